@@ -2,6 +2,16 @@ import { supabase } from '@/integrations/supabase/client';
 import { PatientDocument } from '@/types/documents';
 import { logger } from '@/utils/logger';
 
+const MAX_CHUNK_RETRIES = 3;
+// Hashing needs the whole file in memory, so only smaller files announce a hash for dedup
+const MAX_HASHED_BYTES = 64 * 1024 * 1024;
+
+async function sha256Hex(file: File): Promise<string | undefined> {
+  if (file.size > MAX_HASHED_BYTES || !crypto?.subtle) return undefined;
+  const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+}
+
 export const documentService = {
   async getDocuments(): Promise<PatientDocument[]> {
     try {
@@ -32,27 +42,53 @@ export const documentService = {
         throw new Error("Usuário não autenticado");
       }
 
-      const formData = new FormData();
-      formData.append('file', file);
-      formData.append('documentName', documentName);
-      formData.append('documentType', documentType);
-
-      const { data, error } = await supabase.functions.invoke('upload-document', {
-        body: formData,
-        headers: {
-          Authorization: `Bearer ${session.access_token}`,
+      const headers = { Authorization: `Bearer ${session.access_token}` };
+      const invoke = async (path: string, options: Parameters<typeof supabase.functions.invoke>[1]) => {
+        const { data, error } = await supabase.functions.invoke(path, {
+          ...options,
+          headers: { ...headers, ...options?.headers },
+        });
+        if (error) throw new Error(`Erro no upload: ${error.message}`);
+        if (!data.success) throw new Error(data.error || 'Erro desconhecido no upload');
+        return data;
+      };
+
+      // Open (or resume) an upload session; an identical file already stored is returned as-is
+      const started = await invoke('upload-document', {
+        method: 'POST',
+        body: {
+          documentName,
+          documentType,
+          contentType: file.type,
+          fileName: file.name,
+          size: file.size,
+          sha256: await sha256Hex(file),
         },
       });
-
-      if (error) {
-        throw new Error(`Erro no upload: ${error.message}`);
+      if (started.document) {
+        return started.document;
       }
 
-      if (!data.success) {
-        throw new Error(data.error || 'Erro desconhecido no upload');
+      // Send the file in chunks; after a failure, ask the server where to resume
+      let upload = started.upload;
+      let failures = 0;
+      while (upload.offset < upload.size) {
+        const chunk = file.slice(upload.offset, upload.offset + upload.chunk_size);
+        try {
+          ({ upload } = await invoke(`upload-document/${upload.id}`, {
+            method: 'PATCH',
+            body: chunk,
+            headers: { 'Content-Type': 'application/octet-stream', 'Upload-Offset': String(upload.offset) },
+          }));
+          failures = 0;
+        } catch (error) {
+          if (++failures > MAX_CHUNK_RETRIES) throw error;
+          ({ upload } = await invoke(`upload-document/${upload.id}`, { method: 'GET' }));
+        }
       }
 
-      return data.document;
+      const { document } = await invoke(`upload-document/${upload.id}/complete`, { method: 'POST' });
+      return document;
     } catch (error) {
       logger.error("Falha no upload de documento", "DocumentService", error);
       throw error;
@@ -332,10 +332,8 @@ class AdvancedLogger {
         const blob = new Blob([JSON.stringify(payload)], { type: 'application/json' });
         navigator.sendBeacon(`${EDGE_FUNCTIONS_URL}/client-logs`, blob);
       } else {
-        // Prefer using Supabase Functions SDK
-        const { error } = await supabase.functions.invoke('client-logs', {
-          body: payload,
-        });
+        // Prefer using Supabase Functions SDK; batches are gzipped when the browser can
+        const { error } = await supabase.functions.invoke('client-logs', await this.encodeBatch(payload));
         if (error) throw error;
       }
     } catch (error) {
@@ -345,6 +343,17 @@ class AdvancedLogger {
     }
   }
 
+  private async encodeBatch(payload: unknown): Promise<{ body: any; headers?: Record<string, string> }> {
+    if (typeof CompressionStream === 'undefined') {
+      return { body: payload };
+    }
+    const stream = new Blob([JSON.stringify(payload)]).stream().pipeThrough(new CompressionStream('gzip'));
+    return {
+      body: await new Response(stream).blob(),
+      headers: { 'Content-Type': 'application/json', 'Content-Encoding': 'gzip' },
+    };
+  }
+
   // Public API
   public async captureException(error: Error, context?: Record<string, any>) {
     await this.ensureInitialized();
@@ -377,7 +386,7 @@ class AdvancedLogger {
     return this.isEnabled;
   }
 
-  public async queryLogs(filters?: { traceId?: string; level?: string; limit?: number }) {
+  public async queryLogs(filters?: { traceId?: string; level?: string; limit?: number; offset?: number }) {
     await this.ensureInitialized();
     if (!this.isEnabled) return null;
     
@@ -388,6 +397,7 @@ class AdvancedLogger {
       if (filters?.traceId) params.set('traceId', filters.traceId);
       if (filters?.level) params.set('level', filters.level);
       if (filters?.limit) params.set('limit', filters.limit.toString());
+      if (filters?.offset) params.set('offset', filters.offset.toString());
       
       const response = await fetch(`${EDGE_FUNCTIONS_URL}/client-logs?${params}`, {
         headers: {
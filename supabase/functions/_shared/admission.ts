@@ -0,0 +1,127 @@
+// Admission control for write endpoints that can be stampeded (e.g. when a
+// popular doctor's calendar opens).
+//
+// Every request must hold one slot per key it touches (caller, doctor). When a
+// key is saturated the request waits in a short FIFO queue; if the queue is full
+// or the wait exceeds the queue-time target, the request is shed with a 429
+// instead of piling up behind the database. Limits are per edge-function
+// isolate, so the effective global limit scales with the number of instances.
+
+export interface AdmissionOptions {
+  concurrency: number;
+  maxQueue: number;
+  maxQueueMs: number;
+}
+
+export type Rejection = 'queue_full' | 'queue_timeout';
+
+interface Waiter {
+  enqueuedAt: number;
+  resolve: (admitted: boolean) => void;
+}
+
+class KeyLimiter {
+  active = 0;
+  readonly waiters: Waiter[] = [];
+
+  constructor(readonly options: AdmissionOptions) {}
+
+  acquire(): Promise<Rejection | null> {
+    if (this.active < this.options.concurrency) {
+      this.active++;
+      return Promise.resolve(null);
+    }
+    if (this.waiters.length >= this.options.maxQueue) {
+      return Promise.resolve('queue_full');
+    }
+
+    return new Promise((resolve) => {
+      const waiter: Waiter = {
+        enqueuedAt: performance.now(),
+        resolve: (admitted) => {
+          clearTimeout(timer);
+          resolve(admitted ? null : 'queue_timeout');
+        },
+      };
+      const timer = setTimeout(() => {
+        const index = this.waiters.indexOf(waiter);
+        if (index !== -1) this.waiters.splice(index, 1);
+        resolve('queue_timeout');
+      }, this.options.maxQueueMs);
+      this.waiters.push(waiter);
+    });
+  }
+
+  release() {
+    this.active--;
+    while (this.waiters.length > 0) {
+      const next = this.waiters.shift()!;
+      // Shed requests that already sat in the queue past the target
+      if (performance.now() - next.enqueuedAt > this.options.maxQueueMs) {
+        next.resolve(false);
+        continue;
+      }
+      this.active++;
+      next.resolve(true);
+      return;
+    }
+  }
+
+  get idle() {
+    return this.active === 0 && this.waiters.length === 0;
+  }
+}
+
+export class AdmissionController {
+  private readonly limiters = new Map<string, KeyLimiter>();
+  // EWMA of admitted service time, used to suggest Retry-After
+  private serviceMs = 100;
+
+  constructor(private readonly optionsFor: (key: string) => AdmissionOptions) {}
+
+  /**
+   * Acquire a slot for every key, in order. Resolves to a release function, or
+   * to a rejection reason when any key is saturated.
+   */
+  async admit(keys: string[]): Promise<{ release: () => void } | { rejected: Rejection; retryAfter: number }> {
+    const held: KeyLimiter[] = [];
+    for (const key of keys) {
+      let limiter = this.limiters.get(key);
+      if (!limiter) {
+        limiter = new KeyLimiter(this.optionsFor(key));
+        this.limiters.set(key, limiter);
+      }
+
+      const rejected = await limiter.acquire();
+      if (rejected) {
+        held.forEach((l) => l.release());
+        this.prune(keys);
+        return { rejected, retryAfter: this.retryAfter(limiter) };
+      }
+      held.push(limiter);
+    }
+
+    const startedAt = performance.now();
+    let released = false;
+    return {
+      release: () => {
+        if (released) return;
+        released = true;
+        this.serviceMs = 0.8 * this.serviceMs + 0.2 * (performance.now() - startedAt);
+        held.forEach((l) => l.release());
+        this.prune(keys);
+      },
+    };
+  }
+
+  private retryAfter(limiter: KeyLimiter): number {
+    const backlog = limiter.active + limiter.waiters.length;
+    return Math.max(1, Math.ceil((backlog * this.serviceMs) / (limiter.options.concurrency * 1000)));
+  }
+
+  private prune(keys: string[]) {
+    for (const key of keys) {
+      if (this.limiters.get(key)?.idle) this.limiters.delete(key);
+    }
+  }
+}
@@ -0,0 +1,174 @@
+// Accept-Encoding negotiation for JSON responses returned by the edge functions.
+//
+// Small bodies are sent as-is: below MIN_COMPRESS_BYTES the framing overhead and
+// CPU time cost more than the bytes saved. Levels are configurable per function
+// through env vars so they can be tuned from testsprite_tests/perf/bench_compression.py.
+// `readJsonBody` covers the other direction, for clients that upload compressed batches.
+import * as zlib from "node:zlib";
+import type { ServerTiming } from "./server-timing.ts";
+
+export const MIN_COMPRESS_BYTES = Number(Deno.env.get('COMPRESSION_MIN_BYTES') ?? 1024);
+const GZIP_LEVEL = Number(Deno.env.get('COMPRESSION_GZIP_LEVEL') ?? 6);
+const BROTLI_QUALITY = Number(Deno.env.get('COMPRESSION_BROTLI_QUALITY') ?? 4);
+const ZSTD_LEVEL = Number(Deno.env.get('COMPRESSION_ZSTD_LEVEL') ?? 3);
+
+type Encoding = 'zstd' | 'br' | 'gzip';
+
+// zstd is only offered when the runtime's node:zlib ships it
+const zstdCompressSync: ((buf: Uint8Array, opts?: unknown) => Uint8Array) | undefined =
+  (zlib as any).zstdCompressSync;
+
+// Preference order when the client weighs several encodings equally
+const SUPPORTED: Encoding[] = zstdCompressSync ? ['zstd', 'br', 'gzip'] : ['br', 'gzip'];
+
+function encodingWeights(acceptEncoding: string): Map<string, number> {
+  const weights = new Map<string, number>();
+  for (const part of acceptEncoding.split(',')) {
+    const [name, ...params] = part.trim().toLowerCase().split(';');
+    if (!name) continue;
+    const q = params.map((p) => p.trim()).find((p) => p.startsWith('q='));
+    weights.set(name, q ? Number(q.slice(2)) || 0 : 1);
+  }
+  return weights;
+}
+
+export function negotiateEncoding(acceptEncoding: string | null): Encoding | null {
+  if (!acceptEncoding) return null;
+
+  const weights = encodingWeights(acceptEncoding);
+  let best: Encoding | null = null;
+  let bestWeight = 0;
+  for (const encoding of SUPPORTED) {
+    const weight = weights.get(encoding) ?? weights.get('*') ?? 0;
+    if (weight > bestWeight) {
+      best = encoding;
+      bestWeight = weight;
+    }
+  }
+  return best;
+}
+
+function compress(body: Uint8Array, encoding: Encoding): Uint8Array {
+  switch (encoding) {
+    case 'zstd':
+      return zstdCompressSync!(body, {
+        params: { [(zlib.constants as any).ZSTD_c_compressionLevel]: ZSTD_LEVEL },
+      });
+    case 'br':
+      return zlib.brotliCompressSync(body, {
+        params: {
+          [zlib.constants.BROTLI_PARAM_QUALITY]: BROTLI_QUALITY,
+          [zlib.constants.BROTLI_PARAM_SIZE_HINT]: body.byteLength,
+        },
+      });
+    case 'gzip':
+      return zlib.gzipSync(body, { level: GZIP_LEVEL });
+  }
+}
+
+/**
+ * Serialize `payload` as JSON and compress it with the best encoding the
+ * client accepts, provided the body is at least MIN_COMPRESS_BYTES long.
+ */
+export function compressedJson(
+  req: Request,
+  payload: unknown,
+  init: { status?: number; headers?: Record<string, string>; timing?: ServerTiming } = {},
+): Response {
+  const headers: Record<string, string> = {
+    'Content-Type': 'application/json',
+    ...init.headers,
+    'Vary': 'Accept-Encoding',
+  };
+  let body: Uint8Array = new TextEncoder().encode(JSON.stringify(payload));
+
+  const encoding = body.byteLength >= MIN_COMPRESS_BYTES
+    ? negotiateEncoding(req.headers.get('Accept-Encoding'))
+    : null;
+
+  if (encoding) {
+    const start = performance.now();
+    body = compress(body, encoding);
+    headers['Content-Encoding'] = encoding;
+    init.timing?.record('compress', performance.now() - start, encoding);
+  }
+  if (init.timing) {
+    Object.assign(headers, init.timing.headers());
+  }
+
+  return new Response(body, { status: init.status ?? 200, headers });
+}
+
+/**
+ * Stream a body (e.g. NDJSON) through gzip when the client accepts it. Unlike
+ * compressedJson the payload is never materialized, so it suits unbounded
+ * exports; CompressionStream only offers gzip/deflate, hence gzip here.
+ */
+export function compressedStream(
+  req: Request,
+  body: ReadableStream<Uint8Array>,
+  init: { status?: number; headers?: Record<string, string> } = {},
+): Response {
+  const headers: Record<string, string> = { ...init.headers, 'Vary': 'Accept-Encoding' };
+  const weights = encodingWeights(req.headers.get('Accept-Encoding') ?? '');
+  if ((weights.get('gzip') ?? weights.get('*') ?? 0) > 0) {
+    body = body.pipeThrough(new CompressionStream('gzip'));
+    headers['Content-Encoding'] = 'gzip';
+  }
+  return new Response(body, { status: init.status ?? 200, headers });
+}
+
+export class RequestBodyError extends Error {
+  constructor(readonly status: number, message: string) {
+    super(message);
+  }
+}
+
+/**
+ * Read a JSON request body sent as-is or with `Content-Encoding: gzip|deflate`.
+ * The body is decompressed as a stream and rejected with 413 once it inflates
+ * past `maxBytes`, so a small compressed upload cannot exhaust the isolate.
+ */
+export async function readJsonBody<T = unknown>(req: Request, maxBytes: number): Promise<T> {
+  const encoding = (req.headers.get('Content-Encoding') ?? 'identity').trim().toLowerCase();
+  if (!['identity', 'gzip', 'deflate'].includes(encoding)) {
+    throw new RequestBodyError(415, `Unsupported Content-Encoding: ${encoding}`);
+  }
+  if (!req.body) {
+    throw new RequestBodyError(400, 'Missing request body');
+  }
+
+  const stream = encoding === 'identity'
+    ? req.body
+    : req.body.pipeThrough(new DecompressionStream(encoding as 'gzip' | 'deflate'));
+  const reader = stream.getReader();
+  const parts: Uint8Array[] = [];
+  let size = 0;
+  try {
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      size += value.byteLength;
+      if (size > maxBytes) {
+        await reader.cancel();
+        throw new RequestBodyError(413, `Request body exceeds ${maxBytes} bytes`);
+      }
+      parts.push(value);
+    }
+  } catch (error) {
+    if (error instanceof RequestBodyError) throw error;
+    throw new RequestBodyError(400, `Malformed ${encoding} body`);
+  }
+
+  const body = new Uint8Array(size);
+  let offset = 0;
+  for (const part of parts) {
+    body.set(part, offset);
+    offset += part.byteLength;
+  }
+  try {
+    return JSON.parse(new TextDecoder().decode(body));
+  } catch {
+    throw new RequestBodyError(400, 'Invalid JSON body');
+  }
+}
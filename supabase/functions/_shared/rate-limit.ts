@@ -0,0 +1,79 @@
+// Per-key token buckets for endpoints that accept unauthenticated traffic
+// (client logs, beacons).
+//
+// Each key (a browser session, an IP) gets `burst` tokens that refill at
+// `ratePerSec`. `take` grants as many of the requested tokens as are available,
+// so a batch can be partially accepted instead of all-or-nothing. Like the
+// admission limits, buckets live in the isolate: the global cap scales with
+// the number of instances.
+
+export interface RateLimitOptions {
+  ratePerSec: number;
+  burst: number;
+  // Upper bound on tracked keys; the least recently used buckets are dropped first
+  maxKeys?: number;
+}
+
+interface Bucket {
+  tokens: number;
+  updatedAt: number;
+}
+
+export class TokenBucketLimiter {
+  // Map iteration order doubles as an LRU list: touched keys are re-inserted at the end
+  private readonly buckets = new Map<string, Bucket>();
+
+  constructor(private readonly options: RateLimitOptions) {}
+
+  /** Consume up to `requested` tokens for `key` and return how many were granted. */
+  take(key: string, requested = 1): number {
+    const now = performance.now();
+    const bucket = this.buckets.get(key) ?? { tokens: this.options.burst, updatedAt: now };
+    this.buckets.delete(key);
+
+    bucket.tokens = Math.min(
+      this.options.burst,
+      bucket.tokens + ((now - bucket.updatedAt) / 1000) * this.options.ratePerSec,
+    );
+    bucket.updatedAt = now;
+
+    const granted = Math.max(0, Math.min(requested, Math.floor(bucket.tokens)));
+    bucket.tokens -= granted;
+    this.buckets.set(key, bucket);
+    this.evict();
+    return granted;
+  }
+
+  /** Seconds until `key` has at least one token again. */
+  retryAfter(key: string): number {
+    const bucket = this.buckets.get(key);
+    if (!bucket || bucket.tokens >= 1) return 0;
+    return Math.max(1, Math.ceil((1 - bucket.tokens) / this.options.ratePerSec));
+  }
+
+  private evict() {
+    const maxKeys = this.options.maxKeys ?? 10_000;
+    for (const key of this.buckets.keys()) {
+      if (this.buckets.size <= maxKeys) break;
+      this.buckets.delete(key);
+    }
+  }
+}
+
+// Proxies in front of the function that append to X-Forwarded-For (the platform
+// gateway). Entries left of theirs are whatever the client sent and can be forged.
+const TRUSTED_PROXY_HOPS = Math.max(1, Number(Deno.env.get('TRUSTED_PROXY_HOPS') ?? 1));
+
+/**
+ * Client address as seen by the outermost trusted proxy: the TRUSTED_PROXY_HOPS-th
+ * X-Forwarded-For entry from the right, so prepending fake entries cannot pick
+ * the bucket a request is charged to.
+ */
+export function clientIp(req: Request): string {
+  const hops = (req.headers.get('x-forwarded-for') ?? '')
+    .split(',')
+    .map((hop) => hop.trim())
+    .filter(Boolean);
+  if (hops.length) return hops[Math.max(0, hops.length - TRUSTED_PROXY_HOPS)];
+  return req.headers.get('x-real-ip') || 'unknown';
+}
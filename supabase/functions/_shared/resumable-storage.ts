@@ -0,0 +1,129 @@
+// Streaming access to Supabase Storage's resumable (TUS) upload endpoint.
+//
+// supabase-js only uploads whole Blobs, which forces an edge function to hold
+// the entire file in memory. These helpers talk TUS directly so request bodies
+// can be piped to Storage chunk by chunk: memory use is bounded by the stream
+// buffers, not by the file size. Storage keeps the authoritative byte offset, so
+// an interrupted chunk is resumed from whatever it actually persisted.
+import { Sha256 } from "./sha256.ts";
+
+const TUS_VERSION = '1.0.0';
+// Storage's resumable endpoint is tuned for 6 MiB parts
+export const RESUMABLE_CHUNK_SIZE = 6 * 1024 * 1024;
+
+function storageUrl(path: string) {
+  return `${Deno.env.get('SUPABASE_URL')}/storage/v1/${path}`;
+}
+
+function serviceHeaders(): Record<string, string> {
+  const key = Deno.env.get('SUPABASE_SERVICE_ROLE_KEY')!;
+  return { Authorization: `Bearer ${key}`, apikey: key };
+}
+
+function encodeMetadata(metadata: Record<string, string>) {
+  return Object.entries(metadata)
+    .map(([key, value]) => `${key} ${btoa(String.fromCharCode(...new TextEncoder().encode(value)))}`)
+    .join(',');
+}
+
+export class StorageError extends Error {
+  constructor(readonly status: number, message: string) {
+    super(message);
+  }
+}
+
+async function ensureOk(response: Response, action: string) {
+  if (!response.ok) {
+    const detail = await response.text().catch(() => '');
+    throw new StorageError(response.status, `${action} failed (${response.status}): ${detail}`);
+  }
+}
+
+/** Open a resumable upload for `bucket/path` and return its TUS URL. */
+export async function createResumableUpload(
+  bucket: string,
+  path: string,
+  size: number,
+  contentType: string,
+): Promise<string> {
+  const endpoint = storageUrl('upload/resumable');
+  const response = await fetch(endpoint, {
+    method: 'POST',
+    headers: {
+      ...serviceHeaders(),
+      'Tus-Resumable': TUS_VERSION,
+      'Upload-Length': String(size),
+      'Upload-Metadata': encodeMetadata({
+        bucketName: bucket,
+        objectName: path,
+        contentType,
+        cacheControl: '3600',
+      }),
+    },
+  });
+  await ensureOk(response, 'Create resumable upload');
+  return new URL(response.headers.get('Location')!, endpoint).toString();
+}
+
+/** Number of bytes Storage has persisted for the upload. */
+export async function resumableOffset(tusUrl: string): Promise<number> {
+  const response = await fetch(tusUrl, {
+    method: 'HEAD',
+    headers: { ...serviceHeaders(), 'Tus-Resumable': TUS_VERSION },
+  });
+  await ensureOk(response, 'Read upload offset');
+  return Number(response.headers.get('Upload-Offset') ?? 0);
+}
+
+/**
+ * Stream `body` to Storage at `offset`. The body is forwarded as it arrives;
+ * nothing beyond the runtime's stream buffers is held. Returns the new offset.
+ */
+export async function appendToResumableUpload(
+  tusUrl: string,
+  offset: number,
+  body: ReadableStream<Uint8Array>,
+): Promise<number> {
+  const response = await fetch(tusUrl, {
+    method: 'PATCH',
+    headers: {
+      ...serviceHeaders(),
+      'Tus-Resumable': TUS_VERSION,
+      'Upload-Offset': String(offset),
+      'Content-Type': 'application/offset+octet-stream',
+    },
+    body,
+    // deno-lint-ignore no-explicit-any
+    duplex: 'half',
+  } as any);
+  await ensureOk(response, 'Append to upload');
+  return Number(response.headers.get('Upload-Offset'));
+}
+
+export async function deleteResumableUpload(tusUrl: string) {
+  const response = await fetch(tusUrl, {
+    method: 'DELETE',
+    headers: { ...serviceHeaders(), 'Tus-Resumable': TUS_VERSION },
+  });
+  // Already finished or expired uploads are gone, which is what we wanted
+  if (response.status !== 404) await ensureOk(response, 'Delete upload');
+  else await response.body?.cancel();
+}
+
+/**
+ * SHA-256 (hex) of a stored object, computed while streaming it back. `hash`
+ * may already cover a prefix of the object; only the bytes after it are read.
+ */
+export async function hashStoredObject(bucket: string, path: string, hash = new Sha256()): Promise<string> {
+  const response = await fetch(storageUrl(`object/authenticated/${bucket}/${path}`), {
+    headers: hash.length > 0 ? { ...serviceHeaders(), Range: `bytes=${hash.length}-` } : serviceHeaders(),
+  });
+  await ensureOk(response, 'Read stored object');
+
+  // A server that ignores Range sends the whole object
+  if (response.status === 200 && hash.length > 0) hash = new Sha256();
+  for await (const part of response.body!) {
+    hash.update(part);
+  }
+  return hash.digestHex();
+}
@@ -0,0 +1,58 @@
+// Server-Timing / request-id helpers shared by the edge functions.
+//
+// Each handler creates one ServerTiming per request, wraps the phases it wants
+// to expose (auth, availability lookup, insert, notification enqueue, ...) with
+// `measure`, and merges `timing.headers()` into every response it returns.
+// Clients (and the testsprite perf scripts) join these spans with their own
+// timings using the `X-Request-Id` header. Browsers only see these headers when
+// the function lists `timingExposeHeaders` in Access-Control-Expose-Headers.
+
+export const REQUEST_ID_HEADER = 'X-Request-Id';
+
+export const timingExposeHeaders = 'Server-Timing, X-Request-Id';
+
+interface TimingEntry {
+  name: string;
+  duration: number;
+  description?: string;
+}
+
+export class ServerTiming {
+  readonly requestId: string;
+  private readonly startedAt: number;
+  private readonly entries: TimingEntry[] = [];
+
+  constructor(req: Request) {
+    // Reuse an upstream id when present so a trace can cross the API gateway
+    this.requestId = req.headers.get(REQUEST_ID_HEADER) || crypto.randomUUID();
+    this.startedAt = performance.now();
+  }
+
+  async measure<T>(name: string, fn: () => Promise<T>, description?: string): Promise<T> {
+    const start = performance.now();
+    try {
+      return await fn();
+    } finally {
+      this.record(name, performance.now() - start, description);
+    }
+  }
+
+  record(name: string, duration: number, description?: string) {
+    this.entries.push({ name, duration, description });
+  }
+
+  headers(): Record<string, string> {
+    const metrics = [
+      ...this.entries,
+      { name: 'total', duration: performance.now() - this.startedAt },
+    ].map(({ name, duration, description }) => {
+      const desc = description ? `;desc="${description.replace(/"/g, "'")}"` : '';
+      return `${name};dur=${duration.toFixed(1)}${desc}`;
+    });
+
+    return {
+      'Server-Timing': metrics.join(', '),
+      [REQUEST_ID_HEADER]: this.requestId,
+    };
+  }
+}
@@ -0,0 +1,189 @@
+// Verified-session cache for authenticated edge functions.
+//
+// Every authenticated request used to call auth.getUser(jwt), a round trip to
+// Supabase Auth, even when the same session had been verified a moment ago.
+// SessionCache keeps the verified user until the token expires or `ttlMs`
+// passes, whichever comes first, so a dashboard polling with one access token
+// is verified once per TTL. Keys are SHA-256 digests of the token (WebCrypto,
+// off the JS thread), so raw tokens are not held in memory. Verifications that
+// do reach Auth run on a bounded pool: a login spike queues behind
+// `concurrency` in-flight calls instead of opening one per request, and
+// concurrent requests carrying the same token share a single verification.
+// A signed-out token can stay accepted for up to `ttlMs`, so keep it short.
+//
+// The pool does not grow without bound when Auth is slow: at most `maxQueue`
+// verifications wait for a slot, and a verification that has not finished
+// within `timeoutMs` (queueing included) gives up. Both come back as an
+// AuthUnavailableError, which handlers answer with 503 rather than 401.
+// Tokens Auth rejected are remembered for `negativeTtlMs`, so a client
+// retrying a bad token does not take a slot on every request.
+
+const envInt = (name: string, fallback: number) => Number(Deno.env.get(name) ?? fallback);
+
+export interface SessionCacheOptions {
+  ttlMs: number;
+  maxEntries: number;
+  concurrency: number;
+  maxQueue: number;
+  timeoutMs: number;
+  negativeTtlMs: number;
+}
+
+interface CachedSession {
+  user: any;
+  expiresAt: number;
+}
+
+interface RejectedToken {
+  error: any;
+  expiresAt: number;
+}
+
+/** Auth could not be asked in time; the token is neither valid nor invalid. */
+export class AuthUnavailableError extends Error {
+  readonly status = 503;
+  readonly retryAfter = 1;
+
+  constructor(message: string) {
+    super(message);
+    this.name = 'AuthUnavailableError';
+  }
+}
+
+async function tokenDigest(jwt: string): Promise<string> {
+  const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(jwt));
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+}
+
+// exp claim in ms; the signature is checked by Auth, this only bounds the cache entry
+function tokenExpiry(jwt: string): number | null {
+  try {
+    const payload = jwt.split('.')[1].replace(/-/g, '+').replace(/_/g, '/');
+    const exp = JSON.parse(atob(payload.padEnd(Math.ceil(payload.length / 4) * 4, '='))).exp;
+    return typeof exp === 'number' ? exp * 1000 : null;
+  } catch {
+    return null;
+  }
+}
+
+// Map iteration order doubles as an LRU list: hits are re-inserted at the end
+function lookup<T extends { expiresAt: number }>(entries: Map<string, T>, key: string): T | undefined {
+  const entry = entries.get(key);
+  if (!entry) return undefined;
+  entries.delete(key);
+  if (entry.expiresAt <= Date.now()) return undefined;
+  entries.set(key, entry);
+  return entry;
+}
+
+function remember<T>(entries: Map<string, T>, key: string, entry: T, maxEntries: number) {
+  entries.set(key, entry);
+  if (entries.size > maxEntries) {
+    entries.delete(entries.keys().next().value);
+  }
+}
+
+export class SessionCache {
+  private readonly sessions = new Map<string, CachedSession>();
+  private readonly rejected = new Map<string, RejectedToken>();
+  private readonly inFlight = new Map<string, Promise<any>>();
+  private readonly waiters: (() => void)[] = [];
+  private active = 0;
+
+  constructor(private readonly options: SessionCacheOptions) {}
+
+  /** Same result shape as `client.auth.getUser(jwt)`; `error` is an AuthUnavailableError when Auth could not answer. */
+  async getUser(client: any, jwt: string): Promise<{ data: { user: any }; error: any }> {
+    const key = await tokenDigest(jwt);
+    const cached = lookup(this.sessions, key);
+    if (cached) {
+      return { data: { user: cached.user }, error: null };
+    }
+    const rejected = lookup(this.rejected, key);
+    if (rejected) {
+      return { data: { user: null }, error: rejected.error };
+    }
+
+    let pending = this.inFlight.get(key);
+    if (!pending) {
+      pending = this.verify(client, jwt, key).finally(() => this.inFlight.delete(key));
+      this.inFlight.set(key, pending);
+    }
+    return await pending;
+  }
+
+  private async verify(client: any, jwt: string, key: string) {
+    let timer: number | undefined;
+    const deadline = new Promise<never>((_, reject) => {
+      timer = setTimeout(
+        () => reject(new AuthUnavailableError(`Session verification timed out after ${this.options.timeoutMs} ms`)),
+        this.options.timeoutMs,
+      );
+    });
+
+    try {
+      const slot = this.acquire();
+      try {
+        await Promise.race([slot, deadline]);
+      } catch (error) {
+        // Give the slot back once it is granted; nobody is waiting for it anymore
+        slot.then(() => this.release(), () => {});
+        throw error;
+      }
+
+      // The slot is held until Auth actually answers, even past the deadline, so
+      // a hung Auth fills the pool and the queue and later requests fail fast
+      const call = Promise.resolve(client.auth.getUser(jwt)).finally(() => this.release());
+      // A call that fails after the deadline won has no one awaiting it
+      call.catch(() => {});
+      const result = await Promise.race([call, deadline]);
+      const user = result.data?.user;
+      if (!result.error && user) {
+        const expiresAt = Math.min(Date.now() + this.options.ttlMs, tokenExpiry(jwt) ?? Infinity);
+        remember(this.sessions, key, { user, expiresAt }, this.options.maxEntries);
+      } else if (this.options.negativeTtlMs > 0 && result.error?.status >= 400 && result.error.status < 500) {
+        // Only Auth's verdict on the token is remembered, not network or server errors
+        const expiresAt = Date.now() + this.options.negativeTtlMs;
+        remember(this.rejected, key, { error: result.error, expiresAt }, this.options.maxEntries);
+      }
+      return result;
+    } catch (error) {
+      if (error instanceof AuthUnavailableError) {
+        return { data: { user: null }, error };
+      }
+      throw error;
+    } finally {
+      clearTimeout(timer);
+    }
+  }
+
+  private acquire(): Promise<void> {
+    if (this.active < this.options.concurrency) {
+      this.active++;
+      return Promise.resolve();
+    }
+    if (this.waiters.length >= this.options.maxQueue) {
+      return Promise.reject(new AuthUnavailableError('Too many session verifications waiting'));
+    }
+    return new Promise((resolve) => this.waiters.push(resolve));
+  }
+
+  private release() {
+    const next = this.waiters.shift();
+    if (next) {
+      next();
+    } else {
+      this.active--;
+    }
+  }
+}
+
+// One cache per isolate, shared by every handler in the function
+export const sessionCache = new SessionCache({
+  ttlMs: envInt('AUTH_SESSION_CACHE_TTL_MS', 30000),
+  maxEntries: envInt('AUTH_SESSION_CACHE_MAX_ENTRIES', 10000),
+  concurrency: envInt('AUTH_VERIFY_CONCURRENCY', 8),
+  maxQueue: envInt('AUTH_VERIFY_MAX_QUEUE', 64),
+  timeoutMs: envInt('AUTH_VERIFY_TIMEOUT_MS', 5000),
+  negativeTtlMs: envInt('AUTH_SESSION_NEGATIVE_TTL_MS', 5000),
+});
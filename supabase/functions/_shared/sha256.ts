@@ -0,0 +1,140 @@
+// SHA-256 whose intermediate state can be saved and restored.
+//
+// WebCrypto and node:crypto only hash a message that is available in one
+// request. Resumable uploads arrive as chunks in separate requests, possibly on
+// different isolates, so the digest of the whole file is built incrementally:
+// each chunk is hashed while it streams through, and the state is stored with
+// the upload session in between (`exportState` / `Sha256.fromState`).
+
+const K = new Uint32Array([
+  0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+  0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+  0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+  0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+  0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+  0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+  0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+  0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+]);
+
+const INITIAL = [0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19];
+
+const rotr = (x: number, n: number) => (x >>> n) | (x << (32 - n));
+
+const toHex = (bytes: Uint8Array) => Array.from(bytes, (b) => b.toString(16).padStart(2, '0')).join('');
+
+function fromHex(hex: string): Uint8Array {
+  const bytes = new Uint8Array(hex.length / 2);
+  for (let i = 0; i < bytes.length; i++) bytes[i] = parseInt(hex.slice(i * 2, i * 2 + 2), 16);
+  return bytes;
+}
+
+export class Sha256 {
+  private readonly h = new Uint32Array(INITIAL);
+  private readonly block = new Uint8Array(64);
+  private readonly w = new Uint32Array(64);
+  private buffered = 0;
+  /** Message bytes hashed so far. */
+  length = 0;
+
+  /** Restore a hash saved with `exportState`. */
+  static fromState(state: string): Sha256 {
+    const [words, length, rest] = state.split(':');
+    const hash = new Sha256();
+    const view = new DataView(fromHex(words).buffer);
+    for (let i = 0; i < 8; i++) hash.h[i] = view.getUint32(i * 4);
+    hash.length = Number(length);
+    const pending = fromHex(rest ?? '');
+    hash.block.set(pending);
+    hash.buffered = pending.length;
+    return hash;
+  }
+
+  /** Compact text form of the state: chaining words, byte count and the partial block. */
+  exportState(): string {
+    const words = new Uint8Array(32);
+    const view = new DataView(words.buffer);
+    for (let i = 0; i < 8; i++) view.setUint32(i * 4, this.h[i]);
+    return `${toHex(words)}:${this.length}:${toHex(this.block.subarray(0, this.buffered))}`;
+  }
+
+  update(data: Uint8Array): this {
+    this.length += data.length;
+    let i = 0;
+    if (this.buffered > 0) {
+      i = Math.min(64 - this.buffered, data.length);
+      this.block.set(data.subarray(0, i), this.buffered);
+      this.buffered += i;
+      if (this.buffered < 64) return this;
+      this.compress(this.block, 0);
+      this.buffered = 0;
+    }
+    for (; i + 64 <= data.length; i += 64) this.compress(data, i);
+    if (i < data.length) {
+      this.block.set(data.subarray(i));
+      this.buffered = data.length - i;
+    }
+    return this;
+  }
+
+  /** Hex digest of everything hashed so far; the hash itself can keep being updated. */
+  digestHex(): string {
+    const padding = (this.buffered < 56 ? 56 : 120) - this.buffered;
+    const tail = new Uint8Array(padding + 8);
+    tail[0] = 0x80;
+    const view = new DataView(tail.buffer);
+    view.setUint32(padding, Math.floor(this.length / 0x20000000));
+    view.setUint32(padding + 4, (this.length * 8) >>> 0);
+
+    const final = Sha256.fromState(this.exportState()).update(tail);
+    const out = new Uint8Array(32);
+    const outView = new DataView(out.buffer);
+    for (let i = 0; i < 8; i++) outView.setUint32(i * 4, final.h[i]);
+    return toHex(out);
+  }
+
+  /** TransformStream that hashes the bytes flowing through it unchanged. */
+  tap(): TransformStream<Uint8Array, Uint8Array> {
+    return new TransformStream({
+      transform: (chunk, controller) => {
+        this.update(chunk);
+        controller.enqueue(chunk);
+      },
+    });
+  }
+
+  private compress(data: Uint8Array, offset: number) {
+    const w = this.w;
+    for (let t = 0; t < 16; t++) {
+      const o = offset + t * 4;
+      w[t] = (data[o] << 24) | (data[o + 1] << 16) | (data[o + 2] << 8) | data[o + 3];
+    }
+    for (let t = 16; t < 64; t++) {
+      const s0 = rotr(w[t - 15], 7) ^ rotr(w[t - 15], 18) ^ (w[t - 15] >>> 3);
+      const s1 = rotr(w[t - 2], 17) ^ rotr(w[t - 2], 19) ^ (w[t - 2] >>> 10);
+      w[t] = w[t - 16] + s0 + w[t - 7] + s1;
+    }
+
+    let [a, b, c, d, e, f, g, h] = this.h;
+    for (let t = 0; t < 64; t++) {
+      const t1 = (h + (rotr(e, 6) ^ rotr(e, 11) ^ rotr(e, 25)) + ((e & f) ^ (~e & g)) + K[t] + w[t]) | 0;
+      const t2 = ((rotr(a, 2) ^ rotr(a, 13) ^ rotr(a, 22)) + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+      h = g;
+      g = f;
+      f = e;
+      e = (d + t1) | 0;
+      d = c;
+      c = b;
+      b = a;
+      a = (t1 + t2) | 0;
+    }
+    this.h[0] += a;
+    this.h[1] += b;
+    this.h[2] += c;
+    this.h[3] += d;
+    this.h[4] += e;
+    this.h[5] += f;
+    this.h[6] += g;
+    this.h[7] += h;
+  }
+}
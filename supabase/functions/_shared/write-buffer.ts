@@ -0,0 +1,99 @@
+// Buffered, asynchronous bulk writes for high-volume append-only tables.
+//
+// Handlers `push` rows and answer immediately; the buffer coalesces rows from
+// many requests into one insert of up to `maxBatch` rows, flushed when full or
+// `flushMs` after the first buffered row. The first push of a batch registers
+// the upcoming flush with EdgeRuntime.waitUntil right away, so the isolate is
+// kept alive through the timer and the write instead of only once the timer
+// fires. A failed insert is retried `maxRetries` times with exponential
+// backoff before its rows are dropped. When the database falls behind and
+// `maxBuffered` rows are pending or being retried, `push` refuses new rows so
+// the caller can shed load instead of growing memory without bound.
+
+export interface WriteBufferOptions {
+  maxBatch: number;
+  flushMs: number;
+  maxBuffered: number;
+  // Retries of a failed insert before its rows are dropped (default 3)
+  maxRetries?: number;
+}
+
+function keepAlive(work: Promise<unknown>) {
+  // deno-lint-ignore no-explicit-any
+  (globalThis as any).EdgeRuntime?.waitUntil(work);
+}
+
+export class WriteBuffer<T> {
+  private pending: T[] = [];
+  private inFlight = 0;
+  private timer: number | null = null;
+  // Settles the promise handed to waitUntil when the scheduled flush was registered
+  private settleScheduled: (() => void) | null = null;
+
+  constructor(
+    private readonly write: (rows: T[]) => Promise<void>,
+    private readonly options: WriteBufferOptions,
+  ) {}
+
+  /** Queue rows for writing. Returns false, queuing nothing, when the buffer is full. */
+  push(rows: T[]): boolean {
+    if (this.pending.length + this.inFlight + rows.length > this.options.maxBuffered) {
+      return false;
+    }
+    this.pending.push(...rows);
+
+    if (this.pending.length >= this.options.maxBatch) {
+      this.flush();
+    } else if (this.timer === null) {
+      keepAlive(new Promise<void>((resolve) => (this.settleScheduled = resolve)));
+      this.timer = setTimeout(() => this.flush(), this.options.flushMs);
+    }
+    return true;
+  }
+
+  get size() {
+    return this.pending.length + this.inFlight;
+  }
+
+  flush(): Promise<void> {
+    if (this.timer !== null) {
+      clearTimeout(this.timer);
+      this.timer = null;
+    }
+    const settleScheduled = this.settleScheduled;
+    this.settleScheduled = null;
+
+    const writes: Promise<void>[] = [];
+    while (this.pending.length > 0) {
+      const batch = this.pending.splice(0, this.options.maxBatch);
+      this.inFlight += batch.length;
+      writes.push(
+        this.writeWithRetry(batch).finally(() => {
+          this.inFlight -= batch.length;
+        }),
+      );
+    }
+
+    const done = Promise.all(writes).then(() => undefined);
+    keepAlive(done);
+    done.then(() => settleScheduled?.());
+    return done;
+  }
+
+  private async writeWithRetry(batch: T[]) {
+    const maxRetries = this.options.maxRetries ?? 3;
+    for (let attempt = 0; ; attempt++) {
+      try {
+        await this.write(batch);
+        return;
+      } catch (error) {
+        if (attempt >= maxRetries) {
+          console.error(`Buffered write of ${batch.length} rows failed ${attempt + 1} times, dropping:`, error);
+          return;
+        }
+        console.warn(`Buffered write of ${batch.length} rows failed, retrying:`, error);
+        await new Promise((resolve) => setTimeout(resolve, this.options.flushMs * 2 ** attempt));
+      }
+    }
+  }
+}
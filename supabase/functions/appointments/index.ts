@@ -0,0 +1,396 @@
+import { serve } from "https://deno.land/std@0.168.0/http/server.ts";
+import { createClient } from "https://esm.sh/@supabase/supabase-js@2";
+import { AdmissionController } from "../_shared/admission.ts";
+import { compressedJson } from "../_shared/compression.ts";
+import { clientIp, TokenBucketLimiter } from "../_shared/rate-limit.ts";
+import { ServerTiming, timingExposeHeaders } from "../_shared/server-timing.ts";
+import { AuthUnavailableError, sessionCache } from "../_shared/session-cache.ts";
+
+const corsHeaders = {
+  'Access-Control-Allow-Origin': '*',
+  'Access-Control-Allow-Headers': 'authorization, x-client-info, apikey, content-type, x-request-id, if-match, if-none-match',
+  'Access-Control-Expose-Headers': `${timingExposeHeaders}, Retry-After, ETag`,
+  'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+};
+
+// Same rules reserve_appointment_slot uses to decide whether a slot is taken
+const ACTIVE_STATUSES = ['scheduled', 'agendada', 'confirmada'];
+const PENDING_STATUSES = ['pending_payment', 'pending'];
+
+interface ConsultaRow {
+  id: number;
+  medico_id: string;
+  paciente_id: string;
+  consultation_date: string;
+  status: string;
+  status_pagamento?: string | null;
+  expires_at?: string | null;
+  notes?: string | null;
+  version: number;
+}
+
+const envInt = (name: string, fallback: number) => Number(Deno.env.get(name) ?? fallback);
+
+const bookingAdmission = new AdmissionController((key) => ({
+  concurrency: key.startsWith('doctor:')
+    ? envInt('ADMISSION_DOCTOR_CONCURRENCY', 4)
+    : envInt('ADMISSION_USER_CONCURRENCY', 50),
+  maxQueue: envInt('ADMISSION_MAX_QUEUE', 20),
+  maxQueueMs: envInt('ADMISSION_MAX_QUEUE_MS', 250),
+}));
+
+// Booking attempts per client IP, checked before the auth round trip so a flood
+// is shed without paying for token verification
+const bookingIpLimiter = new TokenBucketLimiter({
+  ratePerSec: envInt('ADMISSION_IP_RATE_PER_SEC', 100),
+  burst: envInt('ADMISSION_IP_BURST', 200),
+});
+
+function holdsSlot(row: ConsultaRow): boolean {
+  if (ACTIVE_STATUSES.includes(row.status)) return true;
+  const notExpired = !!row.expires_at && new Date(row.expires_at) > new Date();
+  return notExpired && (PENDING_STATUSES.includes(row.status) || row.status_pagamento === 'pendente');
+}
+
+function toAppointment(row: ConsultaRow) {
+  return {
+    id: row.id,
+    doctor_id: row.medico_id,
+    patient_id: row.paciente_id,
+    datetime: row.consultation_date,
+    status: row.status,
+    reason: row.notes ?? null,
+    version: row.version,
+  };
+}
+
+// Strong ETag "<id>.<version>"; consultas.version is bumped by a trigger on every update
+function etagFor(row: ConsultaRow) {
+  return { ETag: `"${row.id}.${row.version}"` };
+}
+
+// Schedules can be read from yesterday up to this many days ahead, the window
+// doctor_schedule_days materializes
+const SCHEDULE_HORIZON_DAYS = 90;
+const DAY_MS = 24 * 60 * 60 * 1000;
+
+// Weak: the same schedule version may be sent gzip-encoded or not
+function scheduleEtag(start: string, days: number, version: number) {
+  return `W/"${start}.${days}.${version}"`;
+}
+
+function versionFromIfMatch(ifMatch: string, row: ConsultaRow): number | null {
+  if (ifMatch.trim() === '*') return row.version;
+  for (const tag of ifMatch.split(',')) {
+    const [id, version] = tag.trim().replace(/^W\//, '').replace(/"/g, '').split('.');
+    if (Number(id) === row.id && Number.isInteger(Number(version))) return Number(version);
+  }
+  return null;
+}
+
+serve(async (req) => {
+  // Handle CORS preflight requests
+  if (req.method === 'OPTIONS') {
+    return new Response(null, { headers: corsHeaders });
+  }
+
+  const timing = new ServerTiming(req);
+  const respond = (body: unknown, status = 200, extraHeaders: Record<string, string> = {}) =>
+    body === null
+      ? new Response(null, { status, headers: { ...corsHeaders, ...extraHeaders, ...timing.headers() } })
+      : compressedJson(req, body, { status, headers: { ...corsHeaders, ...extraHeaders }, timing });
+
+  try {
+    const url = new URL(req.url);
+    const parts = url.pathname.split('/').filter(Boolean);
+    const route = parts.slice(parts.indexOf('appointments') + 1);
+
+    if (req.method === 'POST' && route.length === 0) {
+      const clientIP = clientIp(req);
+      if (bookingIpLimiter.take(clientIP) === 0) {
+        const res = respond({ error: 'Too many booking requests', reason: 'ip' }, 429);
+        res.headers.set('Retry-After', String(bookingIpLimiter.retryAfter(clientIP)));
+        return res;
+      }
+    }
+
+    const supabaseUrl = Deno.env.get('SUPABASE_URL')!;
+    const supabase = createClient(supabaseUrl, Deno.env.get('SUPABASE_SERVICE_ROLE_KEY')!);
+
+    const authHeader = req.headers.get('Authorization');
+    if (!authHeader) {
+      return respond({ error: 'Authorization header missing' }, 401);
+    }
+
+    const { data: { user }, error: authError } = await timing.measure('auth', () =>
+      sessionCache.getUser(supabase, authHeader.replace('Bearer ', ''))
+    );
+    if (authError instanceof AuthUnavailableError) {
+      return respond({ error: 'Authentication temporarily unavailable' }, 503, { 'Retry-After': String(authError.retryAfter) });
+    }
+    if (authError || !user) {
+      return respond({ error: 'Invalid authentication' }, 401);
+    }
+
+    // reserve_appointment_v2 relies on auth.uid(), so bookings go through a user-scoped client
+    const userClient = createClient(supabaseUrl, Deno.env.get('SUPABASE_ANON_KEY')!, {
+      global: { headers: { Authorization: authHeader } },
+    });
+
+    const isSlotTaken = (doctorId: string, datetime: string) =>
+      timing.measure('availability', async () => {
+        const { data, error } = await supabase
+          .from('consultas')
+          .select('id, medico_id, paciente_id, consultation_date, status, status_pagamento, expires_at, version')
+          .eq('medico_id', doctorId)
+          .eq('consultation_date', datetime);
+        if (error) throw error;
+        return ((data || []) as ConsultaRow[]).some(holdsSlot);
+      });
+
+    const loadOwned = (id: number) =>
+      timing.measure('lookup', async () => {
+        const { data, error } = await supabase
+          .from('consultas')
+          .select('*')
+          .eq('id', id)
+          .or(`paciente_id.eq.${user.id},medico_id.eq.${user.id}`)
+          .maybeSingle();
+        if (error) throw error;
+        return data as ConsultaRow | null;
+      });
+
+    // GET /appointments/doctors/{id}/availability?datetime=...
+    if (req.method === 'GET' && route[0] === 'doctors' && route[2] === 'availability') {
+      const datetime = url.searchParams.get('datetime');
+      if (!datetime) {
+        return respond({ error: 'datetime query parameter is required' }, 400);
+      }
+      const taken = await isSlotTaken(route[1], datetime);
+      return respond({ doctor_id: route[1], datetime, available: !taken });
+    }
+
+    // GET /appointments - the caller's appointments, as patient or doctor
+    if (req.method === 'GET' && route.length === 0) {
+      const limit = Math.min(Math.max(parseInt(url.searchParams.get('limit') || '100') || 100, 1), 500);
+      const { data, error } = await timing.measure('lookup', () =>
+        supabase
+          .from('consultas')
+          .select('*')
+          .or(`paciente_id.eq.${user.id},medico_id.eq.${user.id}`)
+          .neq('status', 'cancelada')
+          .order('consultation_date', { ascending: true })
+          .limit(limit)
+      );
+      if (error) throw error;
+      return respond({ appointments: ((data || []) as ConsultaRow[]).map(toAppointment) });
+    }
+
+    // GET /appointments/schedule?start=YYYY-MM-DD&days=7 - the calling doctor's materialized
+    // schedule; polls with If-None-Match cost one version lookup while nothing changed
+    if (req.method === 'GET' && route[0] === 'schedule' && route.length === 1) {
+      const start = url.searchParams.get('start') ?? new Date().toISOString().slice(0, 10);
+      const days = Math.min(Math.max(parseInt(url.searchParams.get('days') || '7') || 7, 1), 31);
+      if (!/^\d{4}-\d{2}-\d{2}$/.test(start) || isNaN(Date.parse(start))) {
+        return respond({ error: 'start must be a date (YYYY-MM-DD)' }, 400);
+      }
+      const today = Date.parse(new Date().toISOString().slice(0, 10));
+      const offsetDays = (Date.parse(start) - today) / DAY_MS;
+      if (offsetDays < -1 || offsetDays + days - 1 > SCHEDULE_HORIZON_DAYS) {
+        return respond({ error: `start must be between yesterday and ${SCHEDULE_HORIZON_DAYS} days ahead, including the days requested` }, 400);
+      }
+      const cacheHeaders = (version: number) => ({
+        ETag: scheduleEtag(start, days, version),
+        'Cache-Control': 'private, no-cache',
+      });
+
+      const ifNoneMatch = req.headers.get('If-None-Match');
+      if (ifNoneMatch) {
+        const { data: version, error } = await timing.measure('version', () =>
+          supabase.rpc('doctor_schedule_version', { p_doctor_id: user.id })
+        );
+        if (error) throw error;
+        if (version === null) {
+          return respond({ error: 'Only doctors have a schedule' }, 403);
+        }
+        const etag = scheduleEtag(start, days, version);
+        if (ifNoneMatch.split(',').some((tag) => tag.trim() === etag || tag.trim() === '*')) {
+          return respond(null, 304, cacheHeaders(version));
+        }
+      }
+
+      const { data: schedule, error } = await timing.measure('schedule', () =>
+        supabase.rpc('get_doctor_schedule_week', { p_doctor_id: user.id, p_start: start, p_days: days })
+      );
+      if (error) throw error;
+      if (schedule === null) {
+        return respond({ error: 'Only doctors have a schedule' }, 403);
+      }
+      return respond(
+        { doctor_id: user.id, start, version: schedule.version, days: schedule.days },
+        200,
+        cacheHeaders(schedule.version),
+      );
+    }
+
+    // POST /appointments
+    if (req.method === 'POST' && route.length === 0) {
+      const body = await req.json();
+      const doctorId = body.doctor_id;
+      const datetime = body.datetime;
+      if (!doctorId || !datetime) {
+        return respond({ error: 'doctor_id and datetime are required' }, 400);
+      }
+
+      // Keys come from the verified caller and the calendar being contended, never
+      // from body fields a client could vary to land in an emptier bucket
+      const admission = await timing.measure('queue', () =>
+        bookingAdmission.admit([`user:${user.id}`, `doctor:${doctorId}`])
+      );
+      if ('rejected' in admission) {
+        const res = respond({ error: 'Too many booking requests', reason: admission.rejected }, 429);
+        res.headers.set('Retry-After', String(admission.retryAfter));
+        return res;
+      }
+
+      try {
+        if (await isSlotTaken(doctorId, datetime)) {
+          return respond({ error: 'Este horário não está mais disponível' }, 409);
+        }
+
+        const { data: reservation, error: rpcError } = await timing.measure('insert', () =>
+          userClient.rpc('reserve_appointment_v2', {
+            p_doctor_id: doctorId,
+            p_appointment_datetime: datetime,
+            p_specialty: body.specialty ?? null,
+            p_family_member_id: body.family_member_id ?? null,
+            p_local_id: body.local_id ?? null,
+          })
+        );
+        if (rpcError) {
+          console.error('reserve_appointment_v2 error:', rpcError);
+          return respond({ error: 'Failed to reserve appointment' }, 500);
+        }
+
+        const result = Array.isArray(reservation) ? reservation[0] : reservation;
+        if (!result?.success) {
+          return respond({ error: result?.message || 'Slot unavailable' }, 409);
+        }
+
+        await timing.measure('notify', async () => {
+          const { error } = await supabase.from('medico_notifications').insert({
+            medico_id: doctorId,
+            type: 'appointment',
+            title: 'Nova consulta agendada',
+            description: `Consulta reservada para ${new Date(datetime).toLocaleString('pt-BR')}`,
+          });
+          if (error) console.warn('Failed to enqueue doctor notification:', error);
+        });
+
+        const created = supabase.from('consultas');
+        const { data: row, error: readError } = body.reason
+          ? await created.update({ notes: body.reason }).eq('id', result.appointment_id).select('*').single()
+          : await created.select('*').eq('id', result.appointment_id).single();
+        if (readError) throw readError;
+
+        return respond(toAppointment(row as ConsultaRow), 201, etagFor(row as ConsultaRow));
+      } finally {
+        admission.release();
+      }
+    }
+
+    const appointmentId = Number(route[0]);
+    if (route.length !== 1 || !Number.isFinite(appointmentId)) {
+      return respond({ error: 'Not found' }, 404);
+    }
+
+    const existing = await loadOwned(appointmentId);
+    if (!existing) {
+      return respond({ error: 'Appointment not found' }, 404);
+    }
+
+    // GET /appointments/{id}
+    if (req.method === 'GET') {
+      if (existing.status === 'cancelada') {
+        return respond({ error: 'Appointment cancelled' }, 410);
+      }
+      return respond(toAppointment(existing), 200, etagFor(existing));
+    }
+
+    // PUT /appointments/{id} - optimistic: If-Match must carry the ETag of the version being edited
+    if (req.method === 'PUT') {
+      const body = await req.json();
+      if (body.datetime !== undefined &&
+        (typeof body.datetime !== 'string' || Number.isNaN(new Date(body.datetime).getTime()))) {
+        return respond({ error: 'datetime must be an ISO 8601 date-time' }, 400);
+      }
+      if (body.reason !== undefined && typeof body.reason !== 'string') {
+        return respond({ error: 'reason must be a string' }, 400);
+      }
+      const ifMatch = req.headers.get('If-Match');
+      const version = ifMatch ? versionFromIfMatch(ifMatch, existing) : existing.version;
+      if (version !== existing.version) {
+        return respond({ error: 'Appointment was modified', version: existing.version }, 412, etagFor(existing));
+      }
+
+      const moved = body.datetime !== undefined &&
+        new Date(body.datetime).getTime() !== new Date(existing.consultation_date).getTime();
+      if (moved) {
+        // Claims the new slot row and moves the appointment (with its new notes, if any)
+        // only if the version still matches
+        const { data, error } = await timing.measure('reschedule', () =>
+          userClient.rpc('reschedule_appointment', {
+            p_appointment_id: existing.id,
+            p_new_datetime: body.datetime,
+            p_expected_version: version,
+            p_notes: body.reason ?? null,
+          })
+        );
+        if (error) throw error;
+
+        const result = Array.isArray(data) ? data[0] : data;
+        if (!result?.success) {
+          const status = result?.reason === 'slot_taken' || result?.reason === 'cancelled' ? 409
+            : result?.reason === 'version_mismatch' ? 412
+            : result?.reason === 'not_found' ? 404
+            : 400;
+          return respond({ error: 'Reschedule rejected', reason: result?.reason, version: result?.version }, status);
+        }
+      } else if (body.reason !== undefined) {
+        const { data: rows, error } = await timing.measure('update', () =>
+          supabase
+            .from('consultas')
+            .update({ notes: body.reason })
+            .eq('id', existing.id)
+            .eq('version', version)
+            .select('id')
+        );
+        if (error) throw error;
+        if (!rows?.length) {
+          return respond({ error: 'Appointment was modified' }, 412);
+        }
+      }
+
+      const updated = await loadOwned(existing.id);
+      return respond(toAppointment(updated!), 200, etagFor(updated!));
+    }
+
+    // DELETE /appointments/{id}
+    if (req.method === 'DELETE') {
+      const { error: cancelError } = await timing.measure('update', () =>
+        supabase.from('consultas').update({ status: 'cancelada' }).eq('id', existing.id)
+      );
+      if (cancelError) {
+        console.error('Appointment cancel error:', cancelError);
+        return respond({ error: 'Failed to cancel appointment' }, 500);
+      }
+      return respond(null, 204);
+    }
+
+    return respond({ error: 'Method not allowed' }, 405);
+
+  } catch (error) {
+    console.error('Error in appointments function:', error);
+    return respond({ error: 'Internal server error' }, 500);
+  }
+});
@@ -1,9 +1,14 @@
 import { serve } from "https://deno.land/std@0.168.0/http/server.ts"
 import { createClient } from 'https://esm.sh/@supabase/supabase-js@2'
+import { compressedJson, readJsonBody, RequestBodyError } from '../_shared/compression.ts'
+import { clientIp, TokenBucketLimiter } from '../_shared/rate-limit.ts'
+import { AuthUnavailableError, sessionCache } from '../_shared/session-cache.ts'
+import { WriteBuffer } from '../_shared/write-buffer.ts'
 
 const corsHeaders = {
   'Access-Control-Allow-Origin': '*',
-  'Access-Control-Allow-Headers': 'authorization, x-client-info, apikey, content-type',
+  'Access-Control-Allow-Headers': 'authorization, x-client-info, apikey, content-type, content-encoding',
+  'Access-Control-Expose-Headers': 'Retry-After',
 }
 
 // Allowlist of emails that can use advanced logging (replace with your actual email)
@@ -12,6 +17,72 @@ const ALLOWED_EMAILS = [
   // 'your-email@example.com',
 ]
 
+// Decompressed size cap for one upload and events accepted per batch
+const MAX_BODY_BYTES = Number(Deno.env.get('CLIENT_LOGS_MAX_BODY_BYTES') ?? 1_000_000)
+const MAX_EVENTS_PER_BATCH = 500
+// Share of browser sessions whose debug/info/log events are kept; warn and error are always kept
+const SAMPLE_RATE = Number(Deno.env.get('CLIENT_LOGS_SAMPLE_RATE') ?? 0.2)
+const ALWAYS_KEPT_LEVELS = ['warn', 'error']
+const MAX_PAGE_SIZE = 500
+
+const supabaseClient = createClient(
+  Deno.env.get('SUPABASE_URL') ?? '',
+  Deno.env.get('SUPABASE_SERVICE_ROLE_KEY') ?? ''
+)
+
+// Events per second a signed-in user may store, with room for one full batch
+const userLimiter = new TokenBucketLimiter({
+  ratePerSec: Number(Deno.env.get('CLIENT_LOGS_RATE_PER_SEC') ?? 2),
+  burst: Number(Deno.env.get('CLIENT_LOGS_BURST') ?? 100),
+})
+// Anonymous beacons are limited per IP, which every browser behind one NAT
+// (a clinic, an office) shares, so that bucket is several users wide
+const ipLimiter = new TokenBucketLimiter({
+  ratePerSec: Number(Deno.env.get('CLIENT_LOGS_IP_RATE_PER_SEC') ?? 20),
+  burst: Number(Deno.env.get('CLIENT_LOGS_IP_BURST') ?? 500),
+})
+
+// Rows from many requests are coalesced into a few large inserts after the response
+const logBuffer = new WriteBuffer<Record<string, unknown>>(async (rows) => {
+  const { error } = await supabaseClient.from('client_logs').insert(rows)
+  if (error) throw error
+}, {
+  maxBatch: Number(Deno.env.get('CLIENT_LOGS_FLUSH_ROWS') ?? 1000),
+  flushMs: Number(Deno.env.get('CLIENT_LOGS_FLUSH_MS') ?? 250),
+  maxBuffered: Number(Deno.env.get('CLIENT_LOGS_MAX_BUFFERED') ?? 20_000),
+  maxRetries: Number(Deno.env.get('CLIENT_LOGS_FLUSH_RETRIES') ?? 3),
+})
+
+// Head-based sampling: a caller is either fully kept or fully dropped, so the
+// stored breadcrumbs of a kept session stay complete
+function callerSampled(callerKey: string): boolean {
+  if (SAMPLE_RATE >= 1) return true
+  let hash = 0x811c9dc5
+  for (let i = 0; i < callerKey.length; i++) {
+    hash = Math.imul(hash ^ callerKey.charCodeAt(i), 0x01000193)
+  }
+  return (hash >>> 0) / 0x100000000 < SAMPLE_RATE
+}
+
+// Rate limiting and sampling are keyed on identities the server establishes.
+// sessionId comes from the request body, so a client rotating it would get a
+// fresh budget and pick its own sample; it is only stored with the rows.
+async function callerKey(req: Request, clientIP: string): Promise<string> {
+  const authHeader = req.headers.get('authorization')
+  if (authHeader?.startsWith('Bearer ')) {
+    const { data: { user } } = await sessionCache.getUser(supabaseClient, authHeader.replace('Bearer ', ''))
+    if (user) return `user:${user.id}`
+  }
+  return `ip:${clientIP}`
+}
+
+function jsonResponse(body: unknown, status = 200, extraHeaders: Record<string, string> = {}) {
+  return new Response(JSON.stringify(body), {
+    status,
+    headers: { ...corsHeaders, 'Content-Type': 'application/json', ...extraHeaders },
+  })
+}
+
 serve(async (req) => {
   // Handle CORS preflight requests
   if (req.method === 'OPTIONS') {
@@ -19,27 +90,40 @@ serve(async (req) => {
   }
 
   try {
-    const supabaseClient = createClient(
-      Deno.env.get('SUPABASE_URL') ?? '',
-      Deno.env.get('SUPABASE_SERVICE_ROLE_KEY') ?? ''
-    )
-
     if (req.method === 'POST') {
-      // Receive and store client logs
-      const { events, sentAt, client } = await req.json()
-      
-      if (!events || !Array.isArray(events)) {
-        return new Response(JSON.stringify({ error: 'Invalid payload' }), {
-          status: 400,
-          headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-        })
+      // Receive client logs, optionally gzip/deflate compressed
+      let payload: any
+      try {
+        payload = await readJsonBody(req, MAX_BODY_BYTES)
+      } catch (error) {
+        if (error instanceof RequestBodyError) {
+          return jsonResponse({ error: error.message }, error.status)
+        }
+        throw error
+      }
+      const { events, client } = payload ?? {}
+
+      if (!events || !Array.isArray(events) || events.length > MAX_EVENTS_PER_BATCH) {
+        return jsonResponse({ error: 'Invalid payload' }, 400)
       }
 
-      // Basic rate limiting by IP
-      const clientIP = req.headers.get('x-forwarded-for') || req.headers.get('x-real-ip') || 'unknown'
-      
-      // Process and store logs
-      const logsToInsert = events.map((event: any) => ({
+      const clientIP = clientIp(req)
+      const clientKey = await callerKey(req, clientIP)
+      const limiter = clientKey.startsWith('user:') ? userLimiter : ipLimiter
+
+      // Sample before rate limiting so dropped debug noise does not use up the caller's budget
+      const keepAll = callerSampled(clientKey)
+      const sampled = keepAll ? events : events.filter((event: any) => ALWAYS_KEPT_LEVELS.includes(event.level))
+      const granted = limiter.take(clientKey, sampled.length)
+      const kept = sampled.slice(0, granted)
+      const rateLimited = sampled.length - kept.length
+
+      if (kept.length === 0 && rateLimited > 0) {
+        return jsonResponse({ error: 'Rate limit exceeded', dropped: rateLimited }, 429,
+          { 'Retry-After': String(limiter.retryAfter(clientKey)) })
+      }
+
+      const logsToInsert = kept.map((event: any) => ({
         trace_id: event.traceId || event.sessionId,
         session_id: event.sessionId,
         user_id: event.userId || null,
@@ -55,83 +139,74 @@ serve(async (req) => {
           rawArgs: event.rawArgs,
           breadcrumbs: event.breadcrumbs,
           clientInfo: client,
-          ip: clientIP
+          ip: clientIP,
+          // Lets counts over sampled levels be scaled back up when analysing
+          sample_rate: keepAll || ALWAYS_KEPT_LEVELS.includes(event.level) ? 1 : SAMPLE_RATE
         },
         performance_data: event.performanceData || null
       }))
 
-      const { error } = await supabaseClient
-        .from('client_logs')
-        .insert(logsToInsert)
-
-      if (error) {
-        console.error('Error storing logs:', error)
-        return new Response(JSON.stringify({ error: 'Failed to store logs' }), {
-          status: 500,
-          headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-        })
+      // Writes happen after the response; a full buffer means the database is behind
+      if (!logBuffer.push(logsToInsert)) {
+        console.warn('Client log buffer full, shedding batch of', logsToInsert.length)
+        return jsonResponse({ error: 'Log ingestion overloaded' }, 503, { 'Retry-After': '1' })
       }
 
-      return new Response(JSON.stringify({ 
-        success: true, 
-        stored: events.length,
+      return jsonResponse({
+        success: true,
+        accepted: logsToInsert.length,
+        sampled_out: events.length - sampled.length,
+        rate_limited: rateLimited,
         timestamp: new Date().toISOString()
-      }), {
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-      })
+      }, 202)
     }
 
     if (req.method === 'GET') {
       // Query logs (restricted access)
-      const url = new URL(req.request.url)
+      const url = new URL(req.url)
       const traceId = url.searchParams.get('traceId')
       const level = url.searchParams.get('level')
-      const limit = parseInt(url.searchParams.get('limit') || '100')
+      const limit = Math.min(Math.max(parseInt(url.searchParams.get('limit') || '100') || 100, 1), MAX_PAGE_SIZE)
+      const offset = Math.max(parseInt(url.searchParams.get('offset') || '0') || 0, 0)
 
       // Get JWT from Authorization header
       const authHeader = req.headers.get('authorization')
       if (!authHeader || !authHeader.startsWith('Bearer ')) {
-        return new Response(JSON.stringify({ error: 'Unauthorized' }), {
-          status: 401,
-          headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-        })
+        return jsonResponse({ error: 'Unauthorized' }, 401)
       }
 
       const jwt = authHeader.replace('Bearer ', '')
-      
+
       // Verify JWT and check allowlist
-      const { data: { user }, error: authError } = await supabaseClient.auth.getUser(jwt)
-      
+      const { data: { user }, error: authError } = await sessionCache.getUser(supabaseClient, jwt)
+
+      if (authError instanceof AuthUnavailableError) {
+        return jsonResponse({ error: 'Authentication temporarily unavailable' }, 503, { 'Retry-After': String(authError.retryAfter) })
+      }
       if (authError || !user) {
-        return new Response(JSON.stringify({ error: 'Invalid token' }), {
-          status: 401,
-          headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-        })
+        return jsonResponse({ error: 'Invalid token' }, 401)
       }
 
       // Check if user is in allowlist (either in DB or hardcoded list)
       const { data: allowlistEntry } = await supabaseClient
         .from('debug_allowlist')
-        .select('*')
+        .select('user_id')
         .eq('user_id', user.id)
         .eq('is_active', true)
-        .single()
+        .maybeSingle()
 
       const isAllowed = allowlistEntry || ALLOWED_EMAILS.includes(user.email || '')
 
       if (!isAllowed) {
-        return new Response(JSON.stringify({ error: 'Access denied' }), {
-          status: 403,
-          headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-        })
+        return jsonResponse({ error: 'Access denied' }, 403)
       }
 
-      // Build query
+      // Build query: one page plus the exact number of matching rows
       let query = supabaseClient
         .from('client_logs')
-        .select('*')
+        .select('*', { count: 'exact' })
         .order('timestamp', { ascending: false })
-        .limit(limit)
+        .range(offset, offset + limit - 1)
 
       if (traceId) {
         query = query.eq('trace_id', traceId)
@@ -141,35 +216,28 @@ serve(async (req) => {
         query = query.eq('level', level)
       }
 
-      const { data: logs, error } = await query
+      const { data: logs, count, error } = await query
 
       if (error) {
         console.error('Error querying logs:', error)
-        return new Response(JSON.stringify({ error: 'Failed to query logs' }), {
-          status: 500,
-          headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-        })
+        return jsonResponse({ error: 'Failed to query logs' }, 500)
       }
 
-      return new Response(JSON.stringify({ 
+      const total = count ?? offset + logs.length
+      return compressedJson(req, {
         logs,
-        total: logs.length,
+        total,
+        limit,
+        offset,
+        next_offset: offset + logs.length < total ? offset + logs.length : null,
         timestamp: new Date().toISOString()
-      }), {
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-      })
+      }, { headers: corsHeaders })
     }
 
-    return new Response(JSON.stringify({ error: 'Method not allowed' }), {
-      status: 405,
-      headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-    })
+    return jsonResponse({ error: 'Method not allowed' }, 405)
 
   } catch (error) {
     console.error('Client logs function error:', error)
-    return new Response(JSON.stringify({ error: 'Internal server error' }), {
-      status: 500,
-      headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-    })
+    return jsonResponse({ error: 'Internal server error' }, 500)
   }
-})
\ No newline at end of file
+})
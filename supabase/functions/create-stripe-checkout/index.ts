@@ -187,6 +187,14 @@ serve(async (req) => {
         medico_id: medicoId,
         paciente_id: user.id,
       },
+      // Copiado para o PaymentIntent para que payment_intent.payment_failed identifique a consulta
+      payment_intent_data: {
+        metadata: {
+          consulta_id: consultaId,
+          medico_id: medicoId,
+          paciente_id: user.id,
+        },
+      },
     });
 
     console.log("Sessão de checkout criada:", session.id);
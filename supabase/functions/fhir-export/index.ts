@@ -0,0 +1,231 @@
+import { serve } from "https://deno.land/std@0.168.0/http/server.ts"
+import { createClient } from 'https://esm.sh/@supabase/supabase-js@2'
+import { compressedStream } from '../_shared/compression.ts'
+import { AuthUnavailableError, sessionCache } from '../_shared/session-cache.ts'
+
+const corsHeaders = {
+  'Access-Control-Allow-Origin': '*',
+  'Access-Control-Allow-Headers': 'authorization, x-client-info, apikey, content-type, x-api-key',
+  'Access-Control-Expose-Headers': 'Link, Retry-After',
+}
+
+const RESOURCE_TYPES = ['Patient', 'Observation']
+// Resources converted per database round trip while streaming; bounds memory per response
+const PAGE_SIZE = Number(Deno.env.get('FHIR_EXPORT_PAGE_SIZE') ?? 1000)
+// Resources per response; the rest is reached through the Link: rel="next" cursor
+const DEFAULT_COUNT = 50000
+const MAX_COUNT = 200000
+// Cursors are opaque resource ids (uuid for Patient, bigint for Observation);
+// the database parses them against the resource's own id type
+const CURSOR_PATTERN = /^[0-9A-Za-z-]{1,64}$/
+// Raised by fhir_export_ids for a cursor that is not an id of the resource type
+const INVALID_CURSOR = '22023'
+
+interface ExportScope {
+  p_resource_type: string
+  p_source_id: string | null
+  p_since: string | null
+  p_until: string | null
+}
+
+function outcome(status: number, code: string, diagnostics: string) {
+  return new Response(JSON.stringify({
+    resourceType: 'OperationOutcome',
+    issue: [{ severity: 'error', code, diagnostics }]
+  }), {
+    status,
+    headers: { ...corsHeaders, 'Content-Type': 'application/fhir+json' },
+  })
+}
+
+// Partners authenticate with their data-source API key and only see patients who
+// consented to that source; admins (JWT) export everything
+async function resolveScope(supabaseClient: any, req: Request): Promise<{ sourceId: string | null } | Response> {
+  const apiKey = req.headers.get('x-api-key')
+  if (apiKey) {
+    const { data: source } = await supabaseClient
+      .from('external_data_sources')
+      .select('id')
+      .eq('api_key', apiKey)
+      .eq('is_active', true)
+      .maybeSingle()
+    return source ? { sourceId: source.id } : outcome(401, 'login', 'Invalid API key')
+  }
+
+  const authHeader = req.headers.get('Authorization')
+  if (!authHeader) {
+    return outcome(401, 'login', 'Authorization required')
+  }
+  const { data: { user }, error } = await sessionCache.getUser(supabaseClient, authHeader.replace('Bearer ', ''))
+  if (error instanceof AuthUnavailableError) {
+    const res = outcome(503, 'transient', 'Authentication temporarily unavailable')
+    res.headers.set('Retry-After', String(error.retryAfter))
+    return res
+  }
+  if (error || !user) {
+    return outcome(401, 'login', 'Invalid token')
+  }
+  const { data: profile } = await supabaseClient
+    .from('profiles')
+    .select('user_type')
+    .eq('id', user.id)
+    .maybeSingle()
+  if (profile?.user_type !== 'admin') {
+    return outcome(403, 'forbidden', 'Bulk export requires an admin account or a data-source API key')
+  }
+  return { sourceId: null }
+}
+
+function parseInstant(url: URL, name: string): string | null | undefined {
+  const value = url.searchParams.get(name)
+  if (!value) return null
+  const time = Date.parse(value)
+  return isNaN(time) ? undefined : new Date(time).toISOString()
+}
+
+// NDJSON body that fetches the next page only when the consumer has drained the
+// previous one, so a slow client applies backpressure instead of filling memory
+function exportStream(supabaseClient: any, scope: ExportScope, cursor: string | null, count: number) {
+  const encoder = new TextEncoder()
+  let after = cursor
+  let remaining = count
+
+  return new ReadableStream<Uint8Array>({
+    async pull(controller) {
+      const limit = Math.min(PAGE_SIZE, remaining)
+      const { data: page, error } = await supabaseClient.rpc('fhir_export_page', {
+        ...scope,
+        p_after: after,
+        p_limit: limit,
+      })
+      if (error) {
+        // Aborts the response; clients resume from the last resource id they parsed
+        console.error('FHIR export page failed:', scope.p_resource_type, after, error)
+        controller.error(new Error(error.message))
+        return
+      }
+
+      if (page.length > 0) {
+        controller.enqueue(encoder.encode(page.map((row: any) => JSON.stringify(row.resource)).join('\n') + '\n'))
+        after = page[page.length - 1].id
+        remaining -= page.length
+      }
+      if (page.length < limit || remaining <= 0) {
+        controller.close()
+      }
+    },
+  }, { highWaterMark: 1 })
+}
+
+serve(async (req) => {
+  if (req.method === 'OPTIONS') {
+    return new Response('ok', { headers: corsHeaders })
+  }
+
+  try {
+    const supabaseClient = createClient(
+      Deno.env.get('SUPABASE_URL') ?? '',
+      Deno.env.get('SUPABASE_SERVICE_ROLE_KEY') ?? ''
+    )
+
+    if (req.method !== 'GET') {
+      return outcome(405, 'not-supported', 'Method not allowed')
+    }
+
+    const scope = await resolveScope(supabaseClient, req)
+    if (scope instanceof Response) {
+      return scope
+    }
+
+    const url = new URL(req.url)
+    const parts = url.pathname.split('/').filter(Boolean)
+    const base = [url.origin, ...parts.slice(0, parts.indexOf('fhir-export') + 1)].join('/')
+    const route = parts.slice(parts.indexOf('fhir-export') + 1)
+
+    const since = parseInstant(url, '_since')
+    if (since === undefined) {
+      return outcome(400, 'invalid', '_since must be an instant')
+    }
+
+    // GET /fhir-export/$export - manifest listing one NDJSON stream per type
+    if (route.length === 0 || route[0] === '$export') {
+      const types = (url.searchParams.get('_type') ?? RESOURCE_TYPES.join(',')).split(',').map((t) => t.trim())
+      const unsupported = types.filter((t) => !RESOURCE_TYPES.includes(t))
+      if (unsupported.length > 0) {
+        return outcome(400, 'not-supported', `Unsupported _type: ${unsupported.join(', ')}`)
+      }
+
+      // Every stream is cut at the same instant so the files form one consistent export
+      const transactionTime = new Date().toISOString()
+      const output = types.map((type) => {
+        const params = new URLSearchParams({ _until: transactionTime })
+        if (since) params.set('_since', since)
+        return { type, url: `${base}/${type}?${params}` }
+      })
+
+      return new Response(JSON.stringify({
+        transactionTime,
+        request: req.url,
+        requiresAccessToken: true,
+        output,
+        error: []
+      }), {
+        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
+      })
+    }
+
+    // GET /fhir-export/{Patient|Observation}?cursor=&_count= - one NDJSON page of the export
+    const resourceType = route[0]
+    if (!RESOURCE_TYPES.includes(resourceType)) {
+      return outcome(404, 'not-found', `Unsupported resource type ${resourceType}`)
+    }
+
+    const until = parseInstant(url, '_until')
+    const cursor = url.searchParams.get('cursor')
+    const count = Math.min(parseInt(url.searchParams.get('_count') || String(DEFAULT_COUNT)) || DEFAULT_COUNT, MAX_COUNT)
+    if (until === undefined) {
+      return outcome(400, 'invalid', '_until must be an instant')
+    }
+    if (cursor && !CURSOR_PATTERN.test(cursor)) {
+      return outcome(400, 'invalid', 'cursor must be a resource id from a previous page')
+    }
+    if (count < 1) {
+      return outcome(400, 'invalid', '_count must be positive')
+    }
+
+    const exportScope: ExportScope = {
+      p_resource_type: resourceType,
+      p_source_id: scope.sourceId,
+      p_since: since,
+      p_until: until,
+    }
+
+    // Resolve where this response ends before streaming, so the next cursor can go in a header
+    const { data: nextCursor, error } = await supabaseClient.rpc('fhir_export_next_cursor', {
+      ...exportScope,
+      p_after: cursor,
+      p_count: count,
+    })
+    if (error?.code === INVALID_CURSOR) {
+      return outcome(400, 'invalid', 'cursor must be a resource id from a previous page')
+    }
+    if (error) {
+      console.error('Error resolving FHIR export cursor:', error)
+      return outcome(500, 'exception', 'Internal server error')
+    }
+
+    const headers: Record<string, string> = { ...corsHeaders, 'Content-Type': 'application/fhir+ndjson' }
+    if (nextCursor) {
+      const next = new URL(`${base}/${resourceType}`)
+      url.searchParams.forEach((value, key) => next.searchParams.set(key, value))
+      next.searchParams.set('cursor', nextCursor)
+      headers['Link'] = `<${next}>; rel="next"`
+    }
+
+    return compressedStream(req, exportStream(supabaseClient, exportScope, cursor, count), { headers })
+
+  } catch (error) {
+    console.error('Error in fhir-export function:', error)
+    return outcome(500, 'exception', 'Internal server error')
+  }
+})
@@ -1,6 +1,7 @@
 
 import { serve } from "https://deno.land/std@0.168.0/http/server.ts"
 import { createClient } from 'https://esm.sh/@supabase/supabase-js@2'
+import { compressedJson } from '../_shared/compression.ts'
 
 const corsHeaders = {
   'Access-Control-Allow-Origin': '*',
@@ -98,8 +99,7 @@ serve(async (req) => {
         }))
       }
 
-      return new Response(JSON.stringify(bundle), {
-        status: 200,
+      return compressedJson(req, bundle, {
         headers: { ...corsHeaders, 'Content-Type': 'application/fhir+json' },
       })
     }
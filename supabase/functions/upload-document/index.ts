@@ -1,11 +1,88 @@
 import { serve } from "https://deno.land/std@0.168.0/http/server.ts";
 import { createClient } from "https://esm.sh/@supabase/supabase-js@2";
+import {
+  appendToResumableUpload,
+  createResumableUpload,
+  deleteResumableUpload,
+  hashStoredObject,
+  RESUMABLE_CHUNK_SIZE,
+  resumableOffset,
+  StorageError,
+} from "../_shared/resumable-storage.ts";
+import { AuthUnavailableError, sessionCache } from "../_shared/session-cache.ts";
+import { Sha256 } from "../_shared/sha256.ts";
 
 const corsHeaders = {
   'Access-Control-Allow-Origin': '*',
-  'Access-Control-Allow-Headers': 'authorization, x-client-info, apikey, content-type',
+  'Access-Control-Allow-Headers': 'authorization, x-client-info, apikey, content-type, upload-offset',
+  'Access-Control-Allow-Methods': 'GET, POST, PATCH, DELETE, OPTIONS',
+  'Access-Control-Expose-Headers': 'Location, Upload-Offset, Retry-After',
 };
 
+const BUCKET = 'health-documents';
+const MAX_UPLOAD_BYTES = Number(Deno.env.get('UPLOAD_MAX_BYTES') ?? 1024 * 1024 * 1024);
+// A /complete that crashed after claiming its upload is taken over after this long
+const COMPLETE_CLAIM_TTL_MS = Number(Deno.env.get('UPLOAD_COMPLETE_CLAIM_TTL_MS') ?? 60_000);
+// How long a concurrent /complete waits for the claiming call's result
+const COMPLETE_WAIT_MS = 2_000;
+const ALLOWED_TYPES: Record<string, string> = {
+  'application/pdf': 'pdf',
+  'image/jpeg': 'jpg',
+  'image/jpg': 'jpg',
+  'image/png': 'png',
+};
+
+interface UploadRow {
+  id: string;
+  patient_id: string;
+  document_name: string;
+  document_type: string;
+  content_type: string;
+  size: number;
+  declared_hash: string | null;
+  storage_path: string;
+  tus_url: string;
+  received_bytes: number;
+  hash_state: string | null;
+  status: 'uploading' | 'completing' | 'completed' | 'aborted';
+  document_id: string | null;
+  expires_at: string;
+}
+
+function jsonResponse(body: unknown, status = 200, extraHeaders: Record<string, string> = {}) {
+  return new Response(JSON.stringify(body), {
+    status,
+    headers: { ...corsHeaders, 'Content-Type': 'application/json', ...extraHeaders },
+  });
+}
+
+function uploadState(upload: UploadRow) {
+  return {
+    id: upload.id,
+    size: upload.size,
+    offset: upload.received_bytes,
+    chunk_size: RESUMABLE_CHUNK_SIZE,
+    status: upload.status,
+    expires_at: upload.expires_at,
+  };
+}
+
+// Passes the request body through unchanged, failing the stream if the client
+// sends more than it announced in Content-Length
+function limitBytes(maxBytes: number) {
+  let seen = 0;
+  return new TransformStream<Uint8Array, Uint8Array>({
+    transform(chunk, controller) {
+      seen += chunk.byteLength;
+      if (seen > maxBytes) {
+        controller.error(new Error(`Chunk exceeds announced length of ${maxBytes} bytes`));
+        return;
+      }
+      controller.enqueue(chunk);
+    },
+  });
+}
+
 serve(async (req) => {
   // Handle CORS preflight requests
   if (req.method === 'OPTIONS') {
@@ -20,110 +97,350 @@ serve(async (req) => {
     // Get the authorization header
     const authHeader = req.headers.get('Authorization');
     if (!authHeader) {
-      return new Response(JSON.stringify({ error: 'Authorization header missing' }), {
-        status: 401,
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-      });
+      return jsonResponse({ error: 'Authorization header missing' }, 401);
     }
 
     // Get user from JWT token
-    const { data: { user }, error: authError } = await supabase.auth.getUser(
+    const { data: { user }, error: authError } = await sessionCache.getUser(
+      supabase,
       authHeader.replace('Bearer ', '')
     );
 
+    if (authError instanceof AuthUnavailableError) {
+      return jsonResponse({ error: 'Authentication temporarily unavailable' }, 503, { 'Retry-After': String(authError.retryAfter) });
+    }
     if (authError || !user) {
-      return new Response(JSON.stringify({ error: 'Invalid authentication' }), {
-        status: 401,
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-      });
+      return jsonResponse({ error: 'Invalid authentication' }, 401);
     }
 
-    const formData = await req.formData();
-    const file = formData.get('file') as File;
-    const documentName = formData.get('documentName') as string;
-    const documentType = formData.get('documentType') as string;
+    const url = new URL(req.url);
+    const parts = url.pathname.split('/').filter(Boolean);
+    const route = parts.slice(parts.indexOf('upload-document') + 1);
+
+    const saveOffset = async (upload: UploadRow, offset: number, hashState?: string) => {
+      const { error } = await supabase
+        .from('document_uploads')
+        .update({
+          received_bytes: offset,
+          updated_at: new Date().toISOString(),
+          ...(hashState !== undefined && { hash_state: hashState }),
+        })
+        .eq('id', upload.id);
+      if (error) throw error;
+      upload.received_bytes = offset;
+      if (hashState !== undefined) upload.hash_state = hashState;
+    };
 
-    if (!file || !documentName || !documentType) {
-      return new Response(JSON.stringify({ error: 'Missing required fields' }), {
-        status: 400,
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
+    const uploadHash = (upload: UploadRow) =>
+      upload.hash_state ? Sha256.fromState(upload.hash_state) : new Sha256();
+
+    // POST /upload-document - open an upload session (or short-circuit a duplicate)
+    if (req.method === 'POST' && route.length === 0) {
+      const body = await req.json().catch(() => null);
+      const documentName = body?.documentName;
+      const documentType = body?.documentType;
+      const contentType = body?.contentType;
+      const size = Number(body?.size);
+      const declaredHash = typeof body?.sha256 === 'string' ? body.sha256.toLowerCase() : null;
+
+      if (!documentName || !documentType || !contentType || !Number.isInteger(size) || size <= 0) {
+        return jsonResponse({ error: 'Missing required fields' }, 400);
+      }
+      if (size > MAX_UPLOAD_BYTES) {
+        return jsonResponse({ error: `File size too large (max ${MAX_UPLOAD_BYTES} bytes)` }, 400);
+      }
+      if (!ALLOWED_TYPES[contentType]) {
+        return jsonResponse({ error: 'Invalid file type. Only PDF and images allowed.' }, 400);
+      }
+      if (declaredHash && !/^[0-9a-f]{64}$/.test(declaredHash)) {
+        return jsonResponse({ error: 'sha256 must be a hex SHA-256 digest' }, 400);
+      }
+
+      if (declaredHash) {
+        // Same file already stored for this patient: nothing to transfer
+        const { data: existing } = await supabase
+          .from('patient_documents')
+          .select('*')
+          .eq('patient_id', user.id)
+          .eq('content_hash', declaredHash)
+          .maybeSingle();
+        if (existing) {
+          return jsonResponse({ success: true, deduplicated: true, document: existing });
+        }
+
+        // Same file half-uploaded earlier (page reload, new tab): resume it
+        const { data: pending } = await supabase
+          .from('document_uploads')
+          .select('*')
+          .eq('patient_id', user.id)
+          .eq('declared_hash', declaredHash)
+          .eq('status', 'uploading')
+          .eq('size', size)
+          .gt('expires_at', new Date().toISOString())
+          .order('created_at', { ascending: false })
+          .limit(1)
+          .maybeSingle();
+        if (pending) {
+          await saveOffset(pending, await resumableOffset(pending.tus_url));
+          return jsonResponse({ success: true, upload: uploadState(pending) });
+        }
+      }
+
+      const extension = String(body.fileName ?? '').split('.').pop()?.toLowerCase() || ALLOWED_TYPES[contentType];
+      const storagePath = `${user.id}/${crypto.randomUUID()}.${extension}`;
+      const tusUrl = await createResumableUpload(BUCKET, storagePath, size, contentType);
+
+      const { data: upload, error: insertError } = await supabase
+        .from('document_uploads')
+        .insert({
+          patient_id: user.id,
+          document_name: documentName,
+          document_type: documentType,
+          content_type: contentType,
+          size,
+          declared_hash: declaredHash,
+          storage_path: storagePath,
+          tus_url: tusUrl,
+        })
+        .select()
+        .single();
+
+      if (insertError) {
+        console.error('Failed to open upload session:', insertError);
+        await deleteResumableUpload(tusUrl).catch(() => undefined);
+        return jsonResponse({ error: 'Failed to start upload' }, 500);
+      }
+
+      return jsonResponse({ success: true, upload: uploadState(upload) }, 201, {
+        Location: `${url.origin}${url.pathname.replace(/\/$/, '')}/${upload.id}`,
       });
     }
 
-    // Validate file size (max 10MB)
-    if (file.size > 10 * 1024 * 1024) {
-      return new Response(JSON.stringify({ error: 'File size too large (max 10MB)' }), {
-        status: 400,
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-      });
+    const uploadId = route[0];
+    if (!uploadId) {
+      return jsonResponse({ error: 'Not found' }, 404);
     }
 
-    // Validate file type
-    const allowedTypes = ['application/pdf', 'image/jpeg', 'image/png', 'image/jpg'];
-    if (!allowedTypes.includes(file.type)) {
-      return new Response(JSON.stringify({ error: 'Invalid file type. Only PDF and images allowed.' }), {
-        status: 400,
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-      });
+    const { data: upload, error: lookupError } = await supabase
+      .from('document_uploads')
+      .select('*')
+      .eq('id', uploadId)
+      .eq('patient_id', user.id)
+      .maybeSingle();
+
+    if (lookupError) throw lookupError;
+    if (!upload) {
+      return jsonResponse({ error: 'Upload not found' }, 404);
+    }
+    if (upload.status === 'uploading' && new Date(upload.expires_at) <= new Date()) {
+      return jsonResponse({ error: 'Upload expired', upload: uploadState(upload) }, 410);
     }
 
-    // Generate unique filename
-    const fileExtension = file.name.split('.').pop();
-    const uniqueId = crypto.randomUUID();
-    const filename = `${uniqueId}.${fileExtension}`;
-    const storagePath = `${user.id}/${filename}`;
-
-    // Upload file to storage
-    const { error: uploadError } = await supabase.storage
-      .from('health-documents')
-      .upload(storagePath, file, {
-        cacheControl: '3600',
-        upsert: false
+    // GET /upload-document/{id} - where to resume from
+    if (req.method === 'GET' && route.length === 1) {
+      if (upload.status === 'uploading') {
+        await saveOffset(upload, await resumableOffset(upload.tus_url));
+      }
+      return jsonResponse({ success: true, upload: uploadState(upload) }, 200, {
+        'Upload-Offset': String(upload.received_bytes),
       });
+    }
+
+    // PATCH /upload-document/{id} - append one chunk at Upload-Offset
+    if (req.method === 'PATCH' && route.length === 1) {
+      if (upload.status !== 'uploading') {
+        return jsonResponse({ error: `Upload is ${upload.status}`, upload: uploadState(upload) }, 409);
+      }
+
+      const offset = Number(req.headers.get('Upload-Offset'));
+      const length = Number(req.headers.get('Content-Length'));
+      if (!req.body || !Number.isInteger(length) || length <= 0) {
+        return jsonResponse({ error: 'Content-Length required' }, 411);
+      }
+      if (length > RESUMABLE_CHUNK_SIZE || offset + length > upload.size) {
+        return jsonResponse({ error: `Chunks are at most ${RESUMABLE_CHUNK_SIZE} bytes and must not pass the file size` }, 413);
+      }
 
-    if (uploadError) {
-      console.error('Storage upload error:', uploadError);
-      return new Response(JSON.stringify({ error: 'Failed to upload file' }), {
-        status: 500,
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
+      if (offset !== upload.received_bytes) {
+        // Our copy may be stale after an interrupted chunk; Storage knows the truth
+        await saveOffset(upload, await resumableOffset(upload.tus_url));
+        if (offset !== upload.received_bytes) {
+          await req.body.cancel();
+          return jsonResponse({ error: 'Offset mismatch', upload: uploadState(upload) }, 409, {
+            'Upload-Offset': String(upload.received_bytes),
+          });
+        }
+      }
+
+      // Hash the chunk on its way to Storage. The state only advances when the
+      // chunk was persisted whole; after an interrupted chunk the hash stops at
+      // the gap and /complete reads the rest back from Storage.
+      const hash = uploadHash(upload);
+      const hashing = hash.length === offset;
+      let chunk = req.body.pipeThrough(limitBytes(length));
+      if (hashing) chunk = chunk.pipeThrough(hash.tap());
+
+      try {
+        const newOffset = await appendToResumableUpload(upload.tus_url, offset, chunk);
+        await saveOffset(upload, newOffset, hashing && newOffset === offset + length ? hash.exportState() : undefined);
+      } catch (error) {
+        console.error('Chunk upload failed:', uploadId, error);
+        // Part of the chunk may have been persisted; report the real offset to resume from
+        await saveOffset(upload, await resumableOffset(upload.tus_url)).catch(() => undefined);
+        const status = error instanceof StorageError && error.status === 409 ? 409 : 502;
+        return jsonResponse({ error: 'Chunk upload interrupted', upload: uploadState(upload) }, status, {
+          'Upload-Offset': String(upload.received_bytes),
+        });
+      }
+
+      return jsonResponse({ success: true, upload: uploadState(upload) }, 200, {
+        'Upload-Offset': String(upload.received_bytes),
       });
     }
 
-    // Insert document record
-    const { data: document, error: dbError } = await supabase
-      .from('patient_documents')
-      .insert({
-        patient_id: user.id,
-        document_name: documentName,
-        document_type: documentType,
-        storage_path: storagePath
-      })
-      .select()
-      .single();
-
-    if (dbError) {
-      console.error('Database insert error:', dbError);
-      // Clean up uploaded file if DB insert fails
-      await supabase.storage.from('health-documents').remove([storagePath]);
-      return new Response(JSON.stringify({ error: 'Failed to save document record' }), {
-        status: 500,
-        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-      });
+    // POST /upload-document/{id}/complete - verify the bytes and commit the document
+    if (req.method === 'POST' && route.length === 2 && route[1] === 'complete') {
+      const completedDocument = async (documentId: string | null) => {
+        const { data: document } = await supabase
+          .from('patient_documents')
+          .select('*')
+          .eq('id', documentId)
+          .maybeSingle();
+        return jsonResponse({ success: true, document });
+      };
+      if (upload.status === 'completed') {
+        return completedDocument(upload.document_id);
+      }
+      if (upload.status === 'aborted') {
+        return jsonResponse({ error: 'Upload was aborted' }, 409);
+      }
+
+      await saveOffset(upload, await resumableOffset(upload.tus_url));
+      if (upload.received_bytes < upload.size) {
+        return jsonResponse({ error: 'Upload incomplete', upload: uploadState(upload) }, 409, {
+          'Upload-Offset': String(upload.received_bytes),
+        });
+      }
+
+      // Claim the session so concurrent /complete calls do not both insert the
+      // document (and the loser delete the file the winner's row points to)
+      const staleClaim = new Date(Date.now() - COMPLETE_CLAIM_TTL_MS).toISOString();
+      const { data: claimed, error: claimError } = await supabase
+        .from('document_uploads')
+        .update({ status: 'completing', updated_at: new Date().toISOString() })
+        .eq('id', upload.id)
+        .or(`status.eq.uploading,and(status.eq.completing,updated_at.lt.${staleClaim})`)
+        .select('id')
+        .maybeSingle();
+      if (claimError) throw claimError;
+
+      if (!claimed) {
+        // Another call is completing this upload: answer with its result
+        for (let waited = 0; ; waited += 200) {
+          const { data: current, error } = await supabase
+            .from('document_uploads')
+            .select('status, document_id')
+            .eq('id', upload.id)
+            .single();
+          if (error) throw error;
+          if (current.status === 'completed') {
+            return completedDocument(current.document_id);
+          }
+          if (current.status === 'aborted') {
+            return jsonResponse({ error: 'Upload was aborted' }, 409);
+          }
+          if (current.status === 'uploading' || waited >= COMPLETE_WAIT_MS) {
+            // The other call failed and released the session, or is still running
+            return jsonResponse({ error: 'Upload is being completed' }, 409, { 'Retry-After': '1' });
+          }
+          await new Promise((resolve) => setTimeout(resolve, 200));
+        }
+      }
+
+      const finish = async (status: UploadRow['status'], documentId: string | null) => {
+        const { error } = await supabase
+          .from('document_uploads')
+          .update({ status, document_id: documentId, updated_at: new Date().toISOString() })
+          .eq('id', upload.id);
+        if (error) throw error;
+      };
+
+      try {
+        // Normally every chunk was hashed as it arrived; otherwise only the bytes
+        // after the last hashed one are streamed back from Storage
+        const hash = uploadHash(upload);
+        const contentHash = hash.length === upload.size
+          ? hash.digestHex()
+          : await hashStoredObject(BUCKET, upload.storage_path, hash);
+
+        if (upload.declared_hash && upload.declared_hash !== contentHash) {
+          await supabase.storage.from(BUCKET).remove([upload.storage_path]);
+          await finish('aborted', null);
+          return jsonResponse({ error: 'Content hash mismatch', expected: upload.declared_hash, actual: contentHash }, 422);
+        }
+
+        const { data: document, error: dbError } = await supabase
+          .from('patient_documents')
+          .insert({
+            patient_id: user.id,
+            document_name: upload.document_name,
+            document_type: upload.document_type,
+            storage_path: upload.storage_path,
+            content_hash: contentHash,
+            content_type: upload.content_type,
+            file_size: upload.size,
+          })
+          .select()
+          .single();
+
+        if (dbError?.code === '23505') {
+          // The patient already has this exact file: keep one copy, never the one it points to
+          const { data: existing, error: existingError } = await supabase
+            .from('patient_documents')
+            .select('*')
+            .eq('patient_id', user.id)
+            .eq('content_hash', contentHash)
+            .single();
+          if (existingError) throw existingError;
+          if (existing.storage_path !== upload.storage_path) {
+            await supabase.storage.from(BUCKET).remove([upload.storage_path]);
+          }
+          await finish('completed', existing.id);
+          return jsonResponse({ success: true, deduplicated: true, document: existing });
+        }
+        if (dbError) throw dbError;
+
+        await finish('completed', document.id);
+        return jsonResponse({
+          success: true,
+          document,
+          message: 'Document uploaded successfully'
+        }, 201);
+      } catch (error) {
+        // Release the claim; the stored bytes are kept so /complete can be retried
+        await finish('uploading', null).catch(() => {});
+        console.error('Failed to complete upload:', error);
+        return jsonResponse({ error: 'Failed to save document record' }, 500);
+      }
+    }
+
+    // DELETE /upload-document/{id} - abandon an unfinished upload
+    if (req.method === 'DELETE' && route.length === 1) {
+      if (upload.status !== 'uploading') {
+        return jsonResponse({ error: `Upload is ${upload.status}` }, 409);
+      }
+      await deleteResumableUpload(upload.tus_url);
+      await supabase
+        .from('document_uploads')
+        .update({ status: 'aborted', updated_at: new Date().toISOString() })
+        .eq('id', upload.id);
+      return new Response(null, { status: 204, headers: corsHeaders });
     }
 
-    return new Response(JSON.stringify({ 
-      success: true, 
-      document,
-      message: 'Document uploaded successfully' 
-    }), {
-      headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-    });
+    return jsonResponse({ error: 'Method not allowed' }, 405);
 
   } catch (error) {
     console.error('Error in upload-document function:', error);
-    return new Response(JSON.stringify({ error: error.message }), {
-      status: 500,
-      headers: { ...corsHeaders, 'Content-Type': 'application/json' },
-    });
+    return jsonResponse({ error: error.message }, 500);
   }
-});
\ No newline at end of file
+});
@@ -165,91 +165,22 @@ serve(async (req) => {
 
       const targetConsultaId = (session.metadata?.consulta_id || consulta_id) as string;
 
-      // 1) Dual-write: inserir/garantir registro na nova tabela payments
-      try {
-        const { data: existingV2 } = await supabaseClient
-          .from('payments')
-          .select('id')
-          .eq('stripe_session_id', finalSessionId)
-          .limit(1)
-          .single();
-
-        if (!existingV2) {
-          const { error: insertV2Error } = await supabaseClient
-            .from('payments')
-            .insert({
-              consultation_id: targetConsultaId,
-              amount: session.amount_total || 0,
-              currency: session.currency || 'brl',
-              status: 'succeeded',
-              stripe_session_id: finalSessionId,
-              stripe_payment_intent_id: (session.payment_intent as string) || null,
-              customer_email: session.customer_details?.email || session.customer_email || null,
-              customer_name: session.customer_details?.name || null,
-              metadata: session.metadata || null,
-            });
-          if (insertV2Error) {
-            console.warn('Falha ao inserir em payments (v2):', insertV2Error);
-          } else {
-            console.log('Registro criado em payments (v2)');
-          }
-        } else {
-          console.log('Registro já existe em payments (v2)');
-        }
-      } catch (e) {
-        console.warn('Erro não crítico no dual-write para payments (v2):', e);
-      }
-
-      // 2) Manter compatibilidade: registrar em pagamentos (legacy) se não existir
-      const { data: existingPayment } = await supabaseClient
-        .from('pagamentos')
-        .select('*')
-        .eq('gateway_id', finalSessionId)
-        .single();
-
-      if (!existingPayment) {
-        console.log("Registrando novo pagamento (legacy)...");
-        // Buscar dados da consulta para obter IDs necessários
-        const { data: consultaIds } = await supabaseClient
-          .from('consultas')
-          .select('paciente_id, medico_id')
-          .eq('id', targetConsultaId)
-          .single();
-        
-        const { error: paymentError } = await supabaseClient
-          .from('pagamentos')
-          .insert({
-            consulta_id: targetConsultaId,
-            paciente_id: session.metadata?.paciente_id || consultaIds?.paciente_id,
-            medico_id: session.metadata?.medico_id || consultaIds?.medico_id,
-            valor: (session.amount_total || 0) / 100,
-            metodo_pagamento: 'credit_card',
-            gateway_id: finalSessionId,
-            status: 'succeeded',
-            dados_gateway: session
-          });
-
-        if (paymentError && paymentError.code !== '23505') {
-          console.error("Erro ao registrar pagamento (legacy):", paymentError);
-          throw new Error(`Erro ao registrar pagamento: ${paymentError.message}`);
-        }
-      } else {
-        console.log("Pagamento (legacy) já existe no banco");
-      }
-
-      // 3) Atualizar consulta via RPC confirm_appointment_v2
-      console.log("Confirmando consulta via RPC confirm_appointment_v2...");
-      const { data: rpcResult, error: rpcError } = await supabaseClient
-        .rpc('confirm_appointment_v2', {
-          p_appointment_id: targetConsultaId,
-          p_payment_intent_id: (session.payment_intent as string) || ''
+      // payments (v2), pagamentos (legacy) e confirmação da consulta numa única transação;
+      // idempotente com o stripe-webhook, que aplica a mesma sessão pelo evento
+      const { data: processStatus, error: rpcError } = await supabaseClient
+        .rpc('process_stripe_event', {
+          p_event_id: null,
+          p_event_type: 'checkout.session.completed',
+          p_customer: (session.customer as string) || null,
+          p_created: new Date(session.created * 1000).toISOString(),
+          p_object: { ...session, metadata: { ...session.metadata, consulta_id: targetConsultaId } }
         });
 
       if (rpcError) {
-        console.error('Erro na RPC confirm_appointment_v2:', rpcError);
+        console.error('Erro na RPC process_stripe_event:', rpcError);
         throw new Error(`Erro ao confirmar consulta: ${rpcError.message}`);
       }
-      console.log('RPC confirm_appointment_v2 retorno:', rpcResult);
+      console.log('RPC process_stripe_event retorno:', processStatus);
 
       // Buscar consulta atualizada para retornar ao cliente
       const { data: consultaData, error: consultaFetchError } = await supabaseClient
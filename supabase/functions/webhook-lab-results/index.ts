@@ -31,6 +31,22 @@ interface WebhookPayload {
   };
 }
 
+// Rows per bulk insert/upsert round trip
+const WRITE_CHUNK_SIZE = 500;
+// Values per `in.(...)` lookup, keeps the PostgREST URL well under proxy limits
+const LOOKUP_CHUNK_SIZE = 200;
+// Above this many results the request is acknowledged with 202 before ingestion
+const SYNC_RESULT_LIMIT = 200;
+const MAX_REPORTED_ERRORS = 100;
+
+const VALID_STATUSES = ['normal', 'abnormal', 'critical'];
+
+interface IngestionSummary {
+  processed: number;
+  duplicates: number;
+  errors: string[];
+}
+
 serve(async (req) => {
   // Handle CORS preflight requests
   if (req.method === 'OPTIONS') {
@@ -70,127 +86,58 @@ serve(async (req) => {
       });
     }
 
-    // Parse webhook payload
+    // Parse and validate the whole batch before touching the database
     const payload: WebhookPayload = await req.json();
-    console.log('Received webhook from:', dataSource.name, 'with', payload.results.length, 'results');
-
-    const processedResults = [];
-    const errors = [];
-
-    // Process each result
-    for (const result of payload.results) {
-      try {
-        // Find patient by identifier (assuming CPF is stored in profiles)
-        const { data: patient, error: patientError } = await supabase
-          .from('profiles')
-          .select('id, display_name')
-          .or(`email.eq.${result.patient_identifier},display_name.ilike.%${result.patient_name}%`)
-          .single();
-
-        if (patientError || !patient) {
-          console.warn('Patient not found:', result.patient_identifier, result.patient_name);
-          errors.push(`Patient not found: ${result.patient_identifier}`);
-          await logIntegration(supabase, dataSource.id, null, 'data_received', 'failed', 
-            result, 'Patient not found');
-          continue;
-        }
-
-        // Check consent
-        const { data: consent, error: consentError } = await supabase
-          .from('user_consents')
-          .select('status')
-          .eq('patient_id', patient.id)
-          .eq('source_id', dataSource.id)
-          .eq('status', 'granted')
-          .single();
-
-        if (consentError || !consent) {
-          console.warn('No consent found for patient:', patient.id, 'source:', dataSource.id);
-          errors.push(`No consent for patient: ${result.patient_identifier}`);
-          await logIntegration(supabase, dataSource.id, patient.id, 'data_received', 'rejected', 
-            result, 'No valid consent');
-          continue;
-        }
-
-        // Process the lab result - convert to health_metrics format
-        const healthMetric = {
-          patient_id: patient.id,
-          metric_type: mapTestTypeToMetricType(result.test_type),
-          value: {
-            numeric: typeof result.value === 'number' ? result.value : null,
-            text: typeof result.value === 'string' ? result.value : JSON.stringify(result.value),
-            lab_result: {
-              test_name: result.test_name,
-              reference_range: result.reference_range,
-              status: result.status,
-              lab_order_id: result.lab_order_id,
-              notes: result.notes
-            }
-          },
-          unit: result.unit || '',
-          recorded_at: result.collected_at,
-        };
-
-        // Insert health metric
-        const { error: insertError } = await supabase
-          .from('health_metrics')
-          .insert(healthMetric);
-
-        if (insertError) {
-          console.error('Failed to insert health metric:', insertError);
-          errors.push(`Failed to store result for ${result.patient_identifier}: ${insertError.message}`);
-          await logIntegration(supabase, dataSource.id, patient.id, 'data_received', 'failed', 
-            result, insertError.message);
-          continue;
-        }
+    const validationErrors = validatePayload(payload);
+    if (validationErrors.length > 0) {
+      console.warn('Rejected invalid batch from', dataSource.name, validationErrors.length, 'errors');
+      return new Response(JSON.stringify({
+        error: 'Invalid batch',
+        details: validationErrors.slice(0, MAX_REPORTED_ERRORS),
+      }), {
+        status: 400,
+        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
+      });
+    }
 
-        // Also create a document record for the full lab report
-        const documentRecord = {
-          patient_id: patient.id,
-          document_name: `${result.test_name} - ${new Date(result.reported_at).toLocaleDateString('pt-BR')}`,
-          document_type: 'exame_laboratorial',
-          storage_path: '', // Would be filled if we had the actual PDF/report file
-          metadata: {
-            source: dataSource.name,
-            test_type: result.test_type,
-            lab_order_id: result.lab_order_id,
-            imported_via_api: true
-          }
-        };
-
-        // Success log
-        await logIntegration(supabase, dataSource.id, patient.id, 'data_received', 'success', 
-          result, null);
-        
-        processedResults.push({
-          patient_identifier: result.patient_identifier,
-          test_name: result.test_name,
-          status: 'processed'
-        });
+    const batchId = payload.metadata?.batch_id ?? null;
+    console.log('Received webhook from:', dataSource.name, 'batch:', batchId, 'with', payload.results.length, 'results');
 
-        console.log('Successfully processed result for patient:', patient.display_name);
+    // Large batches are acknowledged immediately and ingested in the background;
+    // retries are safe because every result carries an idempotency key
+    if (payload.results.length > SYNC_RESULT_LIMIT) {
+      const ingestion = ingestBatch(supabase, dataSource, payload)
+        .then((summary) => console.log('Background ingestion complete:', { batch_id: batchId, ...summary }))
+        .catch((error) => console.error('Background ingestion failed:', batchId, error));
+      // deno-lint-ignore no-explicit-any
+      (globalThis as any).EdgeRuntime?.waitUntil(ingestion);
 
-      } catch (error) {
-        console.error('Error processing result:', error);
-        errors.push(`Error processing ${result.patient_identifier}: ${error.message}`);
-        await logIntegration(supabase, dataSource.id, null, 'data_received', 'failed', 
-          result, error.message);
-      }
+      return new Response(JSON.stringify({
+        success: true,
+        source: dataSource.name,
+        batch_id: batchId,
+        accepted: payload.results.length,
+        status: 'processing',
+      }), {
+        status: 202,
+        headers: { ...corsHeaders, 'Content-Type': 'application/json' },
+      });
     }
 
-    // Return summary
+    const summary = await ingestBatch(supabase, dataSource, payload);
     const response = {
       success: true,
       source: dataSource.name,
-      processed: processedResults.length,
-      errors: errors.length,
+      batch_id: batchId,
+      processed: summary.processed,
+      duplicates: summary.duplicates,
+      errors: summary.errors.length,
       details: {
-        processed_results: processedResults,
-        errors: errors
+        errors: summary.errors.slice(0, MAX_REPORTED_ERRORS)
       }
     };
 
-    console.log('Webhook processing complete:', response);
+    console.log('Webhook processing complete:', { ...response, details: undefined });
 
     return new Response(JSON.stringify(response), {
       headers: { ...corsHeaders, 'Content-Type': 'application/json' },
@@ -205,6 +152,159 @@ serve(async (req) => {
   }
 });
 
+function validatePayload(payload: WebhookPayload): string[] {
+  if (!payload || !Array.isArray(payload.results)) {
+    return ['results must be an array'];
+  }
+
+  const errors: string[] = [];
+  payload.results.forEach((result, index) => {
+    for (const field of ['patient_identifier', 'test_name', 'test_type', 'collected_at', 'reported_at'] as const) {
+      if (!result?.[field] || typeof result[field] !== 'string') {
+        errors.push(`results[${index}].${field} is required`);
+      }
+    }
+    if (!VALID_STATUSES.includes(result?.status)) {
+      errors.push(`results[${index}].status must be one of ${VALID_STATUSES.join(', ')}`);
+    }
+    if (result?.collected_at && isNaN(Date.parse(result.collected_at))) {
+      errors.push(`results[${index}].collected_at is not a valid timestamp`);
+    }
+  });
+  return errors;
+}
+
+// Idempotency key: the lab's batch plus the fields that identify one result
+function resultKey(sourceId: string, batchId: string | null, result: LabResult): string {
+  return [
+    sourceId,
+    batchId ?? '-',
+    result.lab_order_id ?? '-',
+    result.patient_identifier,
+    result.test_name,
+    result.collected_at,
+  ].join(':');
+}
+
+function chunk<T>(items: T[], size: number): T[][] {
+  const chunks: T[][] = [];
+  for (let i = 0; i < items.length; i += size) {
+    chunks.push(items.slice(i, i + size));
+  }
+  return chunks;
+}
+
+async function lookupIn(supabase: any, table: string, columns: string, column: string, values: string[],
+  apply: (query: any) => any = (query) => query) {
+  const rows: any[] = [];
+  for (const part of chunk(values, LOOKUP_CHUNK_SIZE)) {
+    const { data, error } = await apply(supabase.from(table).select(columns).in(column, part));
+    if (error) throw error;
+    rows.push(...(data || []));
+  }
+  return rows;
+}
+
+async function ingestBatch(
+  supabase: any,
+  dataSource: { id: string; name: string },
+  payload: WebhookPayload
+): Promise<IngestionSummary> {
+  const batchId = payload.metadata?.batch_id ?? null;
+  const errors: string[] = [];
+  const rejectedLogs: any[] = [];
+
+  // Drop results repeated inside the same payload
+  const unique = new Map<string, LabResult>();
+  for (const result of payload.results) {
+    unique.set(resultKey(dataSource.id, batchId, result), result);
+  }
+  let duplicates = payload.results.length - unique.size;
+
+  // Resolve every patient of the batch with a handful of queries instead of one per result
+  const identifiers = [...new Set([...unique.values()].map((r) => r.patient_identifier))];
+  const patientsByKey = new Map<string, { id: string; display_name: string }>();
+  for (const profile of await lookupIn(supabase, 'profiles', 'id, email, display_name', 'email', identifiers)) {
+    patientsByKey.set(profile.email, profile);
+  }
+  const unresolvedNames = [...new Set([...unique.values()]
+    .filter((r) => !patientsByKey.has(r.patient_identifier) && r.patient_name)
+    .map((r) => r.patient_name))];
+  for (const profile of await lookupIn(supabase, 'profiles', 'id, email, display_name', 'display_name', unresolvedNames)) {
+    patientsByKey.set(`name:${profile.display_name}`, profile);
+  }
+
+  const patientIds = [...new Set([...patientsByKey.values()].map((p) => p.id))];
+  const consented = new Set(
+    (await lookupIn(supabase, 'user_consents', 'patient_id', 'patient_id', patientIds,
+      (query) => query.eq('source_id', dataSource.id).eq('status', 'granted')))
+      .map((c) => c.patient_id)
+  );
+
+  const rows: any[] = [];
+  for (const [key, result] of unique) {
+    const patient = patientsByKey.get(result.patient_identifier) ?? patientsByKey.get(`name:${result.patient_name}`);
+    if (!patient) {
+      errors.push(`Patient not found: ${result.patient_identifier}`);
+      rejectedLogs.push(integrationLog(dataSource.id, null, 'failed', result, 'Patient not found'));
+      continue;
+    }
+    if (!consented.has(patient.id)) {
+      errors.push(`No consent for patient: ${result.patient_identifier}`);
+      rejectedLogs.push(integrationLog(dataSource.id, patient.id, 'rejected', result, 'No valid consent'));
+      continue;
+    }
+
+    // Process the lab result - convert to health_metrics format
+    rows.push({
+      external_id: key,
+      patient_id: patient.id,
+      metric_type: mapTestTypeToMetricType(result.test_type),
+      value: {
+        numeric: typeof result.value === 'number' ? result.value : null,
+        text: typeof result.value === 'string' ? result.value : JSON.stringify(result.value),
+        lab_result: {
+          test_name: result.test_name,
+          reference_range: result.reference_range,
+          status: result.status,
+          lab_order_id: result.lab_order_id,
+          notes: result.notes
+        }
+      },
+      unit: result.unit || '',
+      recorded_at: result.collected_at,
+    });
+  }
+
+  // Bulk upsert; rows already ingested by a previous delivery are skipped by the unique index
+  let processed = 0;
+  for (const part of chunk(rows, WRITE_CHUNK_SIZE)) {
+    const { data, error } = await supabase
+      .from('health_metrics')
+      .upsert(part, { onConflict: 'external_id', ignoreDuplicates: true })
+      .select('external_id');
+
+    if (error) {
+      console.error('Failed to insert health metrics chunk:', error);
+      errors.push(`Failed to store ${part.length} results: ${error.message}`);
+      rejectedLogs.push(integrationLog(dataSource.id, null, 'failed',
+        { batch_id: batchId, results: part.length }, error.message));
+      continue;
+    }
+    processed += data?.length ?? 0;
+    duplicates += part.length - (data?.length ?? 0);
+  }
+
+  // One summary row per delivery plus one row per rejected result, written in bulk
+  await logIntegrations(supabase, [
+    integrationLog(dataSource.id, null, errors.length ? 'partial' : 'success',
+      { batch_id: batchId, received: payload.results.length, processed, duplicates }, null),
+    ...rejectedLogs,
+  ]);
+
+  return { processed, duplicates, errors };
+}
+
 // Helper function to map lab test types to our metric types
 function mapTestTypeToMetricType(testType: string): string {
   const mappings: Record<string, string> = {
@@ -230,18 +330,35 @@ async function logIntegration(
   payload: any,
   errorMessage: string | null
 ) {
-  try {
-    await supabase
-      .from('integration_logs')
-      .insert({
-        source_id: sourceId,
-        patient_id: patientId,
-        action,
-        status,
-        payload,
-        error_message: errorMessage
-      });
-  } catch (error) {
-    console.error('Failed to log integration event:', error);
+  await logIntegrations(supabase, [{
+    source_id: sourceId,
+    patient_id: patientId,
+    action,
+    status,
+    payload,
+    error_message: errorMessage
+  }]);
+}
+
+function integrationLog(sourceId: string | null, patientId: string | null, status: string, payload: any,
+  errorMessage: string | null) {
+  return {
+    source_id: sourceId,
+    patient_id: patientId,
+    action: 'data_received',
+    status,
+    payload,
+    error_message: errorMessage
+  };
+}
+
+async function logIntegrations(supabase: any, entries: any[]) {
+  for (const part of chunk(entries, WRITE_CHUNK_SIZE)) {
+    try {
+      const { error } = await supabase.from('integration_logs').insert(part);
+      if (error) console.error('Failed to log integration events:', error);
+    } catch (error) {
+      console.error('Failed to log integration events:', error);
+    }
   }
-}
\ No newline at end of file
+}
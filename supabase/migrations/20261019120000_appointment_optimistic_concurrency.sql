@@ -0,0 +1,318 @@
+-- Optimistic concurrency for consultas and row-level slot claims.
+--
+-- * consultas.version is bumped on every UPDATE; clients send it back as
+--   If-Match so concurrent edits fail with a conflict instead of overwriting.
+-- * appointment_slot_claims holds one row per (medico_id, slot_start). Booking and
+--   rescheduling insert into it, so two clients racing for the same slot collide
+--   on the primary key rather than serializing on a table-wide lock.
+
+BEGIN;
+
+ALTER TABLE public.consultas
+  ADD COLUMN IF NOT EXISTS version integer NOT NULL DEFAULT 1;
+
+CREATE OR REPLACE FUNCTION public.bump_consulta_version()
+RETURNS trigger
+LANGUAGE plpgsql
+SET search_path = ''
+AS $function$
+BEGIN
+    NEW.version := OLD.version + 1;
+    RETURN NEW;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS trigger_bump_consulta_version ON public.consultas;
+CREATE TRIGGER trigger_bump_consulta_version
+  BEFORE UPDATE ON public.consultas
+  FOR EACH ROW
+  EXECUTE FUNCTION public.bump_consulta_version();
+
+-- Same predicate reserve_appointment_slot uses to decide that a slot is taken
+CREATE OR REPLACE FUNCTION public.consulta_holds_slot(p_consulta_id bigint)
+RETURNS boolean
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = ''
+AS $function$
+    SELECT EXISTS (
+        SELECT 1
+        FROM public.consultas c
+        WHERE c.id = p_consulta_id
+          AND (
+            c.status IN ('scheduled', 'agendada', 'confirmada') OR
+            (c.status IN ('pending_payment', 'pending') AND c.expires_at > now()) OR
+            (c.status_pagamento = 'pendente' AND c.expires_at > now())
+          )
+    );
+$function$;
+
+CREATE TABLE IF NOT EXISTS public.appointment_slot_claims (
+  medico_id uuid NOT NULL,
+  slot_start timestamptz NOT NULL,
+  consulta_id bigint NOT NULL REFERENCES public.consultas(id) ON DELETE CASCADE,
+  claimed_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (medico_id, slot_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_appointment_slot_claims_consulta_id
+  ON public.appointment_slot_claims(consulta_id);
+
+-- Only reachable through the SECURITY DEFINER functions below
+ALTER TABLE public.appointment_slot_claims ENABLE ROW LEVEL SECURITY;
+
+-- Backfill claims for appointments that currently hold their slot
+INSERT INTO public.appointment_slot_claims (medico_id, slot_start, consulta_id)
+SELECT DISTINCT ON (c.medico_id, c.consultation_date) c.medico_id, c.consultation_date, c.id
+FROM public.consultas c
+WHERE c.medico_id IS NOT NULL
+  AND c.consultation_date IS NOT NULL
+  AND public.consulta_holds_slot(c.id)
+ORDER BY c.medico_id, c.consultation_date, c.id
+ON CONFLICT DO NOTHING;
+
+-- Cancelling an appointment frees its slot
+CREATE OR REPLACE FUNCTION public.release_cancelled_slot_claim()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = ''
+AS $function$
+BEGIN
+    IF NEW.status IN ('cancelada', 'cancelled') THEN
+        DELETE FROM public.appointment_slot_claims WHERE consulta_id = NEW.id;
+    END IF;
+    RETURN NEW;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS trigger_release_cancelled_slot_claim ON public.consultas;
+CREATE TRIGGER trigger_release_cancelled_slot_claim
+  AFTER UPDATE OF status ON public.consultas
+  FOR EACH ROW
+  EXECUTE FUNCTION public.release_cancelled_slot_claim();
+
+CREATE OR REPLACE FUNCTION public.reserve_appointment_slot(
+    p_doctor_id uuid,
+    p_patient_id uuid,
+    p_family_member_id uuid,
+    p_scheduled_by_id uuid,
+    p_appointment_datetime timestamp with time zone,
+    p_specialty text
+)
+RETURNS TABLE(success boolean, appointment_id bigint, message text)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = ''
+AS $function$
+DECLARE
+    v_slot_available boolean;
+    v_new_appointment_id bigint;
+    v_expiration_time timestamptz := now() + interval '15 minutes';
+    v_patient_name text;
+    v_patient_email text;
+BEGIN
+    IF p_doctor_id IS NULL OR p_patient_id IS NULL THEN
+        RETURN QUERY SELECT FALSE, NULL::bigint, 'IDs de médico e paciente são obrigatórios'::text;
+        RETURN;
+    END IF;
+
+    IF p_appointment_datetime IS NULL OR p_appointment_datetime <= now() THEN
+        RETURN QUERY SELECT FALSE, NULL::bigint, 'Data e horário da consulta inválidos'::text;
+        RETURN;
+    END IF;
+
+    SELECT NOT EXISTS (
+        SELECT 1
+        FROM public.consultas c
+        WHERE c.medico_id = p_doctor_id
+          AND c.consultation_date = p_appointment_datetime
+          AND (
+            c.status IN ('scheduled', 'agendada', 'confirmada') OR
+            (c.status IN ('pending_payment', 'pending') AND c.expires_at > now()) OR
+            (c.status_pagamento = 'pendente' AND c.expires_at > now())
+          )
+    )
+    INTO v_slot_available;
+
+    IF v_slot_available THEN
+        SELECT display_name, email
+        INTO v_patient_name, v_patient_email
+        FROM public.profiles
+        WHERE id = COALESCE(p_family_member_id, p_patient_id)
+        LIMIT 1;
+
+        v_patient_name := COALESCE(v_patient_name, 'Paciente');
+        v_patient_email := COALESCE(v_patient_email, 'contato@agendarbrasil.com');
+
+        INSERT INTO public.consultas (
+            medico_id,
+            paciente_id,
+            paciente_familiar_id,
+            consultation_date,
+            consultation_type,
+            status,
+            status_pagamento,
+            expires_at,
+            patient_name,
+            patient_email,
+            notes
+        )
+        VALUES (
+            p_doctor_id,
+            p_patient_id,
+            p_family_member_id,
+            p_appointment_datetime,
+            COALESCE(p_specialty, 'Consulta Médica'),
+            'agendada',
+            'pendente',
+            v_expiration_time,
+            v_patient_name,
+            v_patient_email,
+            'Consulta agendada via sistema - ' || now()::text
+        )
+        RETURNING id
+        INTO v_new_appointment_id;
+
+        -- Claim the slot row; a concurrent booking of the same slot raises
+        -- unique_violation here and this insert is rolled back by the handler below
+        DELETE FROM public.appointment_slot_claims sc
+        WHERE sc.medico_id = p_doctor_id
+          AND sc.slot_start = p_appointment_datetime
+          AND NOT public.consulta_holds_slot(sc.consulta_id);
+
+        INSERT INTO public.appointment_slot_claims (medico_id, slot_start, consulta_id)
+        VALUES (p_doctor_id, p_appointment_datetime, v_new_appointment_id);
+
+        RETURN QUERY SELECT TRUE, v_new_appointment_id, 'Horário reservado com sucesso'::text;
+    ELSE
+        RETURN QUERY SELECT FALSE, NULL::bigint, 'Este horário não está mais disponível'::text;
+    END IF;
+
+EXCEPTION
+    WHEN unique_violation THEN
+        RETURN QUERY SELECT FALSE, NULL::bigint, 'Este horário já foi ocupado por outro paciente'::text;
+    WHEN foreign_key_violation THEN
+        RETURN QUERY SELECT FALSE, NULL::bigint, 'Dados de médico ou paciente inválidos'::text;
+    WHEN OTHERS THEN
+        INSERT INTO public.security_audit_log (table_name, operation, user_id, changed_data)
+        VALUES (
+            'consultas',
+            'ERROR',
+            auth.uid(),
+            jsonb_build_object(
+                'error', SQLERRM,
+                'doctor_id', p_doctor_id,
+                'patient_id', p_patient_id
+            )
+        );
+
+        RETURN QUERY SELECT FALSE, NULL::bigint, 'Erro interno do sistema. Tente novamente.'::text;
+END;
+$function$;
+
+-- Move an appointment to a new slot if, and only if, the caller saw the latest version.
+-- p_notes, when given, replaces the notes in the same update, so an edit that
+-- moves the appointment and changes its notes applies both or neither
+CREATE OR REPLACE FUNCTION public.reschedule_appointment(
+    p_appointment_id bigint,
+    p_new_datetime timestamp with time zone,
+    p_expected_version integer DEFAULT NULL,
+    p_notes text DEFAULT NULL
+)
+RETURNS TABLE(success boolean, version integer, reason text)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = ''
+AS $function$
+DECLARE
+    v_consulta record;
+    v_updated integer;
+    -- Assigned from text so the sync works whatever type appointments.id has
+    v_appointment_id public.appointments.id%TYPE;
+BEGIN
+    SELECT c.id, c.medico_id, c.consultation_date, c.version, c.status
+    INTO v_consulta
+    FROM public.consultas c
+    WHERE c.id = p_appointment_id
+      AND (c.paciente_id = auth.uid() OR c.medico_id = auth.uid());
+
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT FALSE, NULL::integer, 'not_found'::text;
+        RETURN;
+    END IF;
+
+    IF p_expected_version IS NOT NULL AND v_consulta.version <> p_expected_version THEN
+        RETURN QUERY SELECT FALSE, v_consulta.version, 'version_mismatch'::text;
+        RETURN;
+    END IF;
+
+    IF v_consulta.status IN ('cancelada', 'cancelled') THEN
+        RETURN QUERY SELECT FALSE, v_consulta.version, 'cancelled'::text;
+        RETURN;
+    END IF;
+
+    IF p_new_datetime IS NULL OR p_new_datetime <= now() THEN
+        RETURN QUERY SELECT FALSE, v_consulta.version, 'invalid_datetime'::text;
+        RETURN;
+    END IF;
+
+    BEGIN
+        v_appointment_id := v_consulta.id::text;
+    EXCEPTION
+        -- An id appointments.id cannot hold was never mirrored there
+        WHEN invalid_text_representation THEN
+            v_appointment_id := NULL;
+    END;
+
+    BEGIN
+        DELETE FROM public.appointment_slot_claims sc
+        WHERE sc.medico_id = v_consulta.medico_id
+          AND sc.slot_start = p_new_datetime
+          AND NOT public.consulta_holds_slot(sc.consulta_id);
+
+        INSERT INTO public.appointment_slot_claims (medico_id, slot_start, consulta_id)
+        VALUES (v_consulta.medico_id, p_new_datetime, v_consulta.id);
+
+        UPDATE public.consultas c
+        SET consultation_date = p_new_datetime,
+            notes = COALESCE(p_notes, c.notes)
+        WHERE c.id = v_consulta.id
+          AND c.version = v_consulta.version;
+
+        GET DIAGNOSTICS v_updated = ROW_COUNT;
+        IF v_updated = 0 THEN
+            -- Another writer committed in between; undo the new claim
+            RAISE EXCEPTION USING ERRCODE = 'serialization_failure';
+        END IF;
+
+        DELETE FROM public.appointment_slot_claims sc
+        WHERE sc.consulta_id = v_consulta.id
+          AND sc.slot_start = v_consulta.consultation_date;
+
+        -- reserve_appointment_v2 mirrors the booking into appointments under the
+        -- same id; move that row too, keeping its duration
+        UPDATE public.appointments a
+        SET start_time = p_new_datetime,
+            end_time = p_new_datetime + (a.end_time - a.start_time)
+        WHERE a.id = v_appointment_id;
+    EXCEPTION
+        WHEN unique_violation THEN
+            RETURN QUERY SELECT FALSE, v_consulta.version, 'slot_taken'::text;
+            RETURN;
+        WHEN serialization_failure THEN
+            RETURN QUERY
+            SELECT FALSE, c.version, 'version_mismatch'::text
+            FROM public.consultas c
+            WHERE c.id = v_consulta.id;
+            RETURN;
+    END;
+
+    RETURN QUERY SELECT TRUE, v_consulta.version + 1, NULL::text;
+END;
+$function$;
+
+GRANT EXECUTE ON FUNCTION public.reschedule_appointment(bigint, timestamp with time zone, integer, text) TO authenticated;
+
+COMMIT;
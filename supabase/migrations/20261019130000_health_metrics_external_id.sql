@@ -0,0 +1,9 @@
+-- Idempotency key for results ingested by webhook-lab-results.
+-- The function upserts with ON CONFLICT (external_id) DO NOTHING, so a lab
+-- re-sending a batch (same batch_id + result key) does not duplicate metrics.
+
+ALTER TABLE public.health_metrics
+  ADD COLUMN IF NOT EXISTS external_id text;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_health_metrics_external_id
+  ON public.health_metrics(external_id);
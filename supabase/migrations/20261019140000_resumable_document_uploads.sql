@@ -0,0 +1,57 @@
+-- Resumable, chunked document uploads (upload-document edge function).
+--
+-- * document_uploads tracks an upload session while its bytes are streamed to
+--   Storage through the resumable (TUS) endpoint. The patient_documents row is
+--   only inserted once every byte has arrived.
+-- * patient_documents.content_hash (SHA-256 of the file) lets the function hand
+--   back an existing document instead of storing the same file twice. It is
+--   computed incrementally as chunks arrive (document_uploads.hash_state).
+
+BEGIN;
+
+ALTER TABLE public.patient_documents
+  ADD COLUMN IF NOT EXISTS content_hash text,
+  ADD COLUMN IF NOT EXISTS content_type text,
+  ADD COLUMN IF NOT EXISTS file_size bigint;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_patient_documents_content_hash
+  ON public.patient_documents(patient_id, content_hash)
+  WHERE content_hash IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS public.document_uploads (
+  id uuid NOT NULL DEFAULT gen_random_uuid() PRIMARY KEY,
+  patient_id uuid NOT NULL REFERENCES public.profiles(id) ON DELETE CASCADE,
+  document_name text NOT NULL,
+  document_type text NOT NULL,
+  content_type text NOT NULL,
+  size bigint NOT NULL CHECK (size > 0),
+  -- SHA-256 announced by the client; verified against the stored bytes on completion
+  declared_hash text,
+  storage_path text NOT NULL,
+  tus_url text NOT NULL,
+  received_bytes bigint NOT NULL DEFAULT 0,
+  -- Saved SHA-256 state (_shared/sha256.ts) of the bytes hashed so far while
+  -- chunks streamed through, so /complete does not re-read the whole object
+  hash_state text,
+  -- 'completing' while one /complete call holds the session (see the function)
+  status text NOT NULL DEFAULT 'uploading' CHECK (status IN ('uploading', 'completing', 'completed', 'aborted')),
+  document_id uuid REFERENCES public.patient_documents(id) ON DELETE SET NULL,
+  created_at timestamp with time zone NOT NULL DEFAULT now(),
+  updated_at timestamp with time zone NOT NULL DEFAULT now(),
+  -- Storage discards unfinished resumable uploads after 24 hours
+  expires_at timestamp with time zone NOT NULL DEFAULT now() + interval '24 hours'
+);
+
+CREATE INDEX IF NOT EXISTS idx_document_uploads_resume
+  ON public.document_uploads(patient_id, declared_hash)
+  WHERE status = 'uploading';
+
+ALTER TABLE public.document_uploads ENABLE ROW LEVEL SECURITY;
+
+-- Writes go through the edge function (service role); patients may only read their sessions
+CREATE POLICY "Users can view their own uploads"
+ON public.document_uploads
+FOR SELECT
+USING (auth.uid() = patient_id);
+
+COMMIT;
@@ -0,0 +1,224 @@
+-- Paged source for the fhir-export edge function (FHIR $export-style NDJSON).
+--
+-- fhir_export_page returns one page of resources after a keyset cursor (the
+-- last resource id the client received, as opaque text), converted to FHIR in
+-- the database so a page costs one round trip instead of one RPC per resource.
+-- fhir_export_next_cursor finds where the page of p_count resources ends
+-- without converting anything, so the function can advertise the next cursor
+-- before streaming the body.
+--
+-- p_source_id scopes the export to patients who granted consent to that
+-- external data source; NULL exports everything (admin exports).
+--
+-- Resources are built here from the live columns rather than by
+-- convert_profile_to_fhir_patient / convert_health_metric_to_fhir: those take
+-- uuid ids and read columns (metric_type, value, pacientes.updated_at) the
+-- current tables no longer have.
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS idx_health_metrics_registrado_em
+  ON public.health_metrics(registrado_em);
+
+-- Keyset over the exportable ids of one resource type; LIMIT/OFFSET are applied
+-- inside each query so a page never materializes more than it returns.
+-- Ids travel as text (profiles.id is a uuid, health_metrics.id a bigint), but
+-- the cursor is cast to each table's own id type so the comparison and ORDER BY
+-- stay on the primary key index. Rows come back in keyset order; callers keep
+-- it WITH ORDINALITY rather than sorting the text.
+CREATE OR REPLACE FUNCTION public.fhir_export_ids(
+  p_resource_type text,
+  p_source_id uuid,
+  p_after text,
+  p_since timestamp with time zone,
+  p_until timestamp with time zone,
+  p_offset integer,
+  p_limit integer
+)
+RETURNS TABLE(id text)
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $function$
+DECLARE
+    v_after_profile uuid;
+    v_after_metric bigint;
+BEGIN
+    IF p_resource_type = 'Patient' THEN
+        v_after_profile := p_after;
+        RETURN QUERY
+        SELECT p.id::text
+        FROM public.profiles p
+        WHERE p.user_type = 'paciente'
+          AND (v_after_profile IS NULL OR p.id > v_after_profile)
+          AND (p_since IS NULL OR p.updated_at > p_since)
+          AND (p_until IS NULL OR p.updated_at <= p_until)
+          AND (p_source_id IS NULL OR EXISTS (
+                SELECT 1 FROM public.user_consents uc
+                WHERE uc.patient_id = p.id AND uc.source_id = p_source_id AND uc.status = 'granted'))
+        ORDER BY p.id
+        OFFSET p_offset
+        LIMIT p_limit;
+    ELSIF p_resource_type = 'Observation' THEN
+        v_after_metric := p_after;
+        RETURN QUERY
+        SELECT hm.id::text
+        FROM public.health_metrics hm
+        WHERE (v_after_metric IS NULL OR hm.id > v_after_metric)
+          AND (p_since IS NULL OR hm.registrado_em > p_since)
+          AND (p_until IS NULL OR hm.registrado_em <= p_until)
+          AND (p_source_id IS NULL OR EXISTS (
+                SELECT 1 FROM public.user_consents uc
+                WHERE uc.patient_id = hm.patient_id AND uc.source_id = p_source_id AND uc.status = 'granted'))
+        ORDER BY hm.id
+        OFFSET p_offset
+        LIMIT p_limit;
+    ELSE
+        RAISE EXCEPTION 'Unsupported resource type: %', p_resource_type;
+    END IF;
+EXCEPTION
+    -- A cursor that does not parse as this resource's id type
+    WHEN invalid_text_representation OR numeric_value_out_of_range THEN
+        RAISE EXCEPTION 'Invalid export cursor: %', p_after USING ERRCODE = '22023';
+END;
+$function$;
+
+CREATE OR REPLACE FUNCTION public.fhir_patient_resource(p public.profiles)
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+SET search_path = public
+AS $function$
+    SELECT jsonb_strip_nulls(jsonb_build_object(
+        'resourceType', 'Patient',
+        'id', p.id::text,
+        'active', p.is_active,
+        'name', jsonb_build_array(jsonb_build_object('use', 'official', 'text', p.display_name)),
+        'telecom', jsonb_build_array(jsonb_build_object('system', 'email', 'value', p.email, 'use', 'home')),
+        'birthDate', pac.dados_pessoais ->> 'data_nascimento',
+        'gender', CASE
+                      WHEN pac.found IS NULL THEN NULL
+                      WHEN pac.dados_pessoais ->> 'sexo' = 'masculino' THEN 'male'
+                      WHEN pac.dados_pessoais ->> 'sexo' = 'feminino' THEN 'female'
+                      ELSE 'unknown'
+                  END,
+        'address', CASE WHEN pac.endereco IS NOT NULL THEN jsonb_build_array(jsonb_build_object(
+                       'use', 'home',
+                       'type', 'physical',
+                       'text', COALESCE(pac.endereco ->> 'endereco_completo', ''),
+                       'city', pac.endereco ->> 'cidade',
+                       'state', pac.endereco ->> 'uf',
+                       'postalCode', pac.endereco ->> 'cep',
+                       'country', 'BR'))
+                   END,
+        'meta', jsonb_build_object('lastUpdated', p.updated_at, 'source', '#' || p.id::text)
+    ))
+    FROM (SELECT 1) AS one
+    LEFT JOIN LATERAL (
+        SELECT pc.dados_pessoais, pc.endereco, true AS found
+        FROM public.pacientes pc
+        WHERE pc.user_id = p.id
+        LIMIT 1
+    ) pac ON true;
+$function$;
+
+-- health_metrics keeps one numeric reading per row (tipo / valor / unidade)
+CREATE OR REPLACE FUNCTION public.fhir_observation_resource(m public.health_metrics)
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+SET search_path = public
+AS $function$
+    SELECT jsonb_strip_nulls(jsonb_build_object(
+        'resourceType', 'Observation',
+        'id', m.id::text,
+        'status', 'final',
+        'category', jsonb_build_array(jsonb_build_object('coding', jsonb_build_array(jsonb_build_object(
+            'system', 'http://terminology.hl7.org/CodeSystem/observation-category',
+            'code', 'vital-signs',
+            'display', 'Vital Signs')))),
+        'code', jsonb_build_object('coding', jsonb_build_array(
+            CASE m.tipo
+                WHEN 'blood_pressure' THEN jsonb_build_object('system', 'http://loinc.org', 'code', '85354-9', 'display', 'Blood pressure panel with all children optional')
+                WHEN 'heart_rate' THEN jsonb_build_object('system', 'http://loinc.org', 'code', '8867-4', 'display', 'Heart rate')
+                WHEN 'temperature' THEN jsonb_build_object('system', 'http://loinc.org', 'code', '8310-5', 'display', 'Body temperature')
+                WHEN 'weight' THEN jsonb_build_object('system', 'http://loinc.org', 'code', '29463-7', 'display', 'Body weight')
+                WHEN 'height' THEN jsonb_build_object('system', 'http://loinc.org', 'code', '8302-2', 'display', 'Body height')
+                WHEN 'glucose' THEN jsonb_build_object('system', 'http://loinc.org', 'code', '33747-0', 'display', 'Glucose [Mass/volume] in Blood by Glucometer')
+                WHEN 'oxygen_saturation' THEN jsonb_build_object('system', 'http://loinc.org', 'code', '2708-6', 'display', 'Oxygen saturation in Arterial blood')
+                ELSE jsonb_build_object('system', 'http://terminology.hl7.org/CodeSystem/observation-category', 'code', 'vital-signs', 'display', m.tipo)
+            END)),
+        'subject', jsonb_build_object('reference', 'Patient/' || m.patient_id::text),
+        'effectiveDateTime', m.registrado_em,
+        'valueQuantity', CASE WHEN m.valor IS NOT NULL THEN jsonb_build_object(
+                             'value', m.valor,
+                             'unit', m.unidade,
+                             'system', 'http://unitsofmeasure.org')
+                         END,
+        'meta', jsonb_build_object('lastUpdated', m.registrado_em, 'source', '#' || m.id::text)
+    ));
+$function$;
+
+CREATE OR REPLACE FUNCTION public.fhir_export_page(
+  p_resource_type text,
+  p_source_id uuid,
+  p_after text,
+  p_limit integer,
+  p_since timestamp with time zone,
+  p_until timestamp with time zone
+)
+RETURNS TABLE(id text, resource jsonb)
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $function$
+BEGIN
+    IF p_resource_type = 'Patient' THEN
+        RETURN QUERY
+        SELECT ids.id, public.fhir_patient_resource(p)
+        FROM public.fhir_export_ids(p_resource_type, p_source_id, p_after, p_since, p_until, 0, p_limit)
+             WITH ORDINALITY AS ids(id, n)
+        JOIN public.profiles p ON p.id = ids.id::uuid
+        ORDER BY ids.n;
+    ELSE
+        RETURN QUERY
+        SELECT ids.id, public.fhir_observation_resource(hm)
+        FROM public.fhir_export_ids(p_resource_type, p_source_id, p_after, p_since, p_until, 0, p_limit)
+             WITH ORDINALITY AS ids(id, n)
+        JOIN public.health_metrics hm ON hm.id = ids.id::bigint
+        ORDER BY ids.n;
+    END IF;
+END;
+$function$;
+
+-- Id of the p_count-th resource after p_after, or NULL when nothing follows it
+CREATE OR REPLACE FUNCTION public.fhir_export_next_cursor(
+  p_resource_type text,
+  p_source_id uuid,
+  p_after text,
+  p_count integer,
+  p_since timestamp with time zone,
+  p_until timestamp with time zone
+)
+RETURNS text
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $function$
+    SELECT CASE WHEN count(*) = 2 THEN (array_agg(boundary.id ORDER BY boundary.n))[1] END
+    FROM public.fhir_export_ids(p_resource_type, p_source_id, p_after, p_since, p_until, p_count - 1, 2)
+         WITH ORDINALITY AS boundary(id, n);
+$function$;
+
+-- Exports bypass RLS, so only the service role (the edge function) may call them
+-- (the builders are plain functions of a row, but are only meant for the export)
+REVOKE ALL ON FUNCTION public.fhir_patient_resource(public.profiles) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.fhir_observation_resource(public.health_metrics) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.fhir_export_ids(text, uuid, text, timestamp with time zone, timestamp with time zone, integer, integer) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.fhir_export_page(text, uuid, text, integer, timestamp with time zone, timestamp with time zone) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.fhir_export_next_cursor(text, uuid, text, integer, timestamp with time zone, timestamp with time zone) FROM PUBLIC, anon, authenticated;
+
+COMMIT;
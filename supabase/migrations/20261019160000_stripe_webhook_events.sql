@@ -0,0 +1,193 @@
+-- Exactly-once processing of Stripe webhook events.
+--
+-- Stripe delivers at least once and retries aggressively when the endpoint is
+-- slow, so the same event can arrive several times, concurrently, and out of
+-- order relative to other events of the same customer. stripe_webhook_events
+-- records every event id that was applied; process_stripe_event claims the id
+-- and applies all of the event's effects (payments, pagamentos, consulta
+-- confirmation) in one transaction and one round trip. If anything fails the
+-- claim rolls back with the rest, so Stripe's retry is processed normally.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.stripe_webhook_events (
+  event_id text PRIMARY KEY,
+  event_type text NOT NULL,
+  customer_id text,
+  event_created timestamp with time zone,
+  -- processed | superseded | ignored
+  status text NOT NULL DEFAULT 'processed',
+  received_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+-- Stripe stops retrying after three days; older rows can be pruned by received_at
+CREATE INDEX IF NOT EXISTS idx_stripe_webhook_events_received_at
+  ON public.stripe_webhook_events(received_at);
+
+ALTER TABLE public.stripe_webhook_events ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY stripe_webhook_events_service_role_all
+  ON public.stripe_webhook_events
+  FOR ALL
+  USING (auth.role() = 'service_role')
+  WITH CHECK (auth.role() = 'service_role');
+
+-- Lookups done inside process_stripe_event for every event. pagamentos keeps the
+-- Stripe object in transacao_gateway: a checkout session's id and payment_intent,
+-- or a failed intent's own id.
+CREATE INDEX IF NOT EXISTS idx_pagamentos_gateway_id ON public.pagamentos((transacao_gateway->>'id'));
+CREATE INDEX IF NOT EXISTS idx_pagamentos_payment_intent ON public.pagamentos((transacao_gateway->>'payment_intent'));
+CREATE INDEX IF NOT EXISTS idx_payments_stripe_payment_intent_id ON public.payments(stripe_payment_intent_id);
+
+-- Applies one Stripe event. p_event_id NULL skips the dedup claim (verify-payment
+-- reconciling a session it fetched from Stripe directly). Returns 'duplicate'
+-- when the event was already applied, otherwise the status it was recorded with.
+-- Ids from Stripe metadata arrive as text and are only ever assigned to variables
+-- declared with the target column's %TYPE, so this works whatever type
+-- consultas.id has (the old PostgREST path sent strings for the same reason).
+CREATE OR REPLACE FUNCTION public.process_stripe_event(
+  p_event_id text,
+  p_event_type text,
+  p_customer text,
+  p_created timestamp with time zone,
+  p_object jsonb
+)
+RETURNS text
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $function$
+DECLARE
+  v_status text := 'processed';
+  v_consulta public.consultas.id%TYPE := NULLIF(p_object->'metadata'->>'consulta_id', '');
+  v_paciente public.consultas.paciente_id%TYPE;
+  v_medico public.consultas.medico_id%TYPE;
+  v_payment_consulta public.payments.consultation_id%TYPE;
+BEGIN
+  -- Deliveries for the same customer apply one at a time, across isolates too
+  PERFORM pg_advisory_xact_lock(hashtext('stripe:' || COALESCE(p_customer, p_object->>'id')));
+
+  IF p_event_id IS NOT NULL THEN
+    INSERT INTO public.stripe_webhook_events (event_id, event_type, customer_id, event_created)
+    VALUES (p_event_id, p_event_type, p_customer, p_created)
+    ON CONFLICT (event_id) DO NOTHING;
+    IF NOT FOUND THEN
+      RETURN 'duplicate';
+    END IF;
+  END IF;
+
+  -- Intents created before checkout started copying metadata onto them carry
+  -- none; find their consulta through the checkout recorded for the intent in
+  -- pagamentos, which is always written, then in payments (v2), which may not be
+  IF v_consulta IS NULL AND p_event_type = 'payment_intent.payment_failed' THEN
+    SELECT pg.consulta_id INTO v_consulta
+      FROM public.pagamentos pg
+     WHERE pg.transacao_gateway->>'payment_intent' = p_object->>'id'
+     ORDER BY pg.created_at DESC
+     LIMIT 1;
+    IF v_consulta IS NULL THEN
+      SELECT c.id INTO v_consulta
+        FROM public.payments p
+        JOIN public.consultas c ON c.id::text = p.consultation_id::text
+       WHERE p.stripe_payment_intent_id = p_object->>'id'
+       ORDER BY p.created_at DESC
+       LIMIT 1;
+    END IF;
+  END IF;
+
+  IF v_consulta IS NOT NULL THEN
+    SELECT COALESCE(NULLIF(p_object->'metadata'->>'paciente_id', ''), c.paciente_id::text),
+           COALESCE(NULLIF(p_object->'metadata'->>'medico_id', ''), c.medico_id::text)
+      INTO v_paciente, v_medico
+      FROM public.consultas c
+     WHERE c.id = v_consulta;
+  END IF;
+
+  IF p_event_type = 'checkout.session.completed' THEN
+    IF v_consulta IS NULL THEN
+      RAISE EXCEPTION 'Consulta ID não encontrado no metadata da sessão %', p_object->>'id';
+    END IF;
+
+    -- payments (v2) is a best-effort dual write, as it was before: a consulta id
+    -- its consultation_id column cannot hold must not fail the whole event
+    BEGIN
+      v_payment_consulta := v_consulta::text;
+      INSERT INTO public.payments (
+        consultation_id, amount, currency, status, stripe_session_id,
+        stripe_payment_intent_id, customer_email, customer_name, metadata
+      ) VALUES (
+        v_payment_consulta,
+        COALESCE((p_object->>'amount_total')::numeric, 0),
+        COALESCE(p_object->>'currency', 'brl'),
+        'succeeded',
+        p_object->>'id',
+        NULLIF(p_object->>'payment_intent', ''),
+        COALESCE(p_object->'customer_details'->>'email', p_object->>'customer_email'),
+        p_object->'customer_details'->>'name',
+        p_object->'metadata'
+      )
+      ON CONFLICT (stripe_session_id) DO NOTHING;
+    EXCEPTION WHEN invalid_text_representation OR datatype_mismatch THEN
+      RAISE WARNING 'payments (v2) não registrado para a consulta %: %', v_consulta, SQLERRM;
+    END;
+
+    INSERT INTO public.pagamentos (
+      consulta_id, paciente_id, medico_id, usuario_id, valor, moeda, metodo, status, transacao_gateway
+    )
+    SELECT v_consulta, v_paciente, v_medico, v_paciente,
+           COALESCE((p_object->>'amount_total')::numeric, 0) / 100,
+           upper(COALESCE(p_object->>'currency', 'brl')),
+           'credit_card', 'succeeded', p_object
+    WHERE NOT EXISTS (
+      SELECT 1 FROM public.pagamentos
+       WHERE transacao_gateway->>'id' = p_object->>'id' AND status = 'succeeded'
+    );
+
+    -- Same transition as confirm_appointment_payment, whose uuid parameter does not
+    -- accept every consultas.id
+    UPDATE public.consultas
+       SET status = 'agendada', status_pagamento = 'pago', expires_at = NULL
+     WHERE id = v_consulta
+       AND (status IN ('pending', 'pending_payment', 'agendada') OR status IS NULL);
+
+  ELSIF p_event_type = 'payment_intent.payment_failed' THEN
+    -- Decided from what the checkout always writes (pagamentos and the consulta),
+    -- not from payments (v2), whose insert may have been skipped
+    IF EXISTS (
+      SELECT 1 FROM public.pagamentos
+       WHERE transacao_gateway->>'payment_intent' = p_object->>'id' AND status = 'succeeded'
+    ) OR EXISTS (
+      SELECT 1 FROM public.consultas WHERE id = v_consulta AND status_pagamento = 'pago'
+    ) THEN
+      -- Delivered after the checkout that later succeeded with the same intent
+      v_status := 'superseded';
+    ELSIF v_consulta IS NULL OR v_paciente IS NULL OR v_medico IS NULL THEN
+      v_status := 'ignored';
+    ELSE
+      INSERT INTO public.pagamentos (
+        consulta_id, paciente_id, medico_id, usuario_id, valor, moeda, metodo, status, transacao_gateway
+      )
+      SELECT v_consulta, v_paciente, v_medico, v_paciente,
+             COALESCE((p_object->>'amount')::numeric, 0) / 100,
+             upper(COALESCE(p_object->>'currency', 'brl')),
+             'credit_card', 'failed', p_object
+      WHERE NOT EXISTS (
+        SELECT 1 FROM public.pagamentos
+         WHERE transacao_gateway->>'id' = p_object->>'id' AND status = 'failed'
+      );
+    END IF;
+
+  ELSE
+    v_status := 'ignored';
+  END IF;
+
+  IF p_event_id IS NOT NULL AND v_status <> 'processed' THEN
+    UPDATE public.stripe_webhook_events SET status = v_status WHERE event_id = p_event_id;
+  END IF;
+  RETURN v_status;
+END;
+$function$;
+
+REVOKE ALL ON FUNCTION public.process_stripe_event(text, text, text, timestamp with time zone, jsonb) FROM PUBLIC, anon, authenticated;
+
+COMMIT;
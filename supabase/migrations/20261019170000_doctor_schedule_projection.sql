@@ -0,0 +1,339 @@
+-- Materialized per-doctor schedule for the doctor dashboard.
+--
+-- The dashboard polls the doctor's week, and get_doctor_schedule_data
+-- recomputes each day from medicos.configuracoes, locais_atendimento and
+-- every appointment on every poll. doctor_schedule_days keeps one computed
+-- payload per (doctor, day): days are materialized on first read and then
+-- kept current by triggers, which recompute only the day an appointment
+-- write touches (or the doctor's materialized days when working hours or
+-- locations change). doctor_schedule_versions is bumped on every such write
+-- and serves as the ETag, so an unchanged schedule costs one indexed lookup.
+-- Only days from yesterday to 90 days ahead are materialized; every refresh
+-- prunes the doctor's days that fell out of that window, so the table stays
+-- bounded by doctors x window.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.doctor_schedule_versions (
+  medico_id uuid PRIMARY KEY,
+  version bigint NOT NULL DEFAULT 1,
+  updated_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS public.doctor_schedule_days (
+  medico_id uuid NOT NULL,
+  day date NOT NULL,
+  payload jsonb NOT NULL,
+  refreshed_at timestamp with time zone NOT NULL DEFAULT now(),
+  PRIMARY KEY (medico_id, day)
+);
+
+-- Only reachable through the SECURITY DEFINER functions below
+ALTER TABLE public.doctor_schedule_versions ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.doctor_schedule_days ENABLE ROW LEVEL SECURITY;
+
+-- One day of a doctor's schedule: free slots per active location (same rules as
+-- get_doctor_schedule_data, set-based so it can run many times per transaction)
+-- plus the day's appointments
+CREATE OR REPLACE FUNCTION public.compute_doctor_schedule_day(p_doctor_id uuid, p_day date)
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $function$
+    WITH config AS (
+        SELECT m.configuracoes -> 'horarioAtendimento'
+                   -> (ARRAY['segunda','terca','quarta','quinta','sexta','sabado','domingo'])[EXTRACT(ISODOW FROM p_day)::integer]
+                   AS day_blocks,
+               COALESCE(NULLIF(btrim(m.configuracoes->>'duracaoConsulta'), '')::integer, 30) AS duracao,
+               COALESCE(NULLIF(btrim(m.configuracoes->>'bufferMinutos'), '')::integer, 0) AS buffer
+        FROM public.medicos m
+        WHERE m.user_id = p_doctor_id
+    ),
+    locations AS (
+        SELECT la.id::text AS local_id, la.nome_local
+        FROM public.locais_atendimento la
+        WHERE la.medico_id = p_doctor_id
+          AND la.ativo = true
+    ),
+    blocks AS (
+        SELECT btrim(b.value->>'local_id') AS local_id,
+               EXTRACT(EPOCH FROM (b.value->>'inicio')::time)::integer / 60 AS start_min,
+               EXTRACT(EPOCH FROM (b.value->>'fim')::time)::integer / 60 AS end_min,
+               EXTRACT(EPOCH FROM NULLIF(b.value->>'inicioAlmoco', '')::time)::integer / 60 AS lunch_start,
+               EXTRACT(EPOCH FROM NULLIF(b.value->>'fimAlmoco', '')::time)::integer / 60 AS lunch_end
+        FROM config c,
+             jsonb_array_elements(CASE WHEN jsonb_typeof(c.day_blocks) = 'array' THEN c.day_blocks ELSE '[]'::jsonb END) b
+        WHERE COALESCE((b.value->>'ativo')::boolean, true)
+          AND NULLIF(b.value->>'inicio', '') IS NOT NULL
+          AND NULLIF(b.value->>'fim', '') IS NOT NULL
+    ),
+    taken AS (
+        SELECT to_char(c.consultation_date, 'HH24:MI') AS slot_time,
+               COALESCE(c.local_id::text, '__ANY__') AS local_id
+        FROM public.consultas c
+        WHERE c.medico_id = p_doctor_id
+          AND c.consultation_date::date = p_day
+          AND c.status IN ('agendada','confirmada','em_andamento','scheduled','confirmed')
+        UNION
+        SELECT to_char(a.start_time, 'HH24:MI'), COALESCE(a.local_id::text, '__ANY__')
+        FROM public.appointments a
+        JOIN public.doctors d ON d.id = a.doctor_id
+        WHERE d.profile_id = p_doctor_id
+          AND a.start_time::date = p_day
+          AND a.status::text IN ('pending','agendada','confirmada','scheduled','confirmed')
+    ),
+    free AS (
+        SELECT DISTINCT bl.local_id,
+               lpad((m / 60)::text, 2, '0') || ':' || lpad((m % 60)::text, 2, '0') AS slot_time
+        FROM blocks bl
+        JOIN locations l ON l.local_id = bl.local_id
+        CROSS JOIN config c
+        CROSS JOIN LATERAL generate_series(bl.start_min, bl.end_min - c.duracao, GREATEST(1, c.duracao + c.buffer)) m
+        WHERE NOT (bl.lunch_start IS NOT NULL AND bl.lunch_end IS NOT NULL
+                   AND m < bl.lunch_end AND m + c.duracao > bl.lunch_start)
+    ),
+    available AS (
+        SELECT f.local_id, f.slot_time
+        FROM free f
+        WHERE NOT EXISTS (
+            SELECT 1 FROM taken t
+            WHERE t.slot_time = f.slot_time
+              AND (t.local_id = f.local_id OR t.local_id = '__ANY__')
+        )
+    )
+    SELECT jsonb_build_object(
+        'date', p_day,
+        'locations', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object(
+                       'id', l.local_id,
+                       'nome_local', l.nome_local,
+                       'horarios_disponiveis', (
+                           SELECT jsonb_agg(jsonb_build_object('time', a.slot_time, 'available', true) ORDER BY a.slot_time)
+                           FROM available a
+                           WHERE a.local_id = l.local_id
+                       )
+                   ) ORDER BY l.nome_local)
+            FROM locations l
+            WHERE EXISTS (SELECT 1 FROM available a WHERE a.local_id = l.local_id)
+        ), '[]'::jsonb),
+        'appointments', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object(
+                       'id', c.id,
+                       'datetime', c.consultation_date,
+                       'status', c.status,
+                       'patient_id', c.paciente_id,
+                       'local_id', c.local_id
+                   ) ORDER BY c.consultation_date)
+            FROM public.consultas c
+            WHERE c.medico_id = p_doctor_id
+              AND c.consultation_date::date = p_day
+              AND c.status NOT IN ('cancelada', 'cancelled')
+        ), '[]'::jsonb)
+    );
+$function$;
+
+-- Recomputes the materialized day (or all of the doctor's days when p_day is
+-- NULL) and bumps the doctor's version. Serialized per doctor with the reads
+-- that materialize days, so a day computed concurrently with a write is never
+-- left stale.
+CREATE OR REPLACE FUNCTION public.refresh_doctor_schedule(p_doctor_id uuid, p_day date)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $function$
+BEGIN
+    IF p_doctor_id IS NULL THEN
+        RETURN;
+    END IF;
+
+    PERFORM pg_advisory_xact_lock(hashtext('doctor_schedule:' || p_doctor_id::text));
+
+    DELETE FROM public.doctor_schedule_days
+    WHERE medico_id = p_doctor_id AND day < CURRENT_DATE - 1;
+
+    UPDATE public.doctor_schedule_days
+    SET payload = public.compute_doctor_schedule_day(medico_id, day),
+        refreshed_at = now()
+    WHERE medico_id = p_doctor_id
+      AND (p_day IS NULL OR day = p_day);
+
+    INSERT INTO public.doctor_schedule_versions (medico_id)
+    VALUES (p_doctor_id)
+    ON CONFLICT (medico_id) DO UPDATE
+    SET version = public.doctor_schedule_versions.version + 1,
+        updated_at = now();
+END;
+$function$;
+
+-- NULL when p_doctor_id is not a doctor, so callers can answer 403 without another query
+CREATE OR REPLACE FUNCTION public.doctor_schedule_version(p_doctor_id uuid)
+RETURNS bigint
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $function$
+    SELECT COALESCE(v.version, 0)
+    FROM public.medicos m
+    LEFT JOIN public.doctor_schedule_versions v ON v.medico_id = m.user_id
+    WHERE m.user_id = p_doctor_id;
+$function$;
+
+-- {version, days: [...]} for p_days days from p_start, materializing missing days
+-- inside the window; days outside it are computed on the fly and not stored
+CREATE OR REPLACE FUNCTION public.get_doctor_schedule_week(p_doctor_id uuid, p_start date, p_days integer)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $function$
+DECLARE
+    v_end date := p_start + LEAST(GREATEST(p_days, 1), 31) - 1;
+    v_first date := GREATEST(p_start, CURRENT_DATE - 1);
+    v_last date := LEAST(v_end, CURRENT_DATE + 90);
+    v_version bigint := public.doctor_schedule_version(p_doctor_id);
+BEGIN
+    IF v_version IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    IF v_first <= v_last AND (SELECT count(*) FROM public.doctor_schedule_days
+        WHERE medico_id = p_doctor_id AND day BETWEEN v_first AND v_last) < v_last - v_first + 1 THEN
+        PERFORM pg_advisory_xact_lock(hashtext('doctor_schedule:' || p_doctor_id::text));
+
+        DELETE FROM public.doctor_schedule_days
+        WHERE medico_id = p_doctor_id AND day < CURRENT_DATE - 1;
+
+        INSERT INTO public.doctor_schedule_days (medico_id, day, payload)
+        SELECT p_doctor_id, d::date, public.compute_doctor_schedule_day(p_doctor_id, d::date)
+        FROM generate_series(v_first, v_last, interval '1 day') d
+        ON CONFLICT (medico_id, day) DO NOTHING;
+
+        v_version := public.doctor_schedule_version(p_doctor_id);
+    END IF;
+
+    RETURN jsonb_build_object(
+        'version', v_version,
+        'days', (
+            SELECT COALESCE(jsonb_agg(
+                       COALESCE(s.payload, public.compute_doctor_schedule_day(p_doctor_id, d::date))
+                       ORDER BY d), '[]'::jsonb)
+            FROM generate_series(p_start, v_end, interval '1 day') d
+            LEFT JOIN public.doctor_schedule_days s
+              ON s.medico_id = p_doctor_id AND s.day = d::date
+        )
+    );
+END;
+$function$;
+
+-- Appointment writes touch the day they leave and the day they land on
+CREATE OR REPLACE FUNCTION public.doctor_schedule_consulta_changed()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $function$
+BEGIN
+    IF TG_OP <> 'INSERT' AND OLD.consultation_date IS NOT NULL THEN
+        PERFORM public.refresh_doctor_schedule(OLD.medico_id, OLD.consultation_date::date);
+    END IF;
+    IF TG_OP <> 'DELETE' AND NEW.consultation_date IS NOT NULL AND (
+        TG_OP = 'INSERT'
+        OR NEW.medico_id IS DISTINCT FROM OLD.medico_id
+        OR NEW.consultation_date::date IS DISTINCT FROM OLD.consultation_date::date
+    ) THEN
+        PERFORM public.refresh_doctor_schedule(NEW.medico_id, NEW.consultation_date::date);
+    END IF;
+    RETURN NULL;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS trigger_doctor_schedule_consulta_write ON public.consultas;
+CREATE TRIGGER trigger_doctor_schedule_consulta_write
+  AFTER INSERT OR DELETE ON public.consultas
+  FOR EACH ROW
+  EXECUTE FUNCTION public.doctor_schedule_consulta_changed();
+
+-- Edits that do not show on the schedule (notes, version bumps) skip the refresh
+DROP TRIGGER IF EXISTS trigger_doctor_schedule_consulta_update ON public.consultas;
+CREATE TRIGGER trigger_doctor_schedule_consulta_update
+  AFTER UPDATE ON public.consultas
+  FOR EACH ROW
+  WHEN (
+    OLD.status IS DISTINCT FROM NEW.status
+    OR OLD.consultation_date IS DISTINCT FROM NEW.consultation_date
+    OR OLD.medico_id IS DISTINCT FROM NEW.medico_id
+    OR OLD.local_id IS DISTINCT FROM NEW.local_id
+    OR OLD.paciente_id IS DISTINCT FROM NEW.paciente_id
+  )
+  EXECUTE FUNCTION public.doctor_schedule_consulta_changed();
+
+CREATE OR REPLACE FUNCTION public.doctor_schedule_appointment_changed()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $function$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM public.refresh_doctor_schedule(
+            (SELECT d.profile_id FROM public.doctors d WHERE d.id = OLD.doctor_id), OLD.start_time::date);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM public.refresh_doctor_schedule(
+            (SELECT d.profile_id FROM public.doctors d WHERE d.id = NEW.doctor_id), NEW.start_time::date);
+    END IF;
+    RETURN NULL;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS trigger_doctor_schedule_appointment_write ON public.appointments;
+CREATE TRIGGER trigger_doctor_schedule_appointment_write
+  AFTER INSERT OR UPDATE OF doctor_id, start_time, status, local_id OR DELETE ON public.appointments
+  FOR EACH ROW
+  EXECUTE FUNCTION public.doctor_schedule_appointment_changed();
+
+-- Working hours, lunch breaks and blocked periods live in medicos.configuracoes
+CREATE OR REPLACE FUNCTION public.doctor_schedule_availability_changed()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $function$
+BEGIN
+    IF TG_TABLE_NAME = 'medicos' THEN
+        PERFORM public.refresh_doctor_schedule(NEW.user_id, NULL);
+    ELSE
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM public.refresh_doctor_schedule(OLD.medico_id, NULL);
+        END IF;
+        IF TG_OP <> 'DELETE' AND (TG_OP = 'INSERT' OR NEW.medico_id IS DISTINCT FROM OLD.medico_id) THEN
+            PERFORM public.refresh_doctor_schedule(NEW.medico_id, NULL);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS trigger_doctor_schedule_hours_update ON public.medicos;
+CREATE TRIGGER trigger_doctor_schedule_hours_update
+  AFTER UPDATE OF configuracoes ON public.medicos
+  FOR EACH ROW
+  WHEN (OLD.configuracoes IS DISTINCT FROM NEW.configuracoes)
+  EXECUTE FUNCTION public.doctor_schedule_availability_changed();
+
+DROP TRIGGER IF EXISTS trigger_doctor_schedule_location_write ON public.locais_atendimento;
+CREATE TRIGGER trigger_doctor_schedule_location_write
+  AFTER INSERT OR UPDATE OF ativo, nome_local, medico_id OR DELETE ON public.locais_atendimento
+  FOR EACH ROW
+  EXECUTE FUNCTION public.doctor_schedule_availability_changed();
+
+REVOKE ALL ON FUNCTION public.compute_doctor_schedule_day(uuid, date) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.refresh_doctor_schedule(uuid, date) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.doctor_schedule_version(uuid) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.get_doctor_schedule_week(uuid, date, integer) FROM PUBLIC, anon, authenticated;
+
+COMMIT;
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from local_supabase import SUPABASE_URL, LocalSupabase
+from perf_utils import TIMEOUT, format_summary, percentile
+
+# Publishable key of the local stack (`supabase status`), as the frontend uses it
+SUPABASE_ANON_KEY = os.environ.get("SUPABASE_ANON_KEY", "")
+
+# TC001's register + login flow, run for many users at once
+USERS = int(os.environ.get("USERS", "20"))
+LOGINS_PER_USER = int(os.environ.get("LOGINS_PER_USER", "3"))
+# Concurrent clients to sweep; each level signs up its own USERS
+CONCURRENCY_LEVELS = [int(n) for n in os.environ.get("CONCURRENCY_LEVELS", "1,4,16").split(",") if n]
+PASSWORD = "TestPass123!"
+
+
+def run_concurrently(fn, items, concurrency):
+    """Runs fn(session, item) on `concurrency` threads; returns ([(latency_ms, ok, result)], elapsed_s)."""
+    local = threading.local()
+
+    def timed(item):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.session.headers.update({"apikey": SUPABASE_ANON_KEY})
+        start = time.perf_counter()
+        try:
+            ok, result = fn(local.session, item)
+        except requests.RequestException:
+            ok, result = False, None
+        return (time.perf_counter() - start) * 1000, ok, result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, items))
+    return results, time.perf_counter() - start
+
+
+def signup(session, email):
+    resp = session.post(f"{SUPABASE_URL}/auth/v1/signup", json={"email": email, "password": PASSWORD},
+                        timeout=TIMEOUT)
+    body = resp.json() if resp.ok else {}
+    return resp.status_code == 200, (resp.status_code, body.get("user", body).get("id"))
+
+
+def login(session, email):
+    resp = session.post(f"{SUPABASE_URL}/auth/v1/token", params={"grant_type": "password"},
+                        json={"email": email, "password": PASSWORD}, timeout=TIMEOUT)
+    return resp.status_code == 200, (resp.status_code, None)
+
+
+def probe_while(db, done):
+    """Latency of a cheap REST read issued while Auth hashes: the database should not stall behind it."""
+    latencies = []
+    while not done.is_set():
+        start = time.perf_counter()
+        db.select("consultas", limit="1")
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.02)
+    return latencies
+
+
+def assert_not_limited(results, step):
+    limited = sum(1 for _, _, result in results if result and result[0] == 429)
+    assert not limited, (
+        f"{limited} {step} requests rate limited by Auth: raise [auth.rate_limit] sign_in_sign_ups "
+        "in supabase/config.toml for the local stack"
+    )
+
+
+def test_auth_throughput():
+    if not SUPABASE_ANON_KEY:
+        raise RuntimeError("SUPABASE_ANON_KEY is required (see `supabase status`)")
+    db = LocalSupabase()
+    report = {}
+    user_ids = []
+    try:
+        for concurrency in CONCURRENCY_LEVELS:
+            emails = [f"testuser_{uuid.uuid4().hex}@example.com" for _ in range(USERS)]
+
+            signups, signup_s = run_concurrently(signup, emails, concurrency)
+            user_ids += [result[1] for _, ok, result in signups if ok and result[1]]
+            done = threading.Event()
+            probes = []
+            prober = threading.Thread(target=lambda: probes.extend(probe_while(LocalSupabase(), done)))
+            prober.start()
+            logins, login_s = run_concurrently(login, emails * LOGINS_PER_USER, concurrency)
+            done.set()
+            prober.join()
+
+            assert_not_limited(signups, "sign-up")
+            assert_not_limited(logins, "login")
+            assert all(ok for _, ok, _ in signups), f"sign-up failed with {concurrency} clients"
+            assert all(ok for _, ok, _ in logins), f"login failed with {concurrency} clients"
+
+            signup_ms = [r[0] for r in signups]
+            login_ms = [r[0] for r in logins]
+            report[concurrency] = {
+                "logins_per_s": len(logins) / login_s,
+                "login_p99": percentile(login_ms, 99),
+                "probe_p99": percentile(probes, 99),
+            }
+            print(f"\n== {concurrency} concurrent clients ==")
+            print(format_summary("sign-up", signup_ms))
+            print(format_summary("login", login_ms))
+            print(format_summary("REST read during logins", probes))
+            print(f"sign-ups/s={len(signups) / signup_s:.1f} logins/s={len(logins) / login_s:.1f}")
+
+        print("\n== summary (clients: logins/s / login p99 ms / REST p99 ms during logins) ==")
+        for concurrency, r in report.items():
+            print(f"{concurrency:>4}: {r['logins_per_s']:.1f} / {r['login_p99']:.0f} / {r['probe_p99']:.0f}")
+    finally:
+        for user_id in user_ids:
+            db.delete("profiles", id=f"eq.{user_id}")
+            db.delete_user(user_id)
+
+
+test_auth_throughput()
@@ -0,0 +1,102 @@
+import datetime
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from perf_utils import FUNCTIONS_URL, TIMEOUT, auth_headers, format_summary, percentile
+
+APPOINTMENTS_URL = f"{FUNCTIONS_URL}/appointments"
+DOCTOR_ID = os.environ.get("DOCTOR_ID", "")
+# Open-loop arrival rate well above what one doctor's calendar admits (ADMISSION_DOCTOR_CONCURRENCY)
+RATE_PER_S = float(os.environ.get("RATE_PER_S", "60"))
+DURATION_S = float(os.environ.get("DURATION_S", "10"))
+# TC010 booking budget
+ADMITTED_P99_SLO_MS = float(os.environ.get("ADMITTED_P99_SLO_MS", "500"))
+# A rejection should cost a fraction of an admitted request
+REJECTED_P99_MAX_MS = float(os.environ.get("REJECTED_P99_MAX_MS", "150"))
+
+_local = threading.local()
+
+
+def _session():
+    if getattr(_local, "session", None) is None:
+        _local.session = requests.Session()
+    return _local.session
+
+
+def book(slot_index, scheduled_at):
+    slot = (datetime.datetime.utcnow() + datetime.timedelta(days=60)).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    ) + datetime.timedelta(minutes=30 * slot_index)
+    payload = {"doctor_id": DOCTOR_ID, "datetime": slot.isoformat() + "Z", "reason": "Admission load test"}
+
+    # Latency is measured from the scheduled arrival, so client-side queueing counts too
+    delay = scheduled_at - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+    try:
+        resp = _session().post(APPOINTMENTS_URL, json=payload, headers=auth_headers(), timeout=TIMEOUT)
+    except requests.RequestException as e:
+        return {"status": None, "latency_ms": (time.perf_counter() - scheduled_at) * 1000, "error": str(e)}
+    return {
+        "status": resp.status_code,
+        "latency_ms": (time.perf_counter() - scheduled_at) * 1000,
+        "retry_after": resp.headers.get("Retry-After"),
+        "reason": resp.json().get("reason") if resp.status_code == 429 else None,
+        "id": resp.json().get("id") if resp.status_code == 201 else None,
+    }
+
+
+def cleanup(results):
+    session = requests.Session()
+    for r in results:
+        if r.get("id"):
+            session.delete(f"{APPOINTMENTS_URL}/{r['id']}", headers=auth_headers(), timeout=TIMEOUT)
+
+
+def test_booking_admission_control():
+    assert DOCTOR_ID, "Set DOCTOR_ID to a doctor profile id that accepts bookings"
+
+    total = int(RATE_PER_S * DURATION_S)
+    start = time.perf_counter() + 0.5
+    # Enough workers that the client never becomes the bottleneck (open loop)
+    with ThreadPoolExecutor(max_workers=min(total, 500)) as pool:
+        futures = [pool.submit(book, i, start + i / RATE_PER_S) for i in range(total)]
+        results = [f.result() for f in futures]
+
+    try:
+        admitted = [r for r in results if r["status"] in (201, 409)]
+        rejected = [r for r in results if r["status"] == 429]
+        errors = [r for r in results if r["status"] not in (201, 409, 429)]
+
+        print(f"\n== {total} bookings at {RATE_PER_S:.0f}/s for doctor {DOCTOR_ID} ==")
+        print(f"admitted={len(admitted)} rejected={len(rejected)} errors={len(errors)} "
+              f"goodput={len([r for r in admitted if r['status'] == 201]) / DURATION_S:.1f}/s")
+        print(format_summary("admitted latency", [r["latency_ms"] for r in admitted]))
+        print(format_summary("rejected latency", [r["latency_ms"] for r in rejected]))
+        reasons = {}
+        for r in rejected:
+            reasons[r["reason"]] = reasons.get(r["reason"], 0) + 1
+        print(f"rejection reasons: {reasons}")
+
+        assert not errors, f"Unexpected failures under overload: {errors[:5]}"
+        assert admitted, "No booking was admitted"
+        admitted_p99 = percentile([r["latency_ms"] for r in admitted], 99)
+        assert admitted_p99 <= ADMITTED_P99_SLO_MS, (
+            f"Admitted p99 {admitted_p99:.1f}ms exceeds SLO {ADMITTED_P99_SLO_MS}ms"
+        )
+        if rejected:
+            rejected_p99 = percentile([r["latency_ms"] for r in rejected], 99)
+            assert rejected_p99 <= REJECTED_P99_MAX_MS, (
+                f"Rejections are not cheap: p99 {rejected_p99:.1f}ms > {REJECTED_P99_MAX_MS}ms"
+            )
+            missing = [r for r in rejected if not (r["retry_after"] or "").isdigit()]
+            assert not missing, f"{len(missing)} 429 responses without a numeric Retry-After"
+    finally:
+        cleanup(results)
+
+
+test_booking_admission_control()
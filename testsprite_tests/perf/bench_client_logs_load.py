@@ -0,0 +1,230 @@
+import gzip
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_postgrest import FakePostgrest
+from perf_utils import TIMEOUT, RssSampler, format_summary
+
+# client-logs served with plain Deno against the in-memory store, e.g.
+#   SUPABASE_URL=http://127.0.0.1:54399 SUPABASE_SERVICE_ROLE_KEY=bench \
+#       deno run -A supabase/functions/client-logs/index.ts
+CLIENT_LOGS_URL = os.environ.get("CLIENT_LOGS_URL", "http://127.0.0.1:8000")
+FAKE_DB_PORT = int(os.environ.get("FAKE_DB_PORT", "54399"))
+FUNCTION_PID = os.environ.get("FUNCTION_PID")
+
+BROWSERS = int(os.environ.get("BROWSERS", "20000"))
+# advancedLogger flushes every 5s while active; most tabs sit idle, so default to a slower average
+FLUSH_INTERVAL_S = float(os.environ.get("FLUSH_INTERVAL_S", "30"))
+DURATION_S = float(os.environ.get("DURATION_S", "60"))
+MAX_EVENTS_PER_FLUSH = 50
+# Share of browsers stuck in an error loop, flushing full batches every second
+NOISY_RATIO = float(os.environ.get("NOISY_RATIO", "0.01"))
+WORKERS = int(os.environ.get("WORKERS", "128"))
+# Must match the function's CLIENT_LOGS_IP_RATE_PER_SEC / CLIENT_LOGS_IP_BURST: every browser here is anonymous
+IP_RATE_PER_SEC = float(os.environ.get("CLIENT_LOGS_IP_RATE_PER_SEC", "20"))
+IP_BURST = int(os.environ.get("CLIENT_LOGS_IP_BURST", "500"))
+PAGE_SIZE = 500
+MAX_PAGES = int(os.environ.get("MAX_PAGES", "20"))
+
+LEVELS = ["debug"] * 40 + ["info"] * 40 + ["warn"] * 15 + ["error"] * 5
+ADMIN_TOKEN = "bench-admin-token"
+
+_local = threading.local()
+
+
+def _session():
+    if getattr(_local, "session", None) is None:
+        _local.session = requests.Session()
+    return _local.session
+
+
+def make_flush(browser, rng):
+    count = MAX_EVENTS_PER_FLUSH if browser["noisy"] else rng.randint(1, MAX_EVENTS_PER_FLUSH)
+    # Noisy browsers also rotate their sessionId on every flush, trying to get a fresh budget
+    session_id = str(uuid.UUID(int=rng.getrandbits(128))) if browser["noisy"] else browser["session_id"]
+    events = [{
+        "id": str(uuid.uuid4()),
+        "traceId": session_id,
+        "sessionId": session_id,
+        "level": "error" if browser["noisy"] else rng.choice(LEVELS),
+        "message": f"event {n} from {session_id[:8]}",
+        "url": "http://localhost:8080/dashboard-medico",
+        "userAgent": browser["ua"],
+        "timestamp": "2026-10-19T12:00:00Z",
+        "breadcrumbs": [{"message": "click", "timestamp": n}] * rng.randint(0, 5),
+    } for n in range(count)]
+    return {"events": events, "sentAt": "2026-10-19T12:00:00Z",
+            "client": {"url": "http://localhost:8080/dashboard-medico", "ua": browser["ua"],
+                       "sessionId": session_id}}
+
+
+def flush(job):
+    browser, scheduled_at, seed = job
+    rng = random.Random(seed)
+    payload = make_flush(browser, rng)
+    raw = json.dumps(payload).encode()
+    body = gzip.compress(raw, compresslevel=6)
+
+    delay = scheduled_at - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+    try:
+        resp = _session().post(CLIENT_LOGS_URL, data=body, timeout=TIMEOUT, headers={
+            "Content-Type": "application/json", "Content-Encoding": "gzip",
+            # Anonymous beacons are limited per IP; plain Deno trusts the header as sent
+            "X-Forwarded-For": browser["ip"],
+        })
+        status, ack = resp.status_code, resp.json()
+    except requests.RequestException as e:
+        status, ack = None, {"error": str(e)}
+    levels = {}
+    for event in payload["events"]:
+        levels[event["level"]] = levels.get(event["level"], 0) + 1
+    return {
+        "browser": browser["ip"],
+        "status": status,
+        "latency_ms": (time.perf_counter() - scheduled_at) * 1000,
+        "lag_ms": max(0.0, -delay) * 1000,
+        "raw_bytes": len(raw),
+        "sent_bytes": len(body),
+        "levels": levels,
+        "ack": ack,
+    }
+
+
+def schedule(browsers):
+    """Each browser flushes on its own phase; noisy ones every second."""
+    start = time.perf_counter() + 1.0
+    jobs = []
+    for i, browser in enumerate(browsers):
+        interval = 1.0 if browser["noisy"] else FLUSH_INTERVAL_S
+        t = random.Random(i).uniform(0, interval)
+        while t < DURATION_S:
+            jobs.append((browser, start + t, len(jobs)))
+            t += interval
+    jobs.sort(key=lambda job: job[1])
+    return jobs
+
+
+def wait_until_quiet(store, timeout_s=60):
+    last_seen, quiet_since, deadline = -1, time.perf_counter(), time.perf_counter() + timeout_s
+    while time.perf_counter() < deadline:
+        seen = store.total_requests()
+        if seen != last_seen:
+            last_seen, quiet_since = seen, time.perf_counter()
+        elif time.perf_counter() - quiet_since >= 1.0:
+            return
+        time.sleep(0.2)
+
+
+def read_pages(expected_total):
+    headers = {"Authorization": f"Bearer {ADMIN_TOKEN}", "Accept-Encoding": "gzip"}
+    offset, latencies, seen = 0, [], 0
+    for _ in range(MAX_PAGES):
+        start = time.perf_counter()
+        resp = requests.get(CLIENT_LOGS_URL, params={"limit": PAGE_SIZE, "offset": offset},
+                            headers=headers, timeout=TIMEOUT)
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert resp.status_code == 200, f"GET page at offset {offset} failed: {resp.status_code} {resp.text}"
+        page = resp.json()
+        assert page["total"] == expected_total, f"total={page['total']} but {expected_total} rows are stored"
+        assert len(page["logs"]) <= PAGE_SIZE, f"Page returned {len(page['logs'])} rows for limit {PAGE_SIZE}"
+        seen += len(page["logs"])
+        if page["next_offset"] is None:
+            assert seen == expected_total, f"Paged through {seen} rows, total says {expected_total}"
+            break
+        assert page["next_offset"] == offset + len(page["logs"]), "next_offset skips or repeats rows"
+        offset = page["next_offset"]
+    print(format_summary(f"GET page ({PAGE_SIZE} rows)", latencies))
+
+
+def test_client_logs_load():
+    store = FakePostgrest(port=FAKE_DB_PORT).start()
+    sampler = RssSampler(FUNCTION_PID) if FUNCTION_PID else None
+    try:
+        admin_id = str(uuid.uuid4())
+        store.add_user(ADMIN_TOKEN, {"id": admin_id, "email": "admin@bench.test", "aud": "authenticated"})
+        store.seed("debug_allowlist", [{"user_id": admin_id, "is_active": True}])
+
+        browsers = [{"session_id": str(uuid.uuid4()), "ua": f"Mozilla/5.0 bench/{i % 7}",
+                     "ip": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+                     "noisy": i < BROWSERS * NOISY_RATIO} for i in range(BROWSERS)]
+        jobs = schedule(browsers)
+        print(f"\n== {BROWSERS} browsers, {len(jobs)} flushes over {DURATION_S:.0f}s "
+              f"(target {len(jobs) / DURATION_S:.0f} req/s) ==")
+
+        if sampler:
+            sampler.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            results = list(pool.map(flush, jobs))
+        elapsed = time.perf_counter() - start
+        wait_until_quiet(store)
+        if sampler:
+            sampler.stopped.set()
+
+        rows = store.rows("client_logs")
+        statuses = {}
+        for r in results:
+            statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+        acked = [r for r in results if r["status"] == 202]
+        accepted = sum(r["ack"]["accepted"] for r in acked)
+        sampled_out = sum(r["ack"]["sampled_out"] for r in acked)
+        rate_limited = sum(r["ack"]["rate_limited"] for r in acked) + \
+            sum(r["ack"].get("dropped", 0) for r in results if r["status"] == 429)
+        inserts = store.request_counts.get(("POST", "client_logs"), 0)
+
+        print(f"achieved {len(results) / elapsed:.0f} req/s, statuses={statuses}")
+        print(format_summary("ack latency", [r["latency_ms"] for r in results]))
+        print(format_summary("client schedule lag", [r["lag_ms"] for r in results]))
+        print(f"events: sent={sum(sum(r['levels'].values()) for r in results)} accepted={accepted} "
+              f"sampled_out={sampled_out} rate_limited={rate_limited} stored={len(rows)}")
+        print(f"gzip: {sum(r['raw_bytes'] for r in results) / sum(r['sent_bytes'] for r in results):.1f}x smaller uploads")
+        print(f"buffered writes: {inserts} inserts for {len(acked)} accepted batches "
+              f"({len(rows) / max(inserts, 1):.0f} rows per insert)")
+        if sampler:
+            print(sampler.report())
+
+        unexpected = {s: n for s, n in statuses.items() if s not in (202, 429, 503)}
+        assert not unexpected, f"Unexpected responses: {unexpected}"
+        assert len(rows) == accepted, f"{accepted} events acknowledged but {len(rows)} stored"
+        assert inserts < len(acked), "Writes were not coalesced across requests"
+
+        # warn/error are never sampled: quiet browsers that were not rate limited keep all of them
+        stored_by_browser = {}
+        for row in rows:
+            if row["level"] in ("warn", "error"):
+                stored_by_browser[row["meta"]["ip"]] = stored_by_browser.get(row["meta"]["ip"], 0) + 1
+        sent_by_browser, limited_browsers = {}, set()
+        for r in results:
+            if r["status"] != 202 or r["ack"]["rate_limited"]:
+                limited_browsers.add(r["browser"])
+            sent_by_browser[r["browser"]] = sent_by_browser.get(r["browser"], 0) + \
+                r["levels"].get("warn", 0) + r["levels"].get("error", 0)
+        lost = [b for b, n in sent_by_browser.items()
+                if b not in limited_browsers and stored_by_browser.get(b, 0) != n]
+        assert not lost, f"{len(lost)} browsers lost warn/error events to sampling"
+
+        # Noisy browsers are held to their token bucket even though they rotate sessionId
+        cap = IP_BURST + IP_RATE_PER_SEC * (elapsed + 1)
+        noisy_ips = {b["ip"] for b in browsers if b["noisy"]}
+        noisy_rows = {}
+        for row in rows:
+            if row["meta"]["ip"] in noisy_ips:
+                noisy_rows[row["meta"]["ip"]] = noisy_rows.get(row["meta"]["ip"], 0) + 1
+        over = {ip: n for ip, n in noisy_rows.items() if n > cap}
+        assert not over, f"{len(over)} noisy browsers stored more than {cap:.0f} events"
+
+        read_pages(len(rows))
+    finally:
+        store.stop()
+
+
+test_client_logs_load()
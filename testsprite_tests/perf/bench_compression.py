@@ -0,0 +1,122 @@
+import gzip
+import os
+import statistics
+import time
+
+import requests
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from perf_utils import FUNCTIONS_URL, TIMEOUT, auth_headers
+
+PATIENT_ID = os.environ.get("PATIENT_ID", "")
+REPEAT = int(os.environ.get("REPEAT", "5"))
+# Must match COMPRESSION_MIN_BYTES in supabase/functions/_shared/compression.ts
+MIN_COMPRESS_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "1024"))
+
+# (label, url, params) - same resources at growing page sizes
+ENDPOINTS = [
+    (f"appointments limit={n}", f"{FUNCTIONS_URL}/appointments", {"limit": n})
+    for n in (5, 50, 200, 500)
+] + [
+    (f"fhir-observation _count={n}", f"{FUNCTIONS_URL}/fhir-observation", {"patient": PATIENT_ID, "_count": n})
+    for n in (5, 50, 200, 1000)
+]
+
+ENCODINGS = ["identity", "gzip", "br"] + (["zstd"] if zstandard else [])
+
+# Links used to turn bytes saved into time saved when picking a level
+LINKS_BPS = {"3g": 1_600_000, "4g": 12_000_000, "broadband": 100_000_000}
+
+
+def fetch(url, params, encoding):
+    headers = auth_headers()
+    headers["Accept-Encoding"] = encoding
+    start = time.perf_counter()
+    resp = requests.get(url, params=params, headers=headers, timeout=TIMEOUT, stream=True)
+    raw = resp.raw.read(decode_content=False)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return resp, raw, elapsed_ms
+
+
+def local_levels():
+    levels = [("gzip", level, lambda b, lvl=level: gzip.compress(b, compresslevel=lvl)) for level in (1, 4, 6, 9)]
+    if brotli:
+        levels += [("br", q, lambda b, q=q: brotli.compress(b, quality=q)) for q in (1, 4, 6, 11)]
+    if zstandard:
+        levels += [("zstd", lvl, lambda b, lvl=lvl: zstandard.ZstdCompressor(level=lvl).compress(b))
+                   for lvl in (1, 3, 9, 19)]
+    return levels
+
+
+def sweep_levels(body):
+    """Compress the identity body locally at each level and pick the fastest end-to-end per link."""
+    print(f"  level sweep ({len(body)} bytes):")
+    results = []
+    for name, level, compress in local_levels():
+        timings = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            out = compress(body)
+            timings.append((time.perf_counter() - start) * 1000)
+        cpu_ms = statistics.median(timings)
+        results.append((name, level, len(out), cpu_ms))
+        print(f"    {name:<5} level={level:<3} bytes={len(out):<9} ratio={len(body) / max(len(out), 1):5.1f}x "
+              f"cpu={cpu_ms:.2f}ms")
+
+    for link, bps in LINKS_BPS.items():
+        baseline = len(body) * 8 / bps * 1000
+        name, level, size, cpu_ms = min(results, key=lambda r: r[3] + r[2] * 8 / bps * 1000)
+        total = cpu_ms + size * 8 / bps * 1000
+        print(f"    best on {link:<9}: {name} level={level} -> {total:.1f}ms (identity {baseline:.1f}ms)")
+
+
+def test_negotiated_compression():
+    assert PATIENT_ID, "Set PATIENT_ID to a patient with health metrics"
+
+    failures = []
+    for label, url, params in ENDPOINTS:
+        print(f"\n== {label} ==")
+        identity_body = None
+        identity_size = None
+        for encoding in ENCODINGS:
+            latencies = []
+            for _ in range(REPEAT):
+                resp, raw, elapsed_ms = fetch(url, params, encoding)
+                latencies.append(elapsed_ms)
+            if resp.status_code != 200:
+                failures.append(f"{label}: {encoding} returned {resp.status_code}")
+                break
+
+            served = resp.headers.get("Content-Encoding", "identity")
+            if encoding == "identity":
+                identity_body, identity_size = raw, len(raw)
+            elif identity_size is not None:
+                expected = encoding if identity_size >= MIN_COMPRESS_BYTES else "identity"
+                if encoding == "zstd" and served == "identity":
+                    print("  (zstd not available in this edge runtime)")
+                elif served != expected:
+                    failures.append(f"{label}: asked {encoding} for {identity_size} bytes, got {served}")
+                elif served != "identity" and len(raw) >= identity_size:
+                    failures.append(f"{label}: {encoding} body ({len(raw)}) not smaller than identity")
+            if "accept-encoding" not in resp.headers.get("Vary", "").lower():
+                failures.append(f"{label}: response missing Vary: Accept-Encoding")
+
+            print(f"  {encoding:<9} served={served:<9} wire={len(raw):<9} "
+                  f"p50={statistics.median(latencies):.1f}ms max={max(latencies):.1f}ms")
+
+        if identity_body and len(identity_body) >= MIN_COMPRESS_BYTES:
+            sweep_levels(identity_body)
+
+    assert not failures, "Compression negotiation problems:\n" + "\n".join(failures)
+
+
+test_negotiated_compression()
@@ -0,0 +1,290 @@
+import os
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import requests
+
+from fake_postgrest import FakePostgrest
+from perf_utils import TIMEOUT, format_summary
+
+# appointments served with plain Deno against the in-memory store, e.g.
+#   SUPABASE_URL=http://127.0.0.1:54399 SUPABASE_SERVICE_ROLE_KEY=bench SUPABASE_ANON_KEY=bench \
+#       deno run -A supabase/functions/appointments/index.ts
+APPOINTMENTS_URL = os.environ.get("APPOINTMENTS_URL", "http://127.0.0.1:8000")
+FAKE_DB_PORT = int(os.environ.get("FAKE_DB_PORT", "54399"))
+
+DOCTORS = int(os.environ.get("DOCTORS", "40"))
+DAYS = 7
+# Appointment bookings/cancellations per second across all doctors, plus occasional hour changes
+WRITES_PER_SEC = float(os.environ.get("WRITES_PER_SEC", "5"))
+HOURS_CHANGE_RATIO = float(os.environ.get("HOURS_CHANGE_RATIO", "0.02"))
+# Each open dashboard polls this often
+POLL_INTERVAL_S = float(os.environ.get("POLL_INTERVAL_S", "1"))
+DURATION_S = float(os.environ.get("DURATION_S", "20"))
+
+WEEKDAYS = ["segunda", "terca", "quarta", "quinta", "sexta", "sabado", "domingo"]
+ACTIVE = {"agendada", "confirmada", "em_andamento", "scheduled", "confirmed"}
+START = date.today()
+
+
+def working_hours(variant):
+    block = {"inicio": "08:00", "fim": "18:00" if variant % 2 == 0 else "17:00",
+             "inicioAlmoco": "12:00", "fimAlmoco": "13:00", "ativo": True}
+    return {"duracaoConsulta": 30, "bufferMinutos": variant % 3 * 5,
+            "horarioAtendimento": {day: ([] if day in ("sabado", "domingo") else [block]) for day in WEEKDAYS}}
+
+
+def to_minutes(hhmm):
+    hours, minutes = hhmm.split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+class Schedules:
+    """Python twin of compute_doctor_schedule_day and the projection's triggers."""
+
+    def __init__(self, store):
+        self.store = store
+        self.days = {}
+        self.versions = {}
+        self.computed = 0
+
+    def compute_day(self, doctor_id, day):
+        self.computed += 1
+        medico = self.store._index("medicos", ("user_id",)).get((doctor_id,))
+        config = medico["configuracoes"]
+        duration = int(config.get("duracaoConsulta") or 30)
+        step = max(1, duration + int(config.get("bufferMinutos") or 0))
+        locations = {str(l["id"]): l["nome_local"] for l in self.store.tables["locais_atendimento"]
+                     if l["medico_id"] == doctor_id and l["ativo"]}
+        on_day = [c for c in self.store.tables["consultas"]
+                  if c["medico_id"] == doctor_id and c["consultation_date"][:10] == day.isoformat()]
+        taken = {(c["consultation_date"][11:16], str(c.get("local_id") or "__ANY__"))
+                 for c in on_day if c["status"] in ACTIVE}
+
+        free = {}
+        for block in config["horarioAtendimento"].get(WEEKDAYS[day.weekday()], []):
+            local_id = str(block.get("local_id", "")).strip()
+            if not block.get("ativo", True) or local_id not in locations:
+                continue
+            start, end = to_minutes(block["inicio"]), to_minutes(block["fim"])
+            lunch = (to_minutes(block["inicioAlmoco"]), to_minutes(block["fimAlmoco"])) \
+                if block.get("inicioAlmoco") and block.get("fimAlmoco") else None
+            for m in range(start, end - duration + 1, step):
+                if lunch and m < lunch[1] and m + duration > lunch[0]:
+                    continue
+                slot = f"{m // 60:02d}:{m % 60:02d}"
+                if (slot, local_id) not in taken and (slot, "__ANY__") not in taken:
+                    free.setdefault(local_id, set()).add(slot)
+
+        return {
+            "date": day.isoformat(),
+            "locations": [{"id": lid, "nome_local": locations[lid],
+                           "horarios_disponiveis": [{"time": s, "available": True} for s in sorted(free[lid])]}
+                          for lid in sorted(free, key=lambda lid: locations[lid])],
+            "appointments": [{"id": c["id"], "datetime": c["consultation_date"], "status": c["status"],
+                              "patient_id": c["paciente_id"], "local_id": c.get("local_id")}
+                             for c in sorted(on_day, key=lambda c: c["consultation_date"])
+                             if c["status"] not in ("cancelada", "cancelled")],
+        }
+
+    def refresh(self, doctor_id, day=None):
+        for key in [k for k in self.days if k[0] == doctor_id and (day is None or k[1] == day)]:
+            self.days[key] = self.compute_day(*key)
+        self.versions[doctor_id] = self.versions.get(doctor_id, 0) + 1
+
+    def register(self):
+        def version(args, store):
+            doctor_id = args["p_doctor_id"]
+            if (doctor_id,) not in store._index("medicos", ("user_id",)):
+                return None
+            return self.versions.get(doctor_id, 0)
+
+        def week(args, store):
+            doctor_id = args["p_doctor_id"]
+            current = version(args, store)
+            if current is None:
+                return None
+            first = date.fromisoformat(args["p_start"])
+            days = [first + timedelta(days=n) for n in range(min(max(args["p_days"], 1), 31))]
+            for day in days:
+                if (doctor_id, day) not in self.days:
+                    self.days[(doctor_id, day)] = self.compute_day(doctor_id, day)
+            return {"version": current, "days": [self.days[(doctor_id, day)] for day in days]}
+
+        def legacy_day(args, store):
+            # get_doctor_schedule_data: recomputed from scratch on every call
+            payload = self.compute_day(args["p_doctor_id"], date.fromisoformat(args["p_date"]))
+            medico = store._index("medicos", ("user_id",)).get((args["p_doctor_id"],))
+            return [{"doctor_config": medico["configuracoes"], "locations": payload["locations"]}]
+
+        self.store.register_rpc("doctor_schedule_version", version)
+        self.store.register_rpc("get_doctor_schedule_week", week)
+        self.store.register_rpc("get_doctor_schedule_data", legacy_day)
+
+
+def seed(store, rng):
+    doctors = []
+    consultas = []
+    for n in range(DOCTORS):
+        doctor_id = f"00000000-0000-4000-8000-{n:012d}"
+        local_id = 1000 + n
+        hours = working_hours(n)
+        for block in (b for blocks in hours["horarioAtendimento"].values() for b in blocks):
+            block["local_id"] = str(local_id)
+        store.seed("medicos", [{"user_id": doctor_id, "configuracoes": hours}])
+        store.seed("locais_atendimento", [{"id": local_id, "medico_id": doctor_id,
+                                           "nome_local": f"Clínica {n}", "ativo": True}])
+        store.add_user(f"doctor-{n}", {"id": doctor_id, "aud": "authenticated", "role": "authenticated"})
+        for d in range(DAYS):
+            for hour in rng.sample(range(8, 17), 4):
+                consultas.append(new_consulta(doctor_id, local_id, START + timedelta(days=d), hour, rng))
+        doctors.append((doctor_id, local_id, f"doctor-{n}"))
+    store.seed("consultas", consultas)
+    return doctors
+
+
+def new_consulta(doctor_id, local_id, day, hour, rng):
+    when = datetime(day.year, day.month, day.day, hour, rng.choice((0, 30)), tzinfo=timezone.utc)
+    return {"id": rng.getrandbits(48), "medico_id": doctor_id, "paciente_id": f"patient-{rng.getrandbits(32)}",
+            "local_id": str(local_id), "consultation_date": when.isoformat(), "status": "agendada"}
+
+
+def writer(store, schedules, doctors, stop, rng, counts):
+    """Books, cancels and edits working hours at WRITES_PER_SEC, applying the triggers' refreshes."""
+    while not stop.is_set():
+        time.sleep(rng.expovariate(WRITES_PER_SEC) if WRITES_PER_SEC else 1)
+        doctor_id, local_id, _ = rng.choice(doctors)
+        day = START + timedelta(days=rng.randrange(DAYS))
+        with store.lock:
+            if rng.random() < HOURS_CHANGE_RATIO:
+                medico = store._index("medicos", ("user_id",))[(doctor_id,)]
+                hours = working_hours(rng.randrange(6))
+                for block in (b for blocks in hours["horarioAtendimento"].values() for b in blocks):
+                    block["local_id"] = str(local_id)
+                medico["configuracoes"] = hours
+                schedules.refresh(doctor_id)
+                counts["hours"] += 1
+                continue
+            mine = [c for c in store.tables["consultas"] if c["medico_id"] == doctor_id
+                    and c["consultation_date"][:10] == day.isoformat() and c["status"] == "agendada"]
+            if mine and rng.random() < 0.5:
+                rng.choice(mine)["status"] = "cancelada"
+            else:
+                store._insert_row("consultas", new_consulta(doctor_id, local_id, day, rng.randrange(8, 17), rng),
+                                  None, None)
+            schedules.refresh(doctor_id, day)
+            counts["appointments"] += 1
+
+
+def poll_legacy(session, store_url, doctor_id, _token, _state):
+    """Today's dashboard: one get_doctor_schedule_data RPC per day plus the week's consultas."""
+    received = 0
+    headers = {"apikey": "bench", "Authorization": "Bearer bench"}
+    for n in range(DAYS):
+        resp = session.post(f"{store_url}/rest/v1/rpc/get_doctor_schedule_data", headers=headers,
+                            json={"p_doctor_id": doctor_id, "p_date": (START + timedelta(days=n)).isoformat()},
+                            timeout=TIMEOUT)
+        resp.raise_for_status()
+        received += len(resp.content)
+    resp = session.get(f"{store_url}/rest/v1/consultas", headers=headers, timeout=TIMEOUT, params=[
+        ("medico_id", f"eq.{doctor_id}"), ("consultation_date", f"gte.{START.isoformat()}"),
+        ("consultation_date", f"lt.{(START + timedelta(days=DAYS)).isoformat()}"),
+    ])
+    resp.raise_for_status()
+    return 200, received + len(resp.content)
+
+
+def poll_projection(session, _store_url, _doctor_id, token, state):
+    headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "gzip"}
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    resp = session.get(f"{APPOINTMENTS_URL}/schedule", headers=headers, timeout=TIMEOUT,
+                       params={"start": START.isoformat(), "days": DAYS})
+    if resp.status_code == 200:
+        state["etag"] = resp.headers.get("ETag")
+    elif resp.status_code != 304:
+        resp.raise_for_status()
+    return resp.status_code, int(resp.raw.tell() or len(resp.content))
+
+
+def run_mode(name, poll, store, schedules, doctors):
+    stop = threading.Event()
+    counts = {"appointments": 0, "hours": 0}
+    latencies, statuses, sizes = [], {}, []
+    lock = threading.Lock()
+
+    def dashboard(doctor_id, token):
+        session, state = requests.Session(), {}
+        next_poll = time.perf_counter()
+        while not stop.is_set():
+            start = time.perf_counter()
+            status, size = poll(session, store.url, doctor_id, token, state)
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+                sizes.append(size)
+            next_poll += POLL_INTERVAL_S
+            stop.wait(max(0.0, next_poll - time.perf_counter()))
+
+    requests_before, computed_before = store.total_requests(), schedules.computed
+    threads = [threading.Thread(target=dashboard, args=(d, t)) for d, _, t in doctors]
+    threads.append(threading.Thread(target=writer, args=(store, schedules, doctors, stop, random.Random(37), counts)))
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(DURATION_S)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    polls = len(latencies)
+    round_trips = store.total_requests() - requests_before
+    computed = schedules.computed - computed_before
+    print(f"\n== {name}: {polls} polls from {len(doctors)} dashboards, "
+          f"{counts['appointments']} appointment writes + {counts['hours']} hour changes in {elapsed:.1f}s ==")
+    print(format_summary("poll latency", latencies))
+    print(f"statuses={statuses} bytes/poll={sum(sizes) / max(polls, 1):.0f} "
+          f"db round trips/poll={round_trips / max(polls, 1):.2f} day computations/poll={computed / max(polls, 1):.2f}")
+    return {"polls": polls, "round_trips": round_trips / max(polls, 1), "computed": computed / max(polls, 1),
+            "bytes": sum(sizes) / max(polls, 1), "not_modified": statuses.get(304, 0) / max(polls, 1)}
+
+
+def test_doctor_schedule_poll():
+    store = FakePostgrest(port=FAKE_DB_PORT).start()
+    try:
+        rng = random.Random(37)
+        doctors = seed(store, rng)
+        schedules = Schedules(store)
+        schedules.register()
+
+        before = run_mode("recompute per poll (get_doctor_schedule_data)", poll_legacy, store, schedules, doctors)
+        after = run_mode("materialized projection + If-None-Match", poll_projection, store, schedules, doctors)
+
+        # Both modes run against the Python twin, so these counts model the SQL rather than measure it;
+        # check_doctor_schedule_sql.py checks the real projection against get_doctor_schedule_data
+        print(f"\nday computations/poll (Python twin): {before['computed']:.2f} -> {after['computed']:.2f}; "
+              f"bytes/poll: {before['bytes']:.0f} -> {after['bytes']:.0f}; "
+              f"304 share: {after['not_modified']:.0%}")
+
+        store.add_user("patient-token", {"id": "patient-without-medicos-row", "aud": "authenticated"})
+        resp = requests.get(f"{APPOINTMENTS_URL}/schedule", headers={"Authorization": "Bearer patient-token"},
+                            timeout=TIMEOUT)
+        assert resp.status_code == 403, f"Patients must not read a doctor schedule (got {resp.status_code})"
+
+        # Days outside the materialized window (yesterday to +90 days) are refused, not stored
+        _, _, token = doctors[0]
+        for start in (START - timedelta(days=30), START + timedelta(days=365)):
+            resp = requests.get(f"{APPOINTMENTS_URL}/schedule", headers={"Authorization": f"Bearer {token}"},
+                                params={"start": start.isoformat(), "days": DAYS}, timeout=TIMEOUT)
+            assert resp.status_code == 400, f"start={start} outside the schedule window returned {resp.status_code}"
+
+        assert after["computed"] < before["computed"], "The projection did not reduce per-poll recomputation"
+        assert after["not_modified"] > 0, "No poll was answered with 304 Not Modified"
+    finally:
+        store.stop()
+
+
+test_doctor_schedule_poll()
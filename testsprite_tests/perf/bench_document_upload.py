@@ -0,0 +1,215 @@
+import hashlib
+import os
+import random
+import resource
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from perf_utils import ACCESS_TOKEN, FUNCTIONS_URL, TIMEOUT, RssSampler, auth_headers, format_summary
+
+UPLOAD_URL = f"{FUNCTIONS_URL}/upload-document"
+FILE_SIZES_MB = [float(n) for n in os.environ.get("FILE_SIZES_MB", "1,16,128,1024").split(",")]
+CONCURRENCY = [int(n) for n in os.environ.get("CONCURRENCY", "1,4").split(",")]
+# PID of the process serving the function (deno / edge-runtime), to sample its memory
+FUNCTION_PID = os.environ.get("FUNCTION_PID")
+# Peak RSS growth allowed while uploading; must not scale with file size
+MAX_FUNCTION_RSS_GROWTH_MB = float(os.environ.get("MAX_FUNCTION_RSS_GROWTH_MB", "256"))
+# Optional cleanup of the documents created by the benchmark
+SUPABASE_URL = os.environ.get("SUPABASE_URL", "")
+SUPABASE_ANON_KEY = os.environ.get("SUPABASE_ANON_KEY", "")
+
+GENERATE_BLOCK = 1024 * 1024
+
+
+def file_blocks(seed, size, start=0, end=None):
+    """Deterministic pseudo-random file content, generated block by block and never held whole."""
+    end = size if end is None else end
+    block_index = start // GENERATE_BLOCK
+    while block_index * GENERATE_BLOCK < end:
+        block = random.Random(f"{seed}:{block_index}").randbytes(min(GENERATE_BLOCK, size - block_index * GENERATE_BLOCK))
+        lo = max(start - block_index * GENERATE_BLOCK, 0)
+        hi = min(end - block_index * GENERATE_BLOCK, len(block))
+        yield block[lo:hi]
+        block_index += 1
+
+
+def file_sha256(seed, size):
+    digest = hashlib.sha256()
+    for block in file_blocks(seed, size):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def call(session, method, path="", **kwargs):
+    headers = auth_headers()
+    headers.update(kwargs.pop("headers", {}))
+    return session.request(method, f"{UPLOAD_URL}{path}", headers=headers, timeout=TIMEOUT, **kwargs)
+
+
+def start_upload(session, seed, size):
+    resp = call(session, "POST", json={
+        "documentName": f"Benchmark {size} bytes", "documentType": "exame_laboratorial",
+        "contentType": "application/pdf", "fileName": f"bench-{seed}.pdf",
+        "size": size, "sha256": file_sha256(seed, size),
+    })
+    assert resp.status_code in (200, 201), f"Starting upload failed: {resp.status_code} {resp.text}"
+    return resp.json()
+
+
+def send_chunks(session, seed, size, upload, stop_at=None):
+    """PATCH chunks from the server's offset; resumes from the reported offset after a failure."""
+    failures = 0
+    while upload["offset"] < size and (stop_at is None or upload["offset"] < stop_at):
+        offset = upload["offset"]
+        body = b"".join(file_blocks(seed, size, offset, min(offset + upload["chunk_size"], size)))
+        resp = call(session, "PATCH", f"/{upload['id']}", data=body, headers={
+            "Content-Type": "application/octet-stream", "Upload-Offset": str(offset),
+        })
+        if resp.status_code == 200:
+            upload, failures = resp.json()["upload"], 0
+            continue
+        failures += 1
+        assert failures <= 3, f"Chunk at {offset} kept failing: {resp.status_code} {resp.text}"
+        upload = call(session, "GET", f"/{upload['id']}").json()["upload"]
+    return upload
+
+
+def upload_file(size):
+    session = requests.Session()
+    seed = uuid.uuid4().hex
+    start = time.perf_counter()
+    started = start_upload(session, seed, size)
+    upload = send_chunks(session, seed, size, started["upload"])
+    transferred = time.perf_counter() - start
+
+    resp = call(session, "POST", f"/{upload['id']}/complete")
+    assert resp.status_code == 201, f"Completing upload failed: {resp.status_code} {resp.text}"
+    document = resp.json()["document"]
+    assert document["content_hash"] == file_sha256(seed, size), "Stored hash differs from the file sent"
+    return {
+        "seed": seed,
+        "document": document,
+        "transfer_s": transferred,
+        "total_s": time.perf_counter() - start,
+    }
+
+
+def run_level(size_mb, concurrency, sampler):
+    size = int(size_mb * 1024 * 1024)
+    baseline = sampler.read_kib("VmRSS:") if sampler else 0
+    first_sample = len(sampler.samples) if sampler else 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: upload_file(size), range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    print(f"\n== {size_mb:g} MB x {concurrency} concurrent ==")
+    print(f"aggregate throughput: {size * concurrency / elapsed / 1024 / 1024:.1f} MB/s")
+    print(format_summary("per-upload MB/s", [size / r["transfer_s"] / 1024 / 1024 for r in results], unit=""))
+    print(format_summary("complete (verify+commit)", [(r["total_s"] - r["transfer_s"]) * 1000 for r in results]))
+    growth_mb = None
+    if sampler:
+        window = sampler.samples[first_sample:] or [baseline]
+        growth_mb = (max(window) - baseline) / 1024
+        print(f"function RSS growth: {growth_mb:.1f}MiB over {baseline / 1024:.1f}MiB")
+    return results, growth_mb
+
+
+def check_resume_and_dedup():
+    session = requests.Session()
+    size = 20 * 1024 * 1024
+    seed = uuid.uuid4().hex
+
+    # Send part of the file, then "reload the page": the same file resumes where it stopped
+    first = start_upload(session, seed, size)
+    partial = send_chunks(session, seed, size, first["upload"], stop_at=size // 2)
+    resumed = start_upload(requests.Session(), seed, size)
+    assert resumed["upload"]["id"] == first["upload"]["id"], "Re-announcing the file opened a new upload"
+    assert resumed["upload"]["offset"] == partial["offset"], "Resume did not start at the stored offset"
+    upload = send_chunks(session, seed, size, resumed["upload"])
+    document = call(session, "POST", f"/{upload['id']}/complete").json()["document"]
+
+    # Uploading the same bytes again transfers nothing
+    start = time.perf_counter()
+    again = start_upload(session, seed, size)
+    assert again.get("deduplicated") and again["document"]["id"] == document["id"], "Duplicate file was stored again"
+    print(f"\nresume after {partial['offset']} bytes ok; duplicate detected in {(time.perf_counter() - start) * 1000:.0f}ms")
+    return {"seed": seed, "document": document}
+
+
+def check_concurrent_complete(parallel=4):
+    """Several /complete calls racing for one upload all get the same document, and its file survives."""
+    session = requests.Session()
+    size = 2 * 1024 * 1024
+    seed = uuid.uuid4().hex
+    upload = send_chunks(session, seed, size, start_upload(session, seed, size)["upload"])
+
+    def complete(_):
+        for _attempt in range(10):
+            resp = call(requests.Session(), "POST", f"/{upload['id']}/complete")
+            if resp.status_code != 409:
+                return resp
+            time.sleep(float(resp.headers.get("Retry-After", "1")))
+        return resp
+
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        responses = list(pool.map(complete, range(parallel)))
+    assert all(r.status_code in (200, 201) for r in responses), (
+        f"Concurrent /complete failed: {[(r.status_code, r.text) for r in responses]}"
+    )
+    documents = {r.json()["document"]["id"] for r in responses}
+    assert len(documents) == 1, f"Concurrent /complete created {len(documents)} documents"
+    document = responses[0].json()["document"]
+    if SUPABASE_URL and SUPABASE_ANON_KEY:
+        stored = requests.head(f"{SUPABASE_URL}/storage/v1/object/authenticated/health-documents/{document['storage_path']}",
+                               headers={"Authorization": f"Bearer {ACCESS_TOKEN}", "apikey": SUPABASE_ANON_KEY},
+                               timeout=TIMEOUT)
+        assert stored.status_code == 200, f"File behind the document is gone after concurrent /complete: {stored.status_code}"
+    print(f"{parallel} concurrent /complete calls -> one document ({sorted(r.status_code for r in responses)})")
+    return {"seed": seed, "document": document}
+
+
+def cleanup(results):
+    if not (SUPABASE_URL and SUPABASE_ANON_KEY):
+        print(f"\n{len(results)} benchmark documents left in place (set SUPABASE_URL/SUPABASE_ANON_KEY to remove)")
+        return
+    headers = {"Authorization": f"Bearer {ACCESS_TOKEN}", "apikey": SUPABASE_ANON_KEY}
+    for r in results:
+        document = r["document"]
+        requests.delete(f"{SUPABASE_URL}/storage/v1/object/health-documents/{document['storage_path']}",
+                        headers=headers, timeout=TIMEOUT)
+        requests.delete(f"{SUPABASE_URL}/rest/v1/patient_documents", params={"id": f"eq.{document['id']}"},
+                        headers=headers, timeout=TIMEOUT)
+
+
+def test_document_upload():
+    assert ACCESS_TOKEN, "Set ACCESS_TOKEN to a patient's JWT"
+
+    sampler = RssSampler(FUNCTION_PID) if FUNCTION_PID else None
+    if sampler:
+        sampler.start()
+    created = []
+    growth = {}
+    try:
+        created.append(check_resume_and_dedup())
+        created.append(check_concurrent_complete())
+        for size_mb in FILE_SIZES_MB:
+            for concurrency in CONCURRENCY:
+                results, growth_mb = run_level(size_mb, concurrency, sampler)
+                created.extend(results)
+                growth[(size_mb, concurrency)] = growth_mb
+        print(f"\nbenchmark client peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f}MiB")
+    finally:
+        if sampler:
+            sampler.stopped.set()
+        cleanup(created)
+
+    if sampler:
+        over = {k: g for k, g in growth.items() if g > MAX_FUNCTION_RSS_GROWTH_MB}
+        assert not over, f"Function memory grew past {MAX_FUNCTION_RSS_GROWTH_MB}MiB: {over}"
+
+
+test_document_upload()
@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+
+import requests
+
+from fault_proxy import FaultProxy
+from perf_utils import TIMEOUT, format_summary, percentile, retrying_session
+
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:8080")
+# Same endpoint TC008 polls for uptime
+PROBE_PATH = os.environ.get("PROBE_PATH", "/health")
+DURATION_S = float(os.environ.get("DURATION_S", "10"))
+CONCURRENCY = int(os.environ.get("CONCURRENCY", "8"))
+SCENARIOS = [s for s in os.environ.get("SCENARIOS", "baseline,slow,throttled,flaky,outage").split(",") if s]
+
+# Network conditions between the client and BASE_URL
+FAULT_SCENARIOS = {
+    "baseline": {},
+    "slow": {"latency_ms": 150, "jitter_ms": 100},
+    "throttled": {"bandwidth_kbps": 512},
+    "flaky": {"reset_ratio": 0.05, "error_ratio": 0.05},
+    # A few hung requests plus a 503 burst a third of the way through the run
+    "outage": {"blackhole_ratio": 0.02, "latency_ms": 50},
+}
+OUTAGE_BURST_S = float(os.environ.get("OUTAGE_BURST_S", "3"))
+
+# Client settings: (timeout, retries, backoff_factor). flat-30s is what the TC0xx scripts use today.
+POLICIES = {
+    "flat-30s": (TIMEOUT, 0, 0.0),
+    "5s+2retries": ((2, 5), 2, 0.2),
+    "2s+3retries": ((1, 2), 3, 0.1),
+}
+
+
+def run_load(url, timeout, retries, backoff):
+    """Closed-loop load for DURATION_S; returns [(latency_ms, ok)] per logical request."""
+    results = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + DURATION_S
+
+    def worker():
+        session = retrying_session(retries, backoff)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                ok = session.get(url, timeout=timeout).status_code < 500
+            except requests.RequestException:
+                ok = False
+            with lock:
+                results.append(((time.perf_counter() - start) * 1000, ok))
+
+    threads = [threading.Thread(target=worker) for _ in range(CONCURRENCY)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_fault_tolerance():
+    proxy = FaultProxy(BASE_URL, seed=36).start()
+    url = f"{proxy.url}{PROBE_PATH}"
+    report = {}
+    try:
+        for scenario in SCENARIOS:
+            for policy, (timeout, retries, backoff) in POLICIES.items():
+                proxy.reset()
+                proxy.configure(**FAULT_SCENARIOS[scenario])
+                burst = None
+                if scenario == "outage":
+                    burst = threading.Timer(DURATION_S / 3, proxy.error_burst, args=(OUTAGE_BURST_S, 503))
+                    burst.start()
+                proxy.take_counts()
+
+                start = time.perf_counter()
+                results = run_load(url, timeout, retries, backoff)
+                elapsed = time.perf_counter() - start
+                if burst:
+                    burst.cancel()
+
+                counts = proxy.take_counts()
+                latencies = [r[0] for r in results]
+                succeeded = sum(1 for r in results if r[1])
+                report[(scenario, policy)] = {
+                    "success": succeeded / len(results) if results else 0.0,
+                    "goodput": succeeded / elapsed,
+                    "p99": percentile(latencies, 99),
+                }
+                # Upstream attempts per logical request: the extra load retries put on a struggling backend
+                amplification = sum(counts.values()) / len(results) if results else 0.0
+                print(f"\n== {scenario} / {policy} ==")
+                print(format_summary("request latency", latencies))
+                print(f"success={succeeded / len(results):.1%} goodput={succeeded / elapsed:.1f} req/s "
+                      f"attempts/request={amplification:.2f} proxy={counts}")
+
+        print("\n== summary (success / goodput req/s / p99 ms) ==")
+        for scenario in SCENARIOS:
+            cells = [f"{policy}: {r['success']:.1%} / {r['goodput']:.1f} / {r['p99']:.0f}"
+                     for policy in POLICIES for r in [report[(scenario, policy)]]]
+            print(f"{scenario:<10} " + " | ".join(cells))
+
+        if "baseline" in SCENARIOS:
+            for policy in POLICIES:
+                assert report[("baseline", policy)]["success"] == 1.0, f"{PROBE_PATH} failed without injected faults"
+        if "flaky" in SCENARIOS:
+            flat = report[("flaky", "flat-30s")]["success"]
+            for policy in POLICIES:
+                if POLICIES[policy][1]:
+                    assert report[("flaky", policy)]["success"] > flat, (
+                        f"{policy} retried but did not beat flat-30s on resets/5xx ({flat:.1%})"
+                    )
+    finally:
+        proxy.stop()
+
+
+test_fault_tolerance()
@@ -0,0 +1,148 @@
+import os
+import time
+
+from fake_postgrest import FakePostgrest
+from fhir_export_client import iter_export
+from perf_utils import RssSampler
+
+# fhir-export served with plain Deno against the in-memory store, e.g.
+#   SUPABASE_URL=http://127.0.0.1:54399 SUPABASE_SERVICE_ROLE_KEY=bench \
+#       deno run -A supabase/functions/fhir-export/index.ts
+FHIR_EXPORT_URL = os.environ.get("FHIR_EXPORT_URL", "http://127.0.0.1:8000")
+FAKE_DB_PORT = int(os.environ.get("FAKE_DB_PORT", "54399"))
+FUNCTION_PID = os.environ.get("FUNCTION_PID")
+
+PATIENTS = int(os.environ.get("PATIENTS", "5000"))
+OBSERVATIONS = int(os.environ.get("OBSERVATIONS", "500000"))
+# Fail one database page mid-export to exercise cursor resumption (0 disables)
+FAIL_PAGE = int(os.environ.get("FAIL_PAGE", "7"))
+CHECKPOINT_EVERY = int(os.environ.get("CHECKPOINT_EVERY", "50000"))
+# RSS may move this much between checkpoints; anything proportional to the export fails
+MAX_RSS_DRIFT_MB = float(os.environ.get("MAX_RSS_DRIFT_MB", "32"))
+
+API_KEY = "bench-export-key"
+LOINC = [("8867-4", "Heart rate", "/min"), ("8310-5", "Body temperature", "Cel"),
+         ("29463-7", "Body weight", "kg"), ("33747-0", "Glucose", "mg/dL")]
+
+
+def resource_id(kind, index):
+    # Ids sort in index order, so the fake can seek a keyset cursor without an index.
+    # Patients are keyed by uuid (profiles.id), observations by bigint (health_metrics.id).
+    if kind == 0x9000:
+        return str(index + 1)
+    return f"{index:08x}-0000-4000-{kind:04x}-{index:012x}"
+
+
+def resource_index(value):
+    return int(value) - 1 if value.isdigit() else int(value.split("-")[-1], 16)
+
+
+def make_patient(index):
+    return {
+        "resourceType": "Patient", "id": resource_id(0x8000, index), "active": True,
+        "name": [{"use": "official", "text": f"Paciente {index}"}],
+        "telecom": [{"system": "email", "value": f"patient{index}@bench.test", "use": "home"}],
+        "meta": {"lastUpdated": "2026-01-01T00:00:00Z", "source": f"#{index}"},
+    }
+
+
+def make_observation(index):
+    code, display, unit = LOINC[index % len(LOINC)]
+    return {
+        "resourceType": "Observation", "id": resource_id(0x9000, index), "status": "final",
+        "category": [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/observation-category",
+                                  "code": "vital-signs", "display": "Vital Signs"}]}],
+        "code": {"coding": [{"system": "http://loinc.org", "code": code, "display": display}]},
+        "subject": {"reference": f"Patient/{resource_id(0x8000, index % PATIENTS)}"},
+        "effectiveDateTime": "2026-01-01T08:00:00Z",
+        "valueQuantity": {"value": 50 + index % 100, "unit": unit, "system": "http://unitsofmeasure.org"},
+    }
+
+
+SOURCES = {"Patient": (PATIENTS, make_patient), "Observation": (OBSERVATIONS, make_observation)}
+
+
+def register_export_rpcs(store):
+    """Stand-ins for fhir_export_page / fhir_export_next_cursor, generating resources on demand."""
+    calls = {"page": 0}
+
+    def first_index(args):
+        return resource_index(args["p_after"]) + 1 if args.get("p_after") else 0
+
+    def page(args, _store):
+        calls["page"] += 1
+        if calls["page"] == FAIL_PAGE:
+            raise ValueError("simulated statement timeout")
+        total, build = SOURCES[args["p_resource_type"]]
+        start = first_index(args)
+        resources = (build(i) for i in range(start, min(start + args["p_limit"], total)))
+        return [{"id": r["id"], "resource": r} for r in resources]
+
+    def next_cursor(args, _store):
+        total, build = SOURCES[args["p_resource_type"]]
+        last = first_index(args) + args["p_count"] - 1
+        return build(last)["id"] if last + 1 < total else None
+
+    store.register_rpc("fhir_export_page", page)
+    store.register_rpc("fhir_export_next_cursor", next_cursor)
+
+
+def self_rss_mb():
+    return RssSampler(os.getpid()).read_kib("VmRSS:") / 1024
+
+
+def test_fhir_export():
+    store = FakePostgrest(port=FAKE_DB_PORT).start()
+    sampler = RssSampler(FUNCTION_PID) if FUNCTION_PID else None
+    try:
+        store.seed("external_data_sources", [{"name": "Bench Partner", "api_key": API_KEY, "is_active": True}])
+        register_export_rpcs(store)
+        headers = {"x-api-key": API_KEY, "Accept-Encoding": "gzip"}
+
+        if sampler:
+            sampler.start()
+        counts, last_index, checkpoints, stats = {}, {}, [], {}
+        start = time.perf_counter()
+        for resource_type, resource in iter_export(f"{FHIR_EXPORT_URL}/$export", headers, stats=stats):
+            index = resource_index(resource["id"])
+            # Keyset order: each resource follows the previous one, none skipped or repeated
+            assert index == last_index.get(resource_type, -1) + 1, (
+                f"{resource_type} stream jumped from {last_index.get(resource_type)} to {index}"
+            )
+            last_index[resource_type] = index
+            counts[resource_type] = counts.get(resource_type, 0) + 1
+            total = sum(counts.values())
+            if total % CHECKPOINT_EVERY == 0:
+                function_mb = sampler.read_kib("VmRSS:") / 1024 if sampler else None
+                checkpoints.append((total, time.perf_counter() - start, self_rss_mb(), function_mb))
+        elapsed = time.perf_counter() - start
+        if sampler:
+            sampler.stopped.set()
+
+        total = sum(counts.values())
+        print(f"\n== exported {total} resources ({counts}) in {elapsed:.1f}s ==")
+        print(f"throughput: {total / elapsed:.0f} resources/s, {stats.get('bytes', 0) / elapsed / 1024 / 1024:.1f} MB/s NDJSON")
+        print(f"pages={stats.get('pages', 0)} resumes={stats.get('resumes', 0)}")
+        for n, t, client_mb, function_mb in checkpoints:
+            function = f" function RSS={function_mb:.1f}MiB" if function_mb is not None else ""
+            print(f"  {n:>8} resources @ {t:6.1f}s  consumer RSS={client_mb:.1f}MiB{function}")
+        if sampler:
+            print(sampler.report())
+
+        assert counts.get("Patient") == PATIENTS, f"Expected {PATIENTS} patients, got {counts.get('Patient')}"
+        assert counts.get("Observation") == OBSERVATIONS, f"Expected {OBSERVATIONS} observations, got {counts.get('Observation')}"
+        if FAIL_PAGE:
+            assert stats.get("resumes"), "The injected page failure did not trigger a resume"
+
+        # Constant memory: RSS after warm-up must not trend with the number of resources
+        steady = checkpoints[1:]
+        for column, label in ((2, "consumer"), (3, "function")):
+            values = [c[column] for c in steady if c[column] is not None]
+            if len(values) >= 2:
+                drift = max(values) - min(values)
+                assert drift <= MAX_RSS_DRIFT_MB, f"{label} RSS drifted {drift:.1f}MiB during the export"
+    finally:
+        store.stop()
+
+
+test_fhir_export()
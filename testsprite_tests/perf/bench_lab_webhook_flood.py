@@ -0,0 +1,129 @@
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_postgrest import FakePostgrest
+from perf_utils import TIMEOUT, RssSampler, format_summary
+
+# webhook-lab-results served with plain Deno against the in-memory store, e.g.
+#   SUPABASE_URL=http://127.0.0.1:54399 SUPABASE_SERVICE_ROLE_KEY=bench \
+#       deno run -A supabase/functions/webhook-lab-results/index.ts
+LAB_WEBHOOK_URL = os.environ.get("LAB_WEBHOOK_URL", "http://127.0.0.1:8000")
+FAKE_DB_PORT = int(os.environ.get("FAKE_DB_PORT", "54399"))
+# PID of the Deno process, to sample its resident memory from /proc
+FUNCTION_PID = os.environ.get("FUNCTION_PID")
+
+BATCHES = int(os.environ.get("BATCHES", "40"))
+RESULTS_PER_BATCH = int(os.environ.get("RESULTS_PER_BATCH", "2000"))
+PATIENTS = int(os.environ.get("PATIENTS", "5000"))
+# Share of batches the lab delivers twice (retries after a timeout)
+REDELIVERY_RATIO = float(os.environ.get("REDELIVERY_RATIO", "0.25"))
+CONCURRENCY = int(os.environ.get("CONCURRENCY", "8"))
+DRAIN_TIMEOUT_S = float(os.environ.get("DRAIN_TIMEOUT_S", "300"))
+# Database round trips allowed per 1,000 results (the old per-result loop needed ~4,000)
+MAX_ROUND_TRIPS_PER_1000 = float(os.environ.get("MAX_ROUND_TRIPS_PER_1000", "25"))
+
+API_KEY = "bench-lab-key"
+TEST_TYPES = ["glucose", "cholesterol", "hemoglobin", "white_blood_cells", "vitamin_d"]
+
+
+def seed_store(store):
+    source_id = str(uuid.uuid4())
+    store.seed("external_data_sources", [{"id": source_id, "name": "Bench Lab", "api_key": API_KEY, "is_active": True}])
+    patients = [{"id": str(uuid.uuid4()), "email": f"patient{i}@bench.test", "display_name": f"Paciente {i}"}
+                for i in range(PATIENTS)]
+    store.seed("profiles", patients)
+    store.seed("user_consents", [{"patient_id": p["id"], "source_id": source_id, "status": "granted"}
+                                 for p in patients])
+    return patients
+
+
+def make_batch(index, patients):
+    rng = random.Random(index)
+    results = []
+    for n in range(RESULTS_PER_BATCH):
+        patient = rng.choice(patients)
+        results.append({
+            "patient_identifier": patient["email"],
+            "patient_name": patient["display_name"],
+            "test_name": f"Exame {n % 50}",
+            "test_type": rng.choice(TEST_TYPES),
+            "value": round(rng.uniform(1, 300), 2),
+            "unit": "mg/dL",
+            "status": rng.choice(["normal", "abnormal", "critical"]),
+            "collected_at": f"2026-01-{1 + n % 28:02d}T08:00:00Z",
+            "reported_at": "2026-02-01T12:00:00Z",
+            "lab_order_id": f"ORD-{index}-{n}",
+        })
+    return {"source": "bench-lab", "results": results,
+            "metadata": {"lab_name": "Bench Lab", "batch_id": f"batch-{index}", "version": "1.0"}}
+
+
+def deliver(session_payload):
+    index, payload = session_payload
+    start = time.perf_counter()
+    resp = requests.post(LAB_WEBHOOK_URL, json=payload, headers={"x-api-key": API_KEY}, timeout=TIMEOUT)
+    return index, resp.status_code, (time.perf_counter() - start) * 1000
+
+
+def test_lab_webhook_flood():
+    store = FakePostgrest(unique={"health_metrics": ["external_id"]}, port=FAKE_DB_PORT).start()
+    sampler = RssSampler(FUNCTION_PID) if FUNCTION_PID else None
+    try:
+        patients = seed_store(store)
+        batches = [(i, make_batch(i, patients)) for i in range(BATCHES)]
+        redelivered = batches[: int(BATCHES * REDELIVERY_RATIO)]
+        deliveries = batches + redelivered
+        random.Random(42).shuffle(deliveries)
+        expected_rows = BATCHES * RESULTS_PER_BATCH
+        requests_before = store.total_requests()
+
+        if sampler:
+            sampler.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+            acks = list(pool.map(deliver, deliveries))
+        acked_s = time.perf_counter() - start
+
+        # 202 deliveries finish in the background; wait until the store has gone quiet
+        last_seen, quiet_since = -1, time.perf_counter()
+        while time.perf_counter() - start < DRAIN_TIMEOUT_S:
+            seen = store.total_requests()
+            if seen != last_seen:
+                last_seen, quiet_since = seen, time.perf_counter()
+            elif time.perf_counter() - quiet_since >= 1.0:
+                break
+            time.sleep(0.2)
+        completed_s = quiet_since - start
+        if sampler:
+            sampler.stopped.set()
+
+        rows = store.rows("health_metrics")
+        external_ids = [r["external_id"] for r in rows]
+        round_trips = store.total_requests() - requests_before
+        delivered_results = len(deliveries) * RESULTS_PER_BATCH
+
+        print(f"\n== {len(deliveries)} deliveries ({len(redelivered)} redelivered) x {RESULTS_PER_BATCH} results ==")
+        print(f"acked in {acked_s:.2f}s ({delivered_results / acked_s:.0f} results/s acknowledged)")
+        print(f"ingested {len(rows)} rows in {completed_s:.2f}s ({len(rows) / completed_s:.0f} results/s stored)")
+        print(format_summary("ack latency", [a[2] for a in acks]))
+        print(f"database round trips: {round_trips} ({round_trips / delivered_results * 1000:.1f} per 1000 results)")
+        if sampler:
+            print(sampler.report())
+
+        bad_acks = [a for a in acks if a[1] not in (200, 202)]
+        assert not bad_acks, f"Webhook rejected deliveries: {bad_acks[:5]}"
+        assert len(set(external_ids)) == len(external_ids), "Duplicate health_metrics rows for the same result key"
+        assert len(rows) == expected_rows, f"Expected {expected_rows} ingested results, found {len(rows)}"
+        assert round_trips / delivered_results * 1000 <= MAX_ROUND_TRIPS_PER_1000, (
+            f"{round_trips} database round trips for {delivered_results} results"
+        )
+    finally:
+        store.stop()
+
+
+test_lab_webhook_flood()
@@ -0,0 +1,218 @@
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+
+import requests
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from perf_utils import TIMEOUT
+
+BASE_URL = os.environ.get("BASE_URL", "http://localhost:8080")
+
+# Same device profiles as TC007
+USER_AGENTS = {
+    "desktop": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)"
+               " Chrome/115.0.0.0 Safari/537.36",
+    "mobile": "Mozilla/5.0 (iPhone; CPU iPhone OS 15_0 like Mac OS X) AppleWebKit/605.1.15"
+              " (KHTML, like Gecko) Version/15.0 Mobile/15E148 Safari/604.1",
+    "tablet": "Mozilla/5.0 (iPad; CPU OS 15_0 like Mac OS X) AppleWebKit/605.1.15"
+              " (KHTML, like Gecko) Version/15.0 Mobile/15E148 Safari/604.1",
+    "screen_reader": "Mozilla/5.0 (compatible; NVDA 2021.2; Windows NT 10.0; Win64; x64)",
+}
+
+ROUTES = ["/", "/login", "/agendamento", "/dashboard-medico"]
+# App.tsx imports every page eagerly, so each route ships the same entry bundle:
+# one budget for the compressed HTML plus its render-critical assets, not one per route
+BUNDLE_BUDGET = int(os.environ.get("BUNDLE_BUDGET", "450000"))
+
+# Lighthouse-style simulated 3G: 150 ms RTT, 1.6 Mbps down
+SIMULATED_RTT_S = 0.150
+SIMULATED_BANDWIDTH_BPS = 1_600_000
+COMPLETION_BUDGET_S = 3.0
+# Browsers open at most six HTTP/1.1 connections per host
+MAX_CONNECTIONS = 6
+
+CRITICAL_KINDS = {"script", "stylesheet", "modulepreload", "font"}
+TEXT_TYPES = ("javascript", "css", "html", "json", "svg")
+CSS_URL_RE = re.compile(r"url\(\s*['\"]?([^'\")]+)['\"]?\s*\)")
+
+
+class AssetCollector(HTMLParser):
+    LINK_KINDS = {
+        "stylesheet": "stylesheet",
+        "modulepreload": "modulepreload",
+        "preload": "preload",
+        "icon": "icon",
+        "apple-touch-icon": "icon",
+        "manifest": "manifest",
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.assets = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "script" and attrs.get("src"):
+            self.assets.append(("script", attrs["src"]))
+        elif tag == "link" and attrs.get("href"):
+            rel = (attrs.get("rel") or "").lower()
+            kind = self.LINK_KINDS.get(rel)
+            if kind == "preload" and attrs.get("as") == "font":
+                kind = "font"
+            if kind:
+                self.assets.append((kind, attrs["href"]))
+        elif tag == "img" and attrs.get("src"):
+            self.assets.append(("image", attrs["src"]))
+
+
+# Only advertise encodings we can decode, so CSS can still be scanned for fonts
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli else "gzip, deflate"
+
+_local = threading.local()
+
+
+def _session(user_agent):
+    # One keep-alive connection per worker, like a browser connection slot
+    if getattr(_local, "session", None) is None:
+        _local.session = requests.Session()
+    _local.session.headers.update({
+        "User-Agent": user_agent,
+        "Accept-Encoding": ACCEPT_ENCODING,
+    })
+    return _local.session
+
+
+def decode_body(raw, encoding):
+    if encoding == "gzip":
+        return zlib.decompress(raw, 16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompress(raw)
+    if encoding == "br":
+        return brotli.decompress(raw) if brotli else None
+    return raw
+
+
+def fetch(url, kind, user_agent):
+    session = _session(user_agent)
+    start = time.perf_counter()
+    resp = session.get(url, stream=True, timeout=TIMEOUT)
+    raw = resp.raw.read(decode_content=False)
+    elapsed = time.perf_counter() - start
+    encoding = resp.headers.get("Content-Encoding", "").lower()
+    body = decode_body(raw, encoding)
+    return {
+        "url": url,
+        "kind": kind,
+        "status": resp.status_code,
+        "wire_bytes": len(raw),
+        "decoded_bytes": len(body) if body is not None else None,
+        "body": body,
+        "encoding": encoding or "identity",
+        "content_type": resp.headers.get("Content-Type", ""),
+        "cache_control": resp.headers.get("Cache-Control", ""),
+        "elapsed_s": elapsed,
+    }
+
+
+def same_origin(url):
+    return urlparse(url).netloc == urlparse(BASE_URL).netloc
+
+
+def simulate_3g(html, critical):
+    """Estimate completion time: HTML first, then critical assets over six connections."""
+    total = 2 * SIMULATED_RTT_S + html["wire_bytes"] * 8 / SIMULATED_BANDWIDTH_BPS
+    if critical:
+        waves = math.ceil(len(critical) / MAX_CONNECTIONS)
+        wire = sum(a["wire_bytes"] for a in critical)
+        total += waves * SIMULATED_RTT_S + wire * 8 / SIMULATED_BANDWIDTH_BPS
+    return total
+
+
+def load_route(route, device, user_agent):
+    html = fetch(urljoin(BASE_URL, route), "document", user_agent)
+    assert html["status"] == 200, f"{device} {route}: HTML returned {html['status']}"
+
+    collector = AssetCollector()
+    collector.feed((html["body"] or b"").decode("utf-8", "replace"))
+    seen = {}
+    for kind, ref in collector.assets:
+        url = urljoin(html["url"], ref)
+        if same_origin(url) and url not in seen:
+            seen[url] = kind
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=MAX_CONNECTIONS) as pool:
+        assets = list(pool.map(lambda item: fetch(item[0], item[1], user_agent), seen.items()))
+
+        # Fonts and images referenced from stylesheets are discovered one round later
+        nested = {}
+        for asset in assets:
+            if asset["kind"] == "stylesheet" and asset["body"]:
+                for ref in CSS_URL_RE.findall(asset["body"].decode("utf-8", "replace")):
+                    url = urljoin(asset["url"], ref)
+                    if not ref.startswith("data:") and same_origin(url) and url not in seen:
+                        nested[url] = "font" if re.search(r"\.(woff2?|ttf|otf)$", url) else "image"
+        assets += list(pool.map(lambda item: fetch(item[0], item[1], user_agent), nested.items()))
+    wall_s = time.perf_counter() - start + html["elapsed_s"]
+
+    return html, assets, wall_s
+
+
+def report(route, device, html, assets, wall_s, simulated_s, critical_bytes):
+    print(f"\n== {device} {route}: critical={critical_bytes / 1024:.1f}KiB "
+          f"local={wall_s:.2f}s simulated-3g={simulated_s:.2f}s ==")
+    for a in [html] + assets:
+        decoded = f"{a['decoded_bytes'] / 1024:.1f}KiB" if a["decoded_bytes"] is not None else "?"
+        print(f"  {a['kind']:<13} {a['status']} wire={a['wire_bytes'] / 1024:7.1f}KiB decoded={decoded:>10} "
+              f"enc={a['encoding']:<8} cache='{a['cache_control']}' {urlparse(a['url']).path}")
+
+
+def lint_headers(asset):
+    warnings = []
+    is_text = any(t in asset["content_type"] for t in TEXT_TYPES)
+    if is_text and asset["encoding"] == "identity" and asset["wire_bytes"] > 1024:
+        warnings.append(f"uncompressed {asset['content_type']} ({asset['wire_bytes']} bytes)")
+    # Vite emits content-hashed files under /assets/, which can be cached forever
+    if "/assets/" in asset["url"] and "immutable" not in asset["cache_control"] \
+            and "max-age=31536000" not in asset["cache_control"]:
+        warnings.append("hashed asset without long-lived Cache-Control")
+    return warnings
+
+
+def test_page_load_waterfall():
+    failures = []
+    for device, user_agent in USER_AGENTS.items():
+        for route in ROUTES:
+            html, assets, wall_s = load_route(route, device, user_agent)
+            critical = [a for a in assets if a["kind"] in CRITICAL_KINDS]
+            critical_bytes = html["wire_bytes"] + sum(a["wire_bytes"] for a in critical)
+            simulated_s = simulate_3g(html, critical)
+            report(route, device, html, assets, wall_s, simulated_s, critical_bytes)
+
+            for a in assets:
+                if a["status"] != 200:
+                    failures.append(f"{device} {route}: {a['url']} returned {a['status']}")
+                for warning in lint_headers(a):
+                    print(f"  warning: {urlparse(a['url']).path}: {warning}")
+            if critical_bytes > BUNDLE_BUDGET:
+                failures.append(f"{device} {route}: {critical_bytes} critical bytes exceed bundle budget "
+                                f"{BUNDLE_BUDGET}")
+            if simulated_s > COMPLETION_BUDGET_S:
+                failures.append(f"{device} {route}: simulated 3G load {simulated_s:.2f}s exceeds "
+                                f"{COMPLETION_BUDGET_S}s")
+
+    assert not failures, "Page-load budgets exceeded:\n" + "\n".join(failures)
+
+
+test_page_load_waterfall()
@@ -0,0 +1,110 @@
+import datetime
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from perf_utils import FUNCTIONS_URL, TIMEOUT, auth_headers, format_summary, parse_server_timing, percentile
+
+APPOINTMENTS_URL = f"{FUNCTIONS_URL}/appointments"
+DOCTOR_ID = os.environ.get("DOCTOR_ID", "")
+ITERATIONS = int(os.environ.get("ITERATIONS", "40"))
+CONCURRENCY = int(os.environ.get("CONCURRENCY", "10"))
+
+
+def timed_request(session, method, url, **kwargs):
+    start = time.perf_counter()
+    resp = session.request(method, url, headers=auth_headers(), timeout=TIMEOUT, **kwargs)
+    client_ms = (time.perf_counter() - start) * 1000
+    return resp, {
+        "request_id": resp.headers.get("X-Request-Id"),
+        "status": resp.status_code,
+        "client_ms": client_ms,
+        "spans": parse_server_timing(resp.headers.get("Server-Timing")),
+    }
+
+
+def booking_round(slot_index):
+    """Availability check + booking + cleanup for one distinct slot (mirrors TC002/TC010)."""
+    session = requests.Session()
+    slot = (datetime.datetime.utcnow() + datetime.timedelta(days=30)).replace(
+        hour=8, minute=0, second=0, microsecond=0
+    ) + datetime.timedelta(minutes=30 * slot_index)
+    slot_iso = slot.isoformat() + "Z"
+    samples = []
+
+    _, sample = timed_request(
+        session, "GET", f"{APPOINTMENTS_URL}/doctors/{DOCTOR_ID}/availability", params={"datetime": slot_iso}
+    )
+    samples.append(("GET availability", sample))
+
+    resp, sample = timed_request(
+        session, "POST", APPOINTMENTS_URL,
+        json={"doctor_id": DOCTOR_ID, "datetime": slot_iso, "reason": "Server-Timing benchmark"},
+    )
+    samples.append(("POST appointments", sample))
+
+    if resp.status_code == 201:
+        appointment_id = resp.json().get("id")
+        session.delete(f"{APPOINTMENTS_URL}/{appointment_id}", headers=auth_headers(), timeout=TIMEOUT)
+    return samples
+
+
+def report(endpoint, samples):
+    print(f"\n== {endpoint} ==")
+    client = [s["client_ms"] for s in samples]
+    server = [s["spans"].get("total", {}).get("dur", 0.0) for s in samples]
+    print(format_summary("client", client))
+    print(format_summary("server total", server))
+    print(format_summary("network+gateway", [c - s for c, s in zip(client, server)]))
+
+    phases = defaultdict(list)
+    for s in samples:
+        for name, metric in s["spans"].items():
+            if name != "total":
+                phases[name].append(metric["dur"])
+    for name, durations in sorted(phases.items()):
+        print(format_summary(f"  {name}", durations))
+
+    # Attribute the tail: which phase dominated each request at or above client p99
+    cutoff = percentile(client, 99)
+    dominant = Counter()
+    for s in samples:
+        if s["client_ms"] < cutoff:
+            continue
+        spans = {k: v["dur"] for k, v in s["spans"].items() if k != "total"}
+        total = s["spans"].get("total", {}).get("dur", 0.0)
+        spans["network+gateway"] = s["client_ms"] - total
+        dominant[max(spans, key=spans.get)] += 1
+        print(f"  tail request {s['request_id']}: {s['client_ms']:.1f}ms -> "
+              + ", ".join(f"{k}={v:.1f}" for k, v in sorted(spans.items())))
+    if dominant:
+        print(f"  tail dominated by: {dict(dominant)}")
+
+
+def test_server_timing_correlation():
+    assert DOCTOR_ID, "Set DOCTOR_ID to a doctor profile id that accepts bookings"
+
+    by_endpoint = defaultdict(list)
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        for samples in pool.map(booking_round, range(ITERATIONS)):
+            for endpoint, sample in samples:
+                by_endpoint[endpoint].append(sample)
+
+    for endpoint, samples in by_endpoint.items():
+        missing = [s for s in samples if not s["request_id"] or "total" not in s["spans"]]
+        assert not missing, f"{endpoint}: {len(missing)} responses without Server-Timing/X-Request-Id"
+        ids = [s["request_id"] for s in samples]
+        assert len(set(ids)) == len(ids), f"{endpoint}: request ids are not unique"
+        for s in samples:
+            server_total = s["spans"]["total"]["dur"]
+            assert server_total <= s["client_ms"] + 1, (
+                f"{endpoint} {s['request_id']}: server total {server_total:.1f}ms exceeds "
+                f"client time {s['client_ms']:.1f}ms"
+            )
+        report(endpoint, samples)
+
+
+test_server_timing_correlation()
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_postgrest import FakePostgrest
+from perf_utils import TIMEOUT, format_summary
+
+# appointments served with plain Deno against the in-memory store, e.g.
+#   SUPABASE_URL=http://127.0.0.1:54399 SUPABASE_SERVICE_ROLE_KEY=bench SUPABASE_ANON_KEY=bench \
+#       deno run -A supabase/functions/appointments/index.ts
+APPOINTMENTS_URL = os.environ.get("APPOINTMENTS_URL", "http://127.0.0.1:8000")
+FAKE_DB_PORT = int(os.environ.get("FAKE_DB_PORT", "54399"))
+
+# Logged-in sessions, each making REQUESTS_PER_USER authenticated calls
+USERS = int(os.environ.get("USERS", "60"))
+REQUESTS_PER_USER = int(os.environ.get("REQUESTS_PER_USER", "10"))
+CONCURRENCY = int(os.environ.get("CONCURRENCY", "16"))
+# Must match the function's AUTH_VERIFY_TIMEOUT_MS: with Auth slower than this, calls answer 503 in time
+AUTH_VERIFY_TIMEOUT_MS = int(os.environ.get("AUTH_VERIFY_TIMEOUT_MS", "5000"))
+
+
+def run_concurrently(fn, items):
+    """Runs fn(session, item) on CONCURRENCY threads; returns ([(latency_ms, ok, result)], elapsed_s)."""
+    local = threading.local()
+
+    def timed(item):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            ok, result = fn(local.session, item)
+        except requests.RequestException:
+            ok, result = False, None
+        return (time.perf_counter() - start) * 1000, ok, result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        results = list(pool.map(timed, items))
+    return results, time.perf_counter() - start
+
+
+def authenticated_calls(tokens, repeat=REQUESTS_PER_USER):
+    """Availability calls, `repeat` per token; each result carries (status, Retry-After)."""
+    def call(session, token):
+        resp = session.get(f"{APPOINTMENTS_URL}/doctors/bench-doctor/availability",
+                           params={"datetime": "2030-01-07T09:00:00"},
+                           headers={"Authorization": f"Bearer {token}"}, timeout=TIMEOUT)
+        return resp.status_code == 200, (resp.status_code, resp.headers.get("Retry-After"))
+
+    return run_concurrently(call, [t for t in tokens for _ in range(repeat)])
+
+
+def new_sessions(store, prefix):
+    tokens = []
+    for _ in range(USERS):
+        token = f"{prefix}-{uuid.uuid4().hex}"
+        store.add_user(token, {"id": str(uuid.uuid4()), "aud": "authenticated", "role": "authenticated",
+                               "email": f"testuser_{uuid.uuid4().hex}@example.com"})
+        tokens.append(token)
+    return tokens
+
+
+def test_session_cache():
+    store = FakePostgrest(port=FAKE_DB_PORT).start()
+    try:
+        # Repeated requests with the same sessions: the function should verify each token once
+        session_tokens = new_sessions(store, "session")
+        verifications_before = store.request_counts.get(("GET", "user"), 0)
+        calls, calls_s = authenticated_calls(session_tokens)
+        verifications = store.request_counts.get(("GET", "user"), 0) - verifications_before
+        print(f"\n== {len(calls)} authenticated calls over {len(session_tokens)} sessions ==")
+        print(format_summary("appointments availability", [r[0] for r in calls]))
+        print(f"calls/s={len(calls) / calls_s:.1f} auth verifications={verifications} "
+              f"({verifications / len(calls):.2f} per call)")
+
+        assert all(ok for _, ok, _ in calls), "authenticated appointments call failed"
+        assert verifications <= len(session_tokens), (
+            f"{verifications} auth verifications for {len(session_tokens)} sessions: session cache not reused"
+        )
+
+        # Invalid tokens retried by their clients: Auth's rejection is remembered briefly
+        bogus_tokens = [f"bogus-{uuid.uuid4().hex}" for _ in range(USERS)]
+        verifications_before = store.request_counts.get(("GET", "user"), 0)
+        rejected, _ = authenticated_calls(bogus_tokens)
+        verifications = store.request_counts.get(("GET", "user"), 0) - verifications_before
+        print(f"\n== {len(rejected)} calls with {len(bogus_tokens)} invalid tokens ==")
+        print(f"auth verifications={verifications} ({verifications / len(rejected):.2f} per call)")
+
+        assert all(status == 401 for _, _, (status, _) in rejected), "invalid token not answered with 401"
+        assert verifications <= len(bogus_tokens), (
+            f"{verifications} auth verifications for {len(bogus_tokens)} invalid tokens: rejections not cached"
+        )
+
+        # Auth slower than the verification timeout: fresh sessions get a prompt 503, not a hang or a 401
+        fresh_tokens = new_sessions(store, "fresh")
+        store.auth_delay_s = AUTH_VERIFY_TIMEOUT_MS / 1000 + 1
+        try:
+            slow, _ = authenticated_calls(fresh_tokens, repeat=1)
+        finally:
+            store.auth_delay_s = 0
+        slow_ms = [r[0] for r in slow]
+        print(f"\n== {len(slow)} calls while Auth takes {AUTH_VERIFY_TIMEOUT_MS + 1000} ms ==")
+        print(format_summary("appointments availability", slow_ms))
+
+        assert all(status == 503 and retry_after for _, _, (status, retry_after) in slow), (
+            "slow Auth not answered with 503 and Retry-After"
+        )
+        assert max(slow_ms) < AUTH_VERIFY_TIMEOUT_MS + 1000, (
+            f"slowest call took {max(slow_ms):.0f} ms with a {AUTH_VERIFY_TIMEOUT_MS} ms verification timeout"
+        )
+    finally:
+        store.stop()
+
+
+test_session_cache()
@@ -0,0 +1,116 @@
+import datetime
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from perf_utils import FUNCTIONS_URL, TIMEOUT, auth_headers, format_summary
+
+APPOINTMENTS_URL = f"{FUNCTIONS_URL}/appointments"
+DOCTOR_ID = os.environ.get("DOCTOR_ID", "")
+# Competing clients per slot; TC010 uses 20 on a single slot
+CONTENDERS = [int(n) for n in os.environ.get("CONTENDERS", "1,2,5,10,20,50").split(",")]
+SLOTS_PER_LEVEL = int(os.environ.get("SLOTS_PER_LEVEL", "5"))
+
+
+def slot_iso(index):
+    slot = (datetime.datetime.utcnow() + datetime.timedelta(days=90)).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    ) + datetime.timedelta(minutes=30 * index)
+    return slot.isoformat() + "Z"
+
+
+def race(contenders, request):
+    """Release `contenders` threads at once through a barrier and collect (status, ms, json)."""
+    barrier = threading.Barrier(contenders)
+
+    def worker(i):
+        session = requests.Session()
+        barrier.wait()
+        start = time.perf_counter()
+        resp = request(session, i)
+        elapsed = (time.perf_counter() - start) * 1000
+        try:
+            body = resp.json()
+        except ValueError:
+            body = {}
+        return resp.status_code, elapsed, body, resp.headers.get("ETag")
+
+    with ThreadPoolExecutor(max_workers=contenders) as pool:
+        return list(pool.map(worker, range(contenders)))
+
+
+def cancel(appointment_id):
+    requests.delete(f"{APPOINTMENTS_URL}/{appointment_id}", headers=auth_headers(), timeout=TIMEOUT)
+
+
+def report(label, contenders, rounds, commit_status, conflict_status):
+    results = [r for round_results in rounds for r in round_results]
+    commits = [r for r in results if r[0] == commit_status]
+    conflicts = [r for r in results if r[0] == conflict_status]
+    shed = [r for r in results if r[0] == 429]
+    print(f"\n== {label}: {contenders} clients x {len(rounds)} slots ==")
+    print(f"commit rate={len(commits) / len(results):.2%} conflict rate={len(conflicts) / len(results):.2%} "
+          f"shed={len(shed)}")
+    print(format_summary("commit latency", [r[1] for r in commits]))
+    print(format_summary("conflict latency", [r[1] for r in conflicts]))
+
+    for round_results in rounds:
+        unexpected = [r for r in round_results if r[0] not in (commit_status, conflict_status, 429)]
+        assert not unexpected, f"{label}: unexpected responses {[(r[0], r[2]) for r in unexpected[:3]]}"
+        winners = [r for r in round_results if r[0] == commit_status]
+        assert len(winners) <= 1, f"{label}: {len(winners)} clients committed the same slot/version"
+        if not any(r[0] == 429 for r in round_results):
+            assert len(winners) == 1, f"{label}: no client committed although none was shed"
+
+
+def booking_contention(contenders, base_index):
+    rounds = []
+    for n in range(SLOTS_PER_LEVEL):
+        slot = slot_iso(base_index + n)
+        payload = {"doctor_id": DOCTOR_ID, "datetime": slot, "reason": "Slot contention benchmark"}
+        results = race(contenders, lambda session, i: session.post(
+            APPOINTMENTS_URL, json=payload, headers=auth_headers(), timeout=TIMEOUT
+        ))
+        rounds.append(results)
+        for status, _, body, _ in results:
+            if status == 201:
+                cancel(body["id"])
+    report("booking", contenders, rounds, 201, 409)
+
+
+def update_contention(contenders, base_index):
+    """Every client read the same ETag, then all try to update with If-Match."""
+    rounds = []
+    for n in range(SLOTS_PER_LEVEL):
+        resp = requests.post(
+            APPOINTMENTS_URL,
+            json={"doctor_id": DOCTOR_ID, "datetime": slot_iso(base_index + n)},
+            headers=auth_headers(), timeout=TIMEOUT,
+        )
+        assert resp.status_code == 201, f"Setup booking failed: {resp.status_code} {resp.text}"
+        appointment_id, etag = resp.json()["id"], resp.headers["ETag"]
+
+        def put(session, i):
+            headers = auth_headers()
+            headers["If-Match"] = etag
+            return session.put(f"{APPOINTMENTS_URL}/{appointment_id}",
+                               json={"reason": f"edit from client {i}"}, headers=headers, timeout=TIMEOUT)
+
+        rounds.append(race(contenders, put))
+        cancel(appointment_id)
+    report("update If-Match", contenders, rounds, 200, 412)
+
+
+def test_slot_contention():
+    assert DOCTOR_ID, "Set DOCTOR_ID to a doctor profile id that accepts bookings"
+
+    for level, contenders in enumerate(CONTENDERS):
+        base_index = level * SLOTS_PER_LEVEL * 2
+        booking_contention(contenders, base_index)
+        update_contention(contenders, base_index + SLOTS_PER_LEVEL)
+
+
+test_slot_contention()
@@ -0,0 +1,245 @@
+import hashlib
+import hmac
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_postgrest import FakePostgrest
+from perf_utils import TIMEOUT, format_summary
+
+# stripe-webhook served with plain Deno against the in-memory store, e.g.
+#   SUPABASE_URL=http://127.0.0.1:54399 SUPABASE_SERVICE_ROLE_KEY=bench \
+#   STRIPE_SECRET_KEY=sk_test_bench STRIPE_WEBHOOK_SECRET=whsec_bench \
+#       deno run -A supabase/functions/stripe-webhook/index.ts
+STRIPE_WEBHOOK_URL = os.environ.get("STRIPE_WEBHOOK_URL", "http://127.0.0.1:8000")
+STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET", "whsec_bench")
+FAKE_DB_PORT = int(os.environ.get("FAKE_DB_PORT", "54399"))
+
+SESSIONS = int(os.environ.get("SESSIONS", "3000"))
+CUSTOMERS = int(os.environ.get("CUSTOMERS", "300"))
+# Share of checkouts whose first card attempt failed (payment_intent.payment_failed first)
+FAILED_FIRST_RATIO = float(os.environ.get("FAILED_FIRST_RATIO", "0.2"))
+# Share of events Stripe redelivers, each 1-3 extra times
+DUPLICATE_RATIO = float(os.environ.get("DUPLICATE_RATIO", "0.5"))
+# Events of types the webhook does not handle, mixed into the stream
+NOISE_RATIO = float(os.environ.get("NOISE_RATIO", "0.1"))
+# Deliveries are shuffled within windows this large, so related events swap order
+REORDER_WINDOW = int(os.environ.get("REORDER_WINDOW", "50"))
+CONCURRENCY = int(os.environ.get("CONCURRENCY", "32"))
+MIN_EVENTS_PER_SEC = float(os.environ.get("MIN_EVENTS_PER_SEC", "0"))
+
+
+def _index(store, table, column):
+    return store._index(table, (column,))
+
+
+def register_stripe_rpcs(store, confirmations):
+    """Stand-in for process_stripe_event with the same claim/apply semantics as the migration.
+
+    check_stripe_event_sql.py runs the migration's own function against a local database.
+    """
+    # pagamentos keeps the Stripe object in transacao_gateway; these mirror the expression indexes
+    by_gateway = set()  # (object id, status)
+    intent_checkouts = {}  # payment_intent -> (consulta id, checkout succeeded)
+
+    def record_pagamento(consulta, obj, valor, status):
+        if (obj["id"], status) in by_gateway:
+            return
+        by_gateway.add((obj["id"], status))
+        store._insert_row("pagamentos", {
+            "consulta_id": consulta["id"], "paciente_id": consulta["paciente_id"], "medico_id": consulta["medico_id"],
+            "usuario_id": consulta["paciente_id"], "valor": valor, "moeda": obj.get("currency", "brl").upper(),
+            "metodo": "credit_card", "status": status, "transacao_gateway": obj,
+        }, None, None)
+        if obj.get("payment_intent"):
+            intent_checkouts[obj["payment_intent"]] = (consulta["id"], status == "succeeded")
+
+    def process_stripe_event(args, store):
+        event_id, event_type, obj = args["p_event_id"], args["p_event_type"], args["p_object"]
+        if event_id is not None:
+            claimed = store._insert_row("stripe_webhook_events", {
+                "event_id": event_id, "event_type": event_type, "customer_id": args["p_customer"],
+                "event_created": args["p_created"], "status": "processed",
+            }, "ignore-duplicates", "event_id")
+            if claimed is None:
+                return "duplicate"
+
+        consultas = _index(store, "consultas", "id")
+        consulta_id = (obj.get("metadata") or {}).get("consulta_id")
+        if not consulta_id and event_type == "payment_intent.payment_failed" and obj["id"] in intent_checkouts:
+            consulta_id = intent_checkouts[obj["id"]][0]
+        consulta = consultas.get((str(consulta_id),)) if consulta_id else None
+        status = "processed"
+        if event_type == "checkout.session.completed":
+            store._insert_row("payments", {
+                "consultation_id": str(consulta["id"]), "amount": obj["amount_total"], "currency": obj["currency"],
+                "status": "succeeded", "stripe_session_id": obj["id"], "stripe_payment_intent_id": obj["payment_intent"],
+            }, "ignore-duplicates", "stripe_session_id")
+            record_pagamento(consulta, obj, obj["amount_total"] / 100, "succeeded")
+            if consulta["status"] in ("pending", "pending_payment", "agendada"):
+                consulta.update(status="agendada", status_pagamento="pago")
+                confirmations[consulta["id"]] = confirmations.get(consulta["id"], 0) + 1
+        elif event_type == "payment_intent.payment_failed":
+            if intent_checkouts.get(obj["id"], (None, False))[1] or (consulta and consulta["status_pagamento"] == "pago"):
+                status = "superseded"
+            elif consulta is None:
+                status = "ignored"
+            else:
+                record_pagamento(consulta, obj, obj["amount"] / 100, "failed")
+        else:
+            status = "ignored"
+
+        if event_id is not None and status != "processed":
+            _index(store, "stripe_webhook_events", "event_id")[(event_id,)]["status"] = status
+        return status
+
+    store.register_rpc("process_stripe_event", process_stripe_event)
+
+
+def make_event(event_type, obj, created):
+    return {"id": f"evt_{uuid.uuid4().hex[:24]}", "object": "event", "api_version": "2023-10-16",
+            "created": created, "livemode": False, "type": event_type, "data": {"object": obj}}
+
+
+def build_events(consultas, rng):
+    """One paid checkout per consulta, some preceded by a failed attempt on the same intent."""
+    customers = [f"cus_{i:06d}" for i in range(CUSTOMERS)]
+    base = int(time.time()) - 3600
+    events = []
+    for n, consulta in enumerate(consultas):
+        customer = customers[n % CUSTOMERS]
+        metadata = {"consulta_id": str(consulta["id"]), "paciente_id": consulta["paciente_id"],
+                    "medico_id": consulta["medico_id"]}
+        intent = f"pi_{uuid.uuid4().hex[:24]}"
+        amount = 15000 + n % 20 * 500
+        created = base + n
+        if rng.random() < FAILED_FIRST_RATIO:
+            events.append(make_event("payment_intent.payment_failed", {
+                "id": intent, "object": "payment_intent", "amount": amount, "currency": "brl",
+                "customer": customer, "status": "requires_payment_method", "metadata": metadata,
+            }, created - 30))
+        events.append(make_event("checkout.session.completed", {
+            "id": f"cs_test_{uuid.uuid4().hex}", "object": "checkout.session", "amount_total": amount,
+            "currency": "brl", "customer": customer, "payment_intent": intent, "payment_status": "paid",
+            "status": "complete", "metadata": metadata,
+            "customer_details": {"email": f"{customer}@bench.test", "name": f"Cliente {customer}"},
+        }, created))
+        if rng.random() < NOISE_RATIO:
+            events.append(make_event("customer.updated", {"id": customer, "object": "customer"}, created))
+    return events
+
+
+def build_deliveries(events, rng):
+    deliveries = list(events)
+    for event in events:
+        if rng.random() < DUPLICATE_RATIO:
+            deliveries.extend([event] * rng.randint(1, 3))
+    rng.shuffle(deliveries)
+    # Mostly chronological, as Stripe sends them, but reordered within each window
+    deliveries.sort(key=lambda e: e["created"])
+    for start in range(0, len(deliveries), REORDER_WINDOW):
+        window = deliveries[start:start + REORDER_WINDOW]
+        rng.shuffle(window)
+        deliveries[start:start + REORDER_WINDOW] = window
+    return deliveries
+
+
+def sign(payload):
+    timestamp = int(time.time())
+    digest = hmac.new(STRIPE_WEBHOOK_SECRET.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def deliver(session, event):
+    payload = json.dumps(event, separators=(",", ":"))
+    headers = {"Content-Type": "application/json", "Stripe-Signature": sign(payload)}
+    start = time.perf_counter()
+    resp = session.post(STRIPE_WEBHOOK_URL, data=payload, headers=headers, timeout=TIMEOUT)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    body = resp.json() if resp.headers.get("Content-Type", "").startswith("application/json") else {}
+    return event, resp.status_code, body, elapsed_ms
+
+
+def test_stripe_webhook_replay():
+    store = FakePostgrest(unique={"payments": ["stripe_session_id"], "stripe_webhook_events": ["event_id"]},
+                          port=FAKE_DB_PORT).start()
+    confirmations = {}
+    try:
+        rng = random.Random(35)
+        # consultas.id is a bigint; Stripe metadata carries it as text
+        consultas = [{"id": n + 1, "paciente_id": str(uuid.uuid4()), "medico_id": str(uuid.uuid4()),
+                      "status": "pending_payment", "status_pagamento": "pendente"} for n in range(SESSIONS)]
+        store.seed("consultas", consultas)
+        register_stripe_rpcs(store, confirmations)
+
+        events = build_events(consultas, rng)
+        deliveries = build_deliveries(events, rng)
+        handled = [e for e in events if e["type"] != "customer.updated"]
+        rpc_before = store.request_counts.get(("POST", "process_stripe_event"), 0)
+
+        # One session per worker thread keeps connections alive, as Stripe's sender does
+        local = threading.local()
+
+        def send(event):
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            return deliver(local.session, event)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+            results = list(pool.map(send, deliveries))
+        elapsed = time.perf_counter() - start
+
+        rpc_calls = store.request_counts.get(("POST", "process_stripe_event"), 0) - rpc_before
+        failures = [(e["id"], status, body) for e, status, body, _ in results if status != 200]
+        duplicates = sum(1 for _, status, body, _ in results if status == 200 and body.get("duplicate"))
+        recorded = store.rows("stripe_webhook_events")
+        by_status = {}
+        for row in recorded:
+            by_status[row["status"]] = by_status.get(row["status"], 0) + 1
+
+        print(f"\n== {len(deliveries)} deliveries of {len(events)} events "
+              f"({len(handled)} handled, {len(deliveries) - len(events)} redeliveries) ==")
+        print(f"throughput: {len(deliveries) / elapsed:.0f} events/s over {elapsed:.2f}s with {CONCURRENCY} senders")
+        print(format_summary("delivery latency", [r[3] for r in results]))
+        print(f"acknowledged as duplicate: {duplicates}; database round trips: {rpc_calls} "
+              f"({rpc_calls / len(deliveries):.2f} per delivery)")
+        print(f"recorded events by status: {by_status}")
+
+        assert not failures, f"Webhook rejected deliveries: {failures[:5]}"
+        assert len(recorded) == len(handled), f"Expected {len(handled)} recorded events, found {len(recorded)}"
+        assert rpc_calls <= len(handled), f"{rpc_calls} RPC calls for {len(handled)} distinct handled events"
+
+        payments = store.rows("payments")
+        pagamentos = store.rows("pagamentos")
+        succeeded = [p for p in pagamentos if p["status"] == "succeeded"]
+        failed = [p for p in pagamentos if p["status"] == "failed"]
+        assert len(payments) == SESSIONS and len({p["stripe_session_id"] for p in payments}) == SESSIONS, (
+            f"Expected one payments row per session, found {len(payments)}"
+        )
+        assert len(succeeded) == SESSIONS and len({p["transacao_gateway"]["id"] for p in succeeded}) == SESSIONS, (
+            f"Expected one succeeded pagamentos row per session, found {len(succeeded)}"
+        )
+        assert len({p["transacao_gateway"]["id"] for p in failed}) == len(failed), "Duplicate failed pagamentos rows"
+        # A failure delivered after its intent's success is superseded, never recorded
+        succeeded_intents = {p["stripe_payment_intent_id"] for p in payments}
+        superseded = {row["event_id"] for row in recorded if row["status"] == "superseded"}
+        assert len(failed) + len(superseded) == sum(1 for e in handled if e["type"] == "payment_intent.payment_failed")
+        assert all(p["transacao_gateway"]["id"] in succeeded_intents for p in failed)
+        assert all(c["status_pagamento"] == "pago" for c in store.rows("consultas")), "Unconfirmed consultas"
+        assert set(confirmations.values()) == {1} and len(confirmations) == SESSIONS, (
+            "Some consultas were confirmed more than once"
+        )
+        if MIN_EVENTS_PER_SEC:
+            assert len(deliveries) / elapsed >= MIN_EVENTS_PER_SEC, f"{len(deliveries) / elapsed:.0f} events/s"
+    finally:
+        store.stop()
+
+
+test_stripe_webhook_replay()
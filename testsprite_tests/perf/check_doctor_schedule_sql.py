@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta, timezone
+
+from local_supabase import LocalSupabase
+
+DAYS = 7
+WEEKDAYS = ["segunda", "terca", "quarta", "quinta", "sexta", "sabado", "domingo"]
+START = datetime.now(timezone.utc).date()
+
+
+def working_hours(locations, fim="18:00"):
+    """Every day open at every location, so each write below lands on a day with slots."""
+    blocks = [{"inicio": "08:00", "fim": fim, "inicioAlmoco": "12:00", "fimAlmoco": "13:00", "ativo": True,
+               "local_id": str(location)} for location in locations]
+    return {"duracaoConsulta": 30, "bufferMinutos": 0, "horarioAtendimento": {day: blocks for day in WEEKDAYS}}
+
+
+def at(day_offset, hhmm):
+    hours, minutes = map(int, hhmm.split(":"))
+    day = START + timedelta(days=day_offset)
+    return datetime(day.year, day.month, day.day, hours, minutes, tzinfo=timezone.utc).isoformat()
+
+
+def assert_matches_legacy(db, doctor_id, step):
+    """Each materialized day must carry the same locations get_doctor_schedule_data computes from scratch."""
+    week = db.rpc("get_doctor_schedule_week", p_doctor_id=doctor_id, p_start=START.isoformat(), p_days=DAYS)
+    assert len(week["days"]) == DAYS, f"{step}: week has {len(week['days'])} days"
+    for payload in week["days"]:
+        legacy = db.rpc("get_doctor_schedule_data", p_doctor_id=doctor_id, p_date=payload["date"])
+        assert payload["locations"] == legacy[0]["locations"], \
+            f"{step}: projection for {payload['date']} diverged from get_doctor_schedule_data"
+    return week
+
+
+def test_doctor_schedule_sql():
+    """doctor_schedule_days, kept current by the triggers, against get_doctor_schedule_data after each write."""
+    db = LocalSupabase()
+    users, locations, consultas, appointments, doctor = [], [], [], [], None
+    try:
+        for user_type in ("medico", "paciente"):
+            user = db.create_user()
+            users.append(user)
+            db.insert("profiles", [{"id": user["id"], "email": user["email"], "user_type": user_type}], upsert=True)
+        medico, paciente = (u["id"] for u in users)
+        if not db.select("medicos", user_id=f"eq.{medico}"):
+            db.insert("medicos", [{"user_id": medico, "crm": "CHECK-0001"}])
+        locations = [db.insert("locais_atendimento", [{"medico_id": medico, "nome_local": name, "ativo": True}])[0]["id"]
+                     for name in ("Clínica A", "Clínica B")]
+        db.update("medicos", {"configuracoes": working_hours(locations)}, user_id=f"eq.{medico}")
+        doctor = db.insert("doctors", [{"profile_id": medico, "crm_number": "CHECK-0001"}])[0]
+
+        # Materialize the week first so every write below goes through the triggers' refresh
+        versions = [assert_matches_legacy(db, medico, "empty week")["version"]]
+
+        def step(name):
+            week = assert_matches_legacy(db, medico, name)
+            assert week["version"] > versions[-1], f"{name}: version did not move"
+            versions.append(week["version"])
+
+        def consulta(**fields):
+            row = db.insert("consultas", [{"medico_id": medico, "paciente_id": paciente, "status": "agendada",
+                                           "status_pagamento": "pendente", **fields}])[0]
+            consultas.append(row["id"])
+            return row
+
+        def appointment(**fields):
+            row = db.insert("appointments", [{"doctor_id": doctor["id"], "patient_id": paciente, "status": "agendada",
+                                              **fields}])[0]
+            appointments.append(row["id"])
+            return row
+
+        consulta(consultation_date=at(0, "09:00"), local_id=locations[0])
+        step("consulta at one location")
+        moved = consulta(consultation_date=at(1, "10:00"))
+        step("consulta without a location")
+        db.update("consultas", {"consultation_date": at(2, "10:30")}, id=f"eq.{moved['id']}")
+        step("consulta moved to another day")
+
+        # appointments carry the location in local_id; location_id (public.locations) stays NULL
+        booked = appointment(start_time=at(3, "14:00"), end_time=at(3, "14:30"), local_id=locations[1])
+        step("appointment at one location")
+        db.update("appointments", {"local_id": locations[0]}, id=f"eq.{booked['id']}")
+        step("appointment moved to the other location")
+        db.update("appointments", {"status": "cancelada"}, id=f"eq.{booked['id']}")
+        step("appointment cancelled")
+        appointment(start_time=at(4, "15:00"), end_time=at(4, "15:30"))
+        step("appointment without a location")
+
+        db.update("medicos", {"configuracoes": working_hours(locations, fim="17:00")}, user_id=f"eq.{medico}")
+        step("working hours changed")
+        db.update("locais_atendimento", {"ativo": False}, id=f"eq.{locations[1]}")
+        step("location deactivated")
+
+        print("\n== doctor_schedule_days on the local database ==")
+        print(f"{len(versions)} states of a {DAYS}-day week matched get_doctor_schedule_data day by day "
+              f"(versions {versions[0]} -> {versions[-1]})")
+    finally:
+        if appointments:
+            db.delete("appointments", id=f"in.({','.join(appointments)})")
+        if consultas:
+            db.delete("consultas", id=f"in.({','.join(map(str, consultas))})")
+        if doctor:
+            db.delete("doctors", id=f"eq.{doctor['id']}")
+        for location in locations:
+            db.delete("locais_atendimento", id=f"eq.{location}")
+        if users:
+            # Last: the deletes above refresh the projection once more
+            db.delete("medicos", user_id=f"eq.{users[0]['id']}")
+            db.delete("doctor_schedule_days", medico_id=f"eq.{users[0]['id']}")
+            db.delete("doctor_schedule_versions", medico_id=f"eq.{users[0]['id']}")
+        for user in users:
+            db.delete("profiles", id=f"eq.{user['id']}")
+            db.delete_user(user["id"])
+
+
+test_doctor_schedule_sql()
@@ -0,0 +1,99 @@
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from local_supabase import LocalSupabase, RestError
+
+# Small on purpose: this checks the SQL behind bench_fhir_export.py, not its speed
+PATIENTS = int(os.environ.get("PATIENTS", "5"))
+METRICS_PER_PATIENT = int(os.environ.get("METRICS_PER_PATIENT", "3"))
+PAGE_SIZE = int(os.environ.get("PAGE_SIZE", "4"))
+
+READINGS = [("weight", 70.5, "kg", "29463-7"), ("heart_rate", 72, "/min", "8867-4"),
+            ("glucose", 95, "mg/dL", "33747-0"), ("mood", None, None, "vital-signs")]
+SINCE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def export_all(db, resource_type, source_id, since=None):
+    """Pages through fhir_export_page exactly as the function does, following fhir_export_next_cursor."""
+    resources, cursor, pages = [], None, 0
+    window = {"p_source_id": source_id, "p_since": since, "p_until": None}
+    while True:
+        rows = db.rpc("fhir_export_page", p_resource_type=resource_type, p_after=cursor, p_limit=PAGE_SIZE, **window)
+        next_cursor = db.rpc("fhir_export_next_cursor", p_resource_type=resource_type, p_after=cursor,
+                             p_count=PAGE_SIZE, **window)
+        pages += 1
+        assert all(row["id"] == row["resource"]["id"] for row in rows), f"{resource_type}: row id != resource id"
+        resources += [row["resource"] for row in rows]
+        if next_cursor is None:
+            assert len(rows) <= PAGE_SIZE, f"{resource_type}: last page has {len(rows)} rows"
+            return resources, pages
+        assert next_cursor == rows[-1]["id"], f"{resource_type}: next cursor {next_cursor} != last id {rows[-1]['id']}"
+        cursor = next_cursor
+
+
+def test_fhir_export_sql():
+    db = LocalSupabase()
+    users, metric_ids, source = [], [], None
+    try:
+        source = db.insert("external_data_sources", [{"name": "Export check", "api_key": uuid.uuid4().hex}])[0]
+        for _ in range(PATIENTS):
+            user = db.create_user()
+            users.append(user)
+            db.insert("profiles", [{"id": user["id"], "email": user["email"], "user_type": "paciente",
+                                    "display_name": f"Paciente {user['id'][:8]}"}], upsert=True)
+            db.insert("user_consents", [{"patient_id": user["id"], "source_id": source["id"], "status": "granted"}])
+
+        expected = {}
+        for p, user in enumerate(users):
+            for m in range(METRICS_PER_PATIENT):
+                tipo, valor, unidade, code = READINGS[(p + m) % len(READINGS)]
+                at = SINCE + timedelta(days=m - 1)
+                row = db.insert("health_metrics", [{"patient_id": user["id"], "tipo": tipo, "valor": valor,
+                                                    "unidade": unidade, "registrado_em": at.isoformat()}])[0]
+                metric_ids.append(row["id"])
+                expected[str(row["id"])] = (user["id"], valor, unidade, code, at)
+
+        patients, patient_pages = export_all(db, "Patient", source["id"])
+        assert [r["id"] for r in patients] == sorted(u["id"] for u in users), "Patient export out of keyset order"
+        assert all(r["resourceType"] == "Patient" and r["telecom"][0]["value"] for r in patients)
+
+        observations, observation_pages = export_all(db, "Observation", source["id"])
+        assert [r["id"] for r in observations] == sorted(expected, key=int), "Observation export out of id order"
+        for resource in observations:
+            patient_id, valor, unidade, code, at = expected[resource["id"]]
+            assert resource["subject"]["reference"] == f"Patient/{patient_id}"
+            assert resource["code"]["coding"][0]["code"] == code, f"{resource['id']}: wrong code"
+            if valor is None:
+                assert "valueQuantity" not in resource, f"{resource['id']}: value for a reading without valor"
+            else:
+                quantity = resource["valueQuantity"]
+                assert float(quantity["value"]) == valor and quantity.get("unit") == unidade
+            assert datetime.fromisoformat(resource["effectiveDateTime"]) == at
+
+        # _since filters on registrado_em
+        recent, _ = export_all(db, "Observation", source["id"], since=SINCE.isoformat())
+        assert {r["id"] for r in recent} == {i for i, e in expected.items() if e[4] > SINCE}, "_since window wrong"
+
+        try:
+            db.rpc("fhir_export_page", p_resource_type="Observation", p_source_id=source["id"], p_after="not-a-number",
+                   p_limit=PAGE_SIZE, p_since=None, p_until=None)
+            raise AssertionError("a non-numeric Observation cursor was accepted")
+        except RestError as error:
+            assert error.code == "22023", f"invalid cursor raised {error.code}, expected 22023"
+
+        print("\n== fhir_export_page / fhir_export_next_cursor on the local database ==")
+        print(f"Patient: {len(patients)} resources in {patient_pages} pages; "
+              f"Observation: {len(observations)} in {observation_pages} pages; since {SINCE:%Y-%m-%d}: {len(recent)}")
+    finally:
+        if metric_ids:
+            db.delete("health_metrics", id=f"in.({','.join(map(str, metric_ids))})")
+        for user in users:
+            db.delete("user_consents", patient_id=f"eq.{user['id']}")
+            db.delete("profiles", id=f"eq.{user['id']}")
+            db.delete_user(user["id"])
+        if source:
+            db.delete("external_data_sources", id=f"eq.{source['id']}")
+
+
+test_fhir_export_sql()
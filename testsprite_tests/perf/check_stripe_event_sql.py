@@ -0,0 +1,82 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from local_supabase import LocalSupabase
+
+
+def event(event_type, obj):
+    return {"p_event_id": f"evt_{uuid.uuid4().hex[:24]}", "p_event_type": event_type, "p_customer": obj.get("customer"),
+            "p_created": datetime.now(timezone.utc).isoformat(), "p_object": obj}
+
+
+def test_stripe_event_sql():
+    """process_stripe_event from the migration, once per case the replay benchmark's Python copy covers."""
+    db = LocalSupabase()
+    users, consulta, event_ids = [], None, []
+    try:
+        for user_type in ("medico", "paciente"):
+            user = db.create_user()
+            users.append(user)
+            db.insert("profiles", [{"id": user["id"], "email": user["email"], "user_type": user_type}], upsert=True)
+        medico, paciente = (u["id"] for u in users)
+        consulta = db.insert("consultas", [{
+            "medico_id": medico, "paciente_id": paciente, "status": "pending_payment", "status_pagamento": "pendente",
+            "consultation_date": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
+        }])[0]
+        metadata = {"consulta_id": str(consulta["id"]), "paciente_id": paciente, "medico_id": medico}
+        customer, intent = f"cus_{uuid.uuid4().hex[:14]}", f"pi_{uuid.uuid4().hex[:24]}"
+
+        def apply(args):
+            event_ids.append(args["p_event_id"])
+            return db.rpc("process_stripe_event", **args)
+
+        def pagamentos(status):
+            return db.select("pagamentos", consulta_id=f"eq.{consulta['id']}", status=f"eq.{status}")
+
+        failed = event("payment_intent.payment_failed", {
+            "id": intent, "object": "payment_intent", "amount": 15000, "currency": "brl", "customer": customer,
+            "metadata": metadata,
+        })
+        assert apply(failed) == "processed", "first failure was not applied"
+        assert db.rpc("process_stripe_event", **failed) == "duplicate", "redelivered event applied twice"
+        assert len(pagamentos("failed")) == 1, "failed attempt not recorded once"
+
+        session = {"id": f"cs_test_{uuid.uuid4().hex}", "object": "checkout.session", "amount_total": 15000,
+                   "currency": "brl", "customer": customer, "payment_intent": intent, "metadata": metadata,
+                   "customer_details": {"email": f"{customer}@bench.test", "name": "Cliente"}}
+        assert apply(event("checkout.session.completed", session)) == "processed"
+        # Stripe can also send the same session under a new event id
+        assert apply(event("checkout.session.completed", session)) == "processed"
+        paid = db.select("consultas", id=f"eq.{consulta['id']}")[0]
+        assert (paid["status"], paid["status_pagamento"]) == ("agendada", "pago"), f"consulta not confirmed: {paid}"
+        assert len(pagamentos("succeeded")) == 1, "checkout recorded more than once in pagamentos"
+
+        # A late failure of the paid intent, without metadata, is superseded however payments (v2) went
+        late = event("payment_intent.payment_failed", {"id": intent, "object": "payment_intent", "amount": 15000,
+                                                       "currency": "brl", "customer": customer})
+        assert apply(late) == "superseded", "late failure after the paid checkout was not superseded"
+        assert len(pagamentos("failed")) == 1, "late failure recorded in pagamentos"
+
+        orphan = event("payment_intent.payment_failed", {"id": f"pi_{uuid.uuid4().hex[:24]}", "object": "payment_intent",
+                                                         "amount": 100, "currency": "brl", "customer": customer})
+        assert apply(orphan) == "ignored", "failure of an unknown intent was not ignored"
+
+        recorded = db.select("stripe_webhook_events", event_id=f"in.({','.join(event_ids)})")
+        statuses = sorted(row["status"] for row in recorded)
+        assert statuses == ["ignored", "processed", "processed", "processed", "superseded"], statuses
+        print("\n== process_stripe_event on the local database ==")
+        print(f"consulta {consulta['id']}: failure, duplicate, checkout x2, late failure and unknown intent "
+              f"-> {statuses}")
+    finally:
+        if event_ids:
+            db.delete("stripe_webhook_events", event_id=f"in.({','.join(event_ids)})")
+        if consulta:
+            db.delete("pagamentos", consulta_id=f"eq.{consulta['id']}")
+            db.delete("payments", consultation_id=f"eq.{consulta['id']}")
+            db.delete("consultas", id=f"eq.{consulta['id']}")
+        for user in users:
+            db.delete("profiles", id=f"eq.{user['id']}")
+            db.delete_user(user["id"])
+
+
+test_stripe_event_sql()
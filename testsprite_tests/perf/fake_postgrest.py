@@ -0,0 +1,304 @@
+"""In-memory stand-in for the Supabase REST API (PostgREST), for local benchmarks.
+
+Edge functions can be pointed at it by running them with plain Deno instead of
+the Supabase CLI (which refuses to override SUPABASE_* variables):
+
+    SUPABASE_URL=http://127.0.0.1:54399 SUPABASE_SERVICE_ROLE_KEY=bench \\
+        deno run -A supabase/functions/<name>/index.ts
+
+Only the subset of PostgREST that supabase-js emits from our functions is
+implemented: eq/neq/gt/gte/lt/lte/in/is filters, order/limit/offset, single
+object responses, inserts and upserts honouring unique keys, PATCH updates,
+exact counts, RPC calls backed by Python callables and `auth.getUser(jwt)` for
+tokens registered with `add_user`.
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+OBJECT_MEDIA_TYPE = "application/vnd.pgrst.object+json"
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+class UniqueViolation(Exception):
+    pass
+
+
+def _text(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return "null"
+    return str(value)
+
+
+def _compare(a, b):
+    try:
+        return (float(a) > float(b)) - (float(a) < float(b))
+    except (TypeError, ValueError):
+        a, b = _text(a), _text(b)
+        return (a > b) - (a < b)
+
+
+def _parse_in_list(raw):
+    # in.("a","b",c) - values may be double-quoted when they contain separators
+    return [m[0] if m[0] else m[1] for m in re.findall(r'"((?:[^"\\]|\\.)*)"|([^,()]+)', raw.strip("()"))]
+
+
+def _matches(row, column, expr):
+    op, _, operand = expr.partition(".")
+    negate = op == "not"
+    if negate:
+        op, _, operand = operand.partition(".")
+    value = row.get(column)
+    if op == "eq":
+        ok = _text(value) == operand
+    elif op == "neq":
+        ok = _text(value) != operand
+    elif op in ("gt", "gte", "lt", "lte"):
+        if value is None:
+            return False
+        cmp = _compare(value, operand)
+        ok = {"gt": cmp > 0, "gte": cmp >= 0, "lt": cmp < 0, "lte": cmp <= 0}[op]
+    elif op == "in":
+        ok = _text(value) in _parse_in_list(operand)
+    elif op == "is":
+        ok = _text(value) == operand
+    else:
+        raise ValueError(f"Unsupported filter operator: {op}")
+    return ok != negate
+
+
+class FakePostgrest:
+    def __init__(self, unique=None, host="127.0.0.1", port=54399):
+        # table -> list of column tuples that must be unique (primary key first)
+        self.unique = {table: [tuple(k) if isinstance(k, (list, tuple)) else (k,) for k in keys]
+                       for table, keys in (unique or {}).items()}
+        self.tables = {}
+        # table -> key columns -> {key values: row}, so conflict checks stay O(1) under floods
+        self.indexes = {}
+        self.rpcs = {}
+        # bearer token -> user object returned by GET /auth/v1/user
+        self.users = {}
+        # seconds GET /auth/v1/user takes to answer, to simulate a slow Auth
+        self.auth_delay_s = 0
+        self.lock = threading.Lock()
+        self.request_counts = {}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # -- data helpers used by the benchmarks ---------------------------------
+
+    def seed(self, table, rows):
+        with self.lock:
+            for row in rows:
+                self._insert_row(table, dict(row), resolution=None, on_conflict=None)
+
+    def rows(self, table):
+        with self.lock:
+            return [dict(r) for r in self.tables.get(table, [])]
+
+    def register_rpc(self, name, fn):
+        """fn(args: dict, store: FakePostgrest) -> JSON-serialisable result; called under the store lock."""
+        self.rpcs[name] = fn
+
+    def add_user(self, token, user):
+        self.users[token] = dict(user)
+
+    def total_requests(self):
+        with self.lock:
+            return sum(self.request_counts.values())
+
+    # -- storage -------------------------------------------------------------
+
+    def _index(self, table, key):
+        indexes = self.indexes.setdefault(table, {})
+        if key not in indexes:
+            indexes[key] = {tuple(_text(r.get(c)) for c in key): r
+                            for r in self.tables.get(table, []) if all(r.get(c) is not None for c in key)}
+        return indexes[key]
+
+    def _conflict(self, table, row, keys):
+        for key in keys:
+            if all(row.get(c) is not None for c in key):
+                existing = self._index(table, key).get(tuple(_text(row.get(c)) for c in key))
+                if existing is not None:
+                    return existing
+        return None
+
+    def _reindex(self, table):
+        self.indexes.pop(table, None)
+
+    def _insert_row(self, table, row, resolution, on_conflict):
+        row.setdefault("id", str(uuid.uuid4()))
+        row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+        keys = [tuple(on_conflict.split(","))] if on_conflict else self.unique.get(table, [("id",)])
+        if ("id",) not in keys:
+            keys = keys + [("id",)]
+        existing = self._conflict(table, row, keys)
+        if existing is not None:
+            if resolution == "ignore-duplicates":
+                return None
+            if resolution == "merge-duplicates":
+                existing.update(row)
+                self._reindex(table)
+                return existing
+            raise UniqueViolation(f"duplicate key value violates unique constraint on {table}")
+        self.tables.setdefault(table, []).append(row)
+        for key in self.indexes.get(table, {}):
+            if all(row.get(c) is not None for c in key):
+                self.indexes[table][key][tuple(_text(row.get(c)) for c in key)] = row
+        return row
+
+    def _select(self, table, params):
+        rows = self.tables.get(table, [])
+        filters = [(k, v) for k, v in params if k not in RESERVED_PARAMS]
+        result = [r for r in rows if all(_matches(r, col, expr) for col, expr in filters)]
+        order = dict(params).get("order")
+        if order:
+            for clause in reversed(order.split(",")):
+                column, *mods = clause.split(".")
+                result.sort(key=lambda r: (r.get(column) is None, _text(r.get(column))), reverse="desc" in mods)
+        return result
+
+    # -- HTTP ----------------------------------------------------------------
+
+    def _handler(self):
+        store = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=None, headers=None):
+                payload = b"" if body is None else json.dumps(body, default=str).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                if payload and self.command != "HEAD":
+                    self.wfile.write(payload)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"null")
+
+            def _route(self):
+                parsed = urlparse(self.path)
+                parts = parsed.path.strip("/").split("/")
+                params = parse_qsl(parsed.query, keep_blank_values=True)
+                if parts[:3] == ["auth", "v1", "user"]:
+                    return "auth", "user", params
+                if parts[:2] != ["rest", "v1"] or len(parts) < 3:
+                    return None, None, params
+                if parts[2] == "rpc":
+                    return "rpc", parts[3], params
+                return "table", parts[2], params
+
+            def _prefer(self, name):
+                for item in (self.headers.get("Prefer") or "").split(","):
+                    key, _, value = item.strip().partition("=")
+                    if key == name:
+                        return value
+                return None
+
+            def _respond_rows(self, rows, status=200, total=None):
+                p = dict(self._params)
+                offset = int(p.get("offset", 0))
+                limit = int(p["limit"]) if "limit" in p else None
+                page = rows[offset:offset + limit] if limit is not None else rows[offset:]
+                headers = {}
+                if self._prefer("count"):
+                    last = offset + len(page) - 1
+                    headers["Content-Range"] = f"{offset}-{last}/{total if total is not None else len(rows)}" \
+                        if page else f"*/{total if total is not None else len(rows)}"
+                if OBJECT_MEDIA_TYPE in (self.headers.get("Accept") or ""):
+                    if len(page) != 1:
+                        return self._send(406, {"code": "PGRST116", "message": "JSON object requested, "
+                                                f"multiple (or no) rows returned", "details": f"{len(page)} rows"})
+                    return self._send(status, page[0], headers)
+                return self._send(status, page, headers)
+
+            def _handle(self):
+                kind, name, self._params = self._route()
+                if kind is None:
+                    return self._send(404, {"message": "not found"})
+                if kind == "auth" and store.auth_delay_s:
+                    time.sleep(store.auth_delay_s)
+                with store.lock:
+                    store.request_counts[(self.command, name)] = store.request_counts.get((self.command, name), 0) + 1
+                    try:
+                        if kind == "auth":
+                            token = (self.headers.get("Authorization") or "").removeprefix("Bearer ")
+                            user = store.users.get(token)
+                            if user is None:
+                                return self._send(401, {"code": 401, "msg": "invalid JWT"})
+                            return self._send(200, user)
+
+                        if kind == "rpc":
+                            fn = store.rpcs.get(name)
+                            if fn is None:
+                                return self._send(404, {"code": "PGRST202", "message": f"function {name} not found"})
+                            return self._send(200, fn(self._body() or {}, store))
+
+                        if self.command in ("GET", "HEAD"):
+                            return self._respond_rows(store._select(name, self._params))
+
+                        if self.command == "POST":
+                            body = self._body()
+                            rows = body if isinstance(body, list) else [body]
+                            resolution = self._prefer("resolution")
+                            on_conflict = dict(self._params).get("on_conflict")
+                            written = [store._insert_row(name, dict(r), resolution, on_conflict) for r in rows]
+                            written = [dict(r) for r in written if r is not None]
+                            if self._prefer("return") == "representation":
+                                return self._respond_rows(written, status=201)
+                            return self._send(201)
+
+                        if self.command == "PATCH":
+                            changes = self._body() or {}
+                            matched = store._select(name, self._params)
+                            for row in matched:
+                                row.update(changes)
+                            store._reindex(name)
+                            if self._prefer("return") == "representation":
+                                return self._respond_rows([dict(r) for r in matched])
+                            return self._send(204)
+
+                        if self.command == "DELETE":
+                            matched = store._select(name, self._params)
+                            matched_ids = {id(r) for r in matched}
+                            store.tables[name] = [r for r in store.tables.get(name, []) if id(r) not in matched_ids]
+                            store._reindex(name)
+                            return self._send(204)
+                    except UniqueViolation as e:
+                        return self._send(409, {"code": "23505", "message": str(e)})
+                    except ValueError as e:
+                        return self._send(400, {"code": "PGRST100", "message": str(e)})
+                return self._send(405, {"message": "method not allowed"})
+
+            do_GET = do_HEAD = do_POST = do_PATCH = do_DELETE = _handle
+
+        return Handler
@@ -0,0 +1,246 @@
+"""Local fault-injection proxy for resilience benchmarks.
+
+`FaultProxy` listens on a local port and forwards HTTP/1.1 traffic to an
+upstream (usually `BASE_URL`), degrading it on the way:
+
+    proxy = FaultProxy("http://localhost:8080").start()
+    proxy.configure(latency_ms=200, jitter_ms=100, reset_ratio=0.05)
+    requests.get(f"{proxy.url}/health", timeout=TIMEOUT)
+    proxy.error_burst(seconds=3, status=503)
+
+Faults are read per request, so they can be changed while a load test runs:
+
+- `latency_ms` / `jitter_ms`: delay before the request reaches the upstream
+  (jitter is uniform in [-jitter, +jitter], never below zero).
+- `bandwidth_kbps`: cap on response bytes per second, per connection.
+- `reset_ratio`: share of requests whose connection is reset (TCP RST) after
+  `reset_after_bytes` bytes of the response, as when a backend crashes.
+- `error_ratio` / `error_status`: share of requests answered by the proxy with
+  a synthetic 5xx instead of being forwarded; `error_burst` answers every
+  request that way for a while.
+- `blackhole_ratio`: share of requests that are accepted but never answered,
+  so only the client timeout ends them.
+
+Each client connection carries one request (the proxy forwards it with
+`Connection: close` and the upstream's `Host`), which keeps the proxy a plain
+byte pipe after the request and makes every fault decision independent.
+`take_counts` reports what happened to each request: a `reset` whose response
+ended before `reset_after_bytes` closed cleanly and is counted as `forward`.
+"""
+import random
+import socket
+import struct
+import threading
+import time
+from urllib.parse import urlparse
+
+DEFAULT_FAULTS = {
+    "latency_ms": 0.0,
+    "jitter_ms": 0.0,
+    "bandwidth_kbps": 0.0,
+    "reset_ratio": 0.0,
+    "reset_after_bytes": 0,
+    "error_ratio": 0.0,
+    "error_status": 503,
+    "blackhole_ratio": 0.0,
+}
+CHUNK = 16 * 1024
+REASONS = {500: "Internal Server Error", 502: "Bad Gateway", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+class FaultProxy:
+    def __init__(self, upstream, host="127.0.0.1", port=0, seed=None):
+        parsed = urlparse(upstream)
+        if parsed.scheme != "http":
+            raise ValueError("FaultProxy only forwards plain http:// upstreams")
+        self.upstream = (parsed.hostname, parsed.port or 80)
+        self.host_header = parsed.netloc.rpartition("@")[2].encode()
+        self.faults = dict(DEFAULT_FAULTS)
+        self.burst_until = 0.0
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        # forward | error | reset | blackhole -> requests handled that way
+        self.counts = {}
+        self.server = socket.create_server((host, port), backlog=512)
+        self.url = f"http://{host}:{self.server.getsockname()[1]}"
+        self.stopped = threading.Event()
+        self._thread = None
+
+    # -- control -------------------------------------------------------------
+
+    def start(self):
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.server.close()
+
+    def configure(self, **faults):
+        unknown = set(faults) - set(DEFAULT_FAULTS)
+        if unknown:
+            raise ValueError(f"Unknown faults: {', '.join(sorted(unknown))}")
+        with self.lock:
+            self.faults.update(faults)
+
+    def reset(self):
+        with self.lock:
+            self.faults = dict(DEFAULT_FAULTS)
+            self.burst_until = 0.0
+
+    def error_burst(self, seconds, status=503):
+        """Answer every request with `status` for the next `seconds`."""
+        with self.lock:
+            self.faults["error_status"] = status
+            self.burst_until = time.monotonic() + seconds
+
+    def take_counts(self):
+        with self.lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+    # -- proxying ------------------------------------------------------------
+
+    def _decide(self):
+        with self.lock:
+            faults = dict(self.faults)
+            roll = self.rng.random()
+            if time.monotonic() < self.burst_until:
+                action = "error"
+            elif roll < faults["error_ratio"]:
+                action = "error"
+            elif roll < faults["error_ratio"] + faults["reset_ratio"]:
+                action = "reset"
+            elif roll < faults["error_ratio"] + faults["reset_ratio"] + faults["blackhole_ratio"]:
+                action = "blackhole"
+            else:
+                action = "forward"
+            delay = max(0.0, faults["latency_ms"] + self.rng.uniform(-1, 1) * faults["jitter_ms"]) / 1000
+        return action, delay, faults
+
+    def _count(self, outcome):
+        with self.lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    def _accept_loop(self):
+        while not self.stopped.is_set():
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(client,), daemon=True).start()
+
+    def _handle(self, client):
+        upstream = None
+        outcome = None
+        try:
+            head, body = _read_head(client)
+            if head is None:
+                return
+            action, delay, faults = self._decide()
+            outcome = action
+            if delay:
+                time.sleep(delay)
+
+            if action == "error":
+                status = faults["error_status"]
+                payload = b'{"error":"injected fault"}'
+                client.sendall(
+                    f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+                )
+                return
+            if action == "blackhole":
+                # Hold the connection open until the client gives up
+                while not self.stopped.is_set() and client.recv(CHUNK):
+                    pass
+                return
+
+            upstream = socket.create_connection(self.upstream)
+            upstream.sendall(_upstream_head(head, self.host_header) + body)
+            remaining = _content_length(head)
+            if remaining is None:
+                # Chunked upload: keep relaying the client's bytes alongside the response
+                threading.Thread(target=_pipe, args=(client, upstream), daemon=True).start()
+            else:
+                remaining -= len(body)
+                while remaining > 0:
+                    data = client.recv(min(CHUNK, remaining))
+                    if not data:
+                        return
+                    upstream.sendall(data)
+                    remaining -= len(data)
+
+            sent = 0
+            reset_at = faults["reset_after_bytes"] if action == "reset" else None
+            bytes_per_sec = faults["bandwidth_kbps"] * 1024 / 8
+            while True:
+                if reset_at is not None and sent >= reset_at:
+                    _abort(client)
+                    client = None
+                    return
+                data = upstream.recv(CHUNK if reset_at is None else max(1, min(CHUNK, reset_at - sent)))
+                if not data:
+                    # The response ended before the reset point: the client saw a clean close
+                    outcome = "forward"
+                    return
+                client.sendall(data)
+                sent += len(data)
+                if bytes_per_sec:
+                    time.sleep(len(data) / bytes_per_sec)
+        except OSError:
+            pass
+        finally:
+            if outcome is not None:
+                self._count(outcome)
+            for sock in (client, upstream):
+                if sock is not None:
+                    sock.close()
+
+
+def _read_head(sock):
+    """Read up to the end of the request head; returns (head, bytes already read past it)."""
+    data = b""
+    while b"\r\n\r\n" not in data:
+        chunk = sock.recv(CHUNK)
+        if not chunk:
+            return None, b""
+        data += chunk
+    head, _, rest = data.partition(b"\r\n\r\n")
+    return head + b"\r\n\r\n", rest
+
+
+def _content_length(head):
+    """Request body size from the head; None when the body is chunked."""
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"transfer-encoding" and b"chunked" in value.lower():
+            return None
+        if name.strip().lower() == b"content-length":
+            return int(value.strip())
+    return 0
+
+
+def _upstream_head(head, host):
+    """The request head as the upstream should see it: its own Host, closed after the response."""
+    request_line, *lines = head.split(b"\r\n")[:-2]
+    lines = [line for line in lines if not line.lower().startswith((b"connection:", b"keep-alive:", b"host:"))]
+    return b"\r\n".join([request_line, b"Host: " + host] + lines + [b"Connection: close", b"", b""])
+
+
+def _pipe(source, destination):
+    try:
+        while True:
+            data = source.recv(CHUNK)
+            if not data:
+                break
+            destination.sendall(data)
+    except OSError:
+        pass
+
+
+def _abort(sock):
+    # SO_LINGER with a zero timeout makes close() send RST instead of FIN
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+    sock.close()
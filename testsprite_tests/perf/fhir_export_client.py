@@ -0,0 +1,71 @@
+"""Incremental consumer for the fhir-export function's NDJSON streams.
+
+`iter_export` walks a `$export` manifest and yields one resource at a time,
+following `Link: rel="next"` cursors between pages. Nothing is buffered beyond
+the current line, so memory stays flat however large the export is. If a
+stream breaks mid-page, the page is re-requested from the id of the last
+resource received (the same keyset cursor the server issues), so no resource
+is yielded twice.
+"""
+import json
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import requests
+
+from perf_utils import TIMEOUT
+
+RESUMABLE_ERRORS = (requests.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.Timeout)
+
+
+def _with_cursor(url, cursor):
+    parts = urlparse(url)
+    params = dict(parse_qsl(parts.query))
+    params["cursor"] = cursor
+    return urlunparse(parts._replace(query=urlencode(params)))
+
+
+def iter_ndjson(url, headers, session=None, max_retries=3, stats=None):
+    """Yield resources from one NDJSON stream and all of its `next` pages."""
+    session = session or requests.Session()
+    retries = 0
+    last_id = None
+    while url:
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as resp:
+                resp.raise_for_status()
+                if stats is not None:
+                    stats["pages"] = stats.get("pages", 0) + 1
+                for line in resp.iter_lines(chunk_size=64 * 1024):
+                    if not line:
+                        continue
+                    resource = json.loads(line)
+                    last_id = resource["id"]
+                    if stats is not None:
+                        stats["bytes"] = stats.get("bytes", 0) + len(line) + 1
+                    yield resource
+                url = resp.links.get("next", {}).get("url")
+                retries = 0
+        except RESUMABLE_ERRORS:
+            retries += 1
+            if retries > max_retries:
+                raise
+            if stats is not None:
+                stats["resumes"] = stats.get("resumes", 0) + 1
+            if last_id is not None:
+                url = _with_cursor(url, last_id)
+
+
+def iter_export(export_url, headers, types=None, since=None, session=None, stats=None):
+    """Yield (resource_type, resource) for every output listed by the `$export` manifest."""
+    session = session or requests.Session()
+    params = {}
+    if types:
+        params["_type"] = ",".join(types)
+    if since:
+        params["_since"] = since
+    resp = session.get(export_url, params=params, headers=headers, timeout=TIMEOUT)
+    resp.raise_for_status()
+    manifest = resp.json()
+    for output in manifest["output"]:
+        for resource in iter_ndjson(output["url"], headers, session=session, stats=stats):
+            yield output["type"], resource
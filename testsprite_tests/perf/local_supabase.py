@@ -0,0 +1,82 @@
+"""Service-role REST client for a local Supabase stack (`supabase start`).
+
+The benchmarks in this directory swap the database for `fake_postgrest.py` so
+they can generate load without Postgres, which also means they never run the
+migrations' SQL. The `check_*_sql.py` scripts use this client to call the real
+functions and triggers once against a local database with every migration
+applied (`supabase db reset`):
+
+    db = LocalSupabase()
+    user = db.create_user("someone@bench.test")
+    db.insert("health_metrics", [{"patient_id": user["id"], "tipo": "weight", "valor": 70}])
+    page = db.rpc("fhir_export_page", p_resource_type="Observation", ...)
+    db.delete_user(user["id"])
+"""
+import os
+import uuid
+
+import requests
+
+from perf_utils import TIMEOUT
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL", "http://127.0.0.1:54321")
+# `supabase status` prints the local service_role key
+SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY", "")
+
+
+class RestError(Exception):
+    """A PostgREST or Auth error response; `code` is the SQLSTATE when Postgres raised it."""
+
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+        self.code = body.get("code") if isinstance(body, dict) else None
+        super().__init__(f"{status}: {body}")
+
+
+class LocalSupabase:
+    def __init__(self, url=SUPABASE_URL, service_role_key=SUPABASE_SERVICE_ROLE_KEY):
+        if not service_role_key:
+            raise RuntimeError("SUPABASE_SERVICE_ROLE_KEY is required (see `supabase status`)")
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers.update({
+            "apikey": service_role_key,
+            "Authorization": f"Bearer {service_role_key}",
+            "Content-Type": "application/json",
+        })
+
+    def _call(self, method, path, **kwargs):
+        resp = self.session.request(method, f"{self.url}{path}", timeout=TIMEOUT, **kwargs)
+        body = resp.json() if resp.content else None
+        if resp.status_code >= 400:
+            raise RestError(resp.status_code, body)
+        return body
+
+    def rpc(self, name, **args):
+        return self._call("POST", f"/rest/v1/rpc/{name}", json=args)
+
+    def insert(self, table, rows, upsert=False):
+        prefer = "return=representation" + (",resolution=merge-duplicates" if upsert else "")
+        return self._call("POST", f"/rest/v1/{table}", json=rows, headers={"Prefer": prefer})
+
+    def select(self, table, **filters):
+        """Rows of `table`; filters are PostgREST operators, e.g. id="in.(1,2)"."""
+        return self._call("GET", f"/rest/v1/{table}", params={"select": "*", **filters})
+
+    def update(self, table, values, **filters):
+        return self._call("PATCH", f"/rest/v1/{table}", params=filters, json=values,
+                          headers={"Prefer": "return=representation"})
+
+    def delete(self, table, **filters):
+        return self._call("DELETE", f"/rest/v1/{table}", params=filters)
+
+    def create_user(self, email=None, password="TestPass123!", **metadata):
+        """Confirmed Auth user (the signup trigger creates its profile); returns the Auth user object."""
+        email = email or f"check_{uuid.uuid4().hex}@bench.test"
+        return self._call("POST", "/auth/v1/admin/users", json={
+            "email": email, "password": password, "email_confirm": True, "user_metadata": metadata,
+        })
+
+    def delete_user(self, user_id):
+        self._call("DELETE", f"/auth/v1/admin/users/{user_id}")
@@ -0,0 +1,113 @@
+"""Shared helpers for the testsprite performance scripts in this directory."""
+import os
+import statistics
+import threading
+import time
+
+# Edge functions served by `supabase functions serve` (or the hosted project)
+FUNCTIONS_URL = os.environ.get("FUNCTIONS_URL", "http://localhost:54321/functions/v1")
+ACCESS_TOKEN = os.environ.get("ACCESS_TOKEN", "")
+TIMEOUT = 30
+
+
+def retrying_session(retries=0, backoff=0.0, statuses=(502, 503, 504)):
+    """requests.Session that retries idempotent requests on connection errors, timeouts and `statuses`."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    policy = Retry(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff,
+                   status_forcelist=statuses, raise_on_status=False)
+    adapter = HTTPAdapter(max_retries=policy)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def auth_headers(token=None):
+    headers = {"Content-Type": "application/json", "Accept": "application/json"}
+    token = token or ACCESS_TOKEN
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    return headers
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile; returns 0.0 for an empty sample."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean": statistics.fmean(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+    }
+
+
+def format_summary(label, values, unit="ms"):
+    s = summarize(values)
+    return (
+        f"{label:<24} n={s['count']:<5} mean={s['mean']:.1f}{unit} p50={s['p50']:.1f}{unit} "
+        f"p95={s['p95']:.1f}{unit} p99={s['p99']:.1f}{unit} max={s['max']:.1f}{unit}"
+    )
+
+
+def parse_server_timing(header):
+    """Parse a Server-Timing header into {name: {"dur": float, "desc": str}}."""
+    metrics = {}
+    if not header:
+        return metrics
+    for entry in header.split(","):
+        parts = [p.strip() for p in entry.split(";") if p.strip()]
+        if not parts:
+            continue
+        metric = {"dur": 0.0, "desc": ""}
+        for param in parts[1:]:
+            key, _, value = param.partition("=")
+            value = value.strip().strip('"')
+            if key.strip() == "dur":
+                try:
+                    metric["dur"] = float(value)
+                except ValueError:
+                    pass
+            elif key.strip() == "desc":
+                metric["desc"] = value
+        metrics[parts[0]] = metric
+    return metrics
+
+
+class RssSampler(threading.Thread):
+    """Samples VmRSS of a local process (e.g. `deno run` serving a function) every 100ms."""
+
+    def __init__(self, pid):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def read_kib(self, field):
+        with open(f"/proc/{self.pid}/status") as status:
+            for line in status:
+                if line.startswith(field):
+                    return int(line.split()[1])
+        return 0
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.samples.append(self.read_kib("VmRSS:"))
+            time.sleep(0.1)
+
+    def report(self):
+        if not self.samples:
+            return "function RSS: no samples"
+        return (f"function RSS: start={self.samples[0] / 1024:.1f}MiB peak={max(self.samples) / 1024:.1f}MiB "
+                f"high-water={self.read_kib('VmHWM:') / 1024:.1f}MiB")